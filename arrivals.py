@@ -0,0 +1,105 @@
+import sys
+import time
+import numpy as np
+
+
+## ARRIVAL PROFILE ##
+# The arrival rate can follow the hour of the day and the day of the week: a piecewise-constant rate over a week
+# (simulated time 0 is Monday 00:00), normalized so arrivalRate stays the mean time between arrivals over the week.
+HOUR = 60
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+
+class ArrivalProfile():
+      """ Weekly piecewise-constant arrival rate: one rate per hour of the week, the product of the hour-of-day and
+      day-of-week weights. Arrival times are found by inversion: a cumulative rate (unit-rate Poisson time) maps
+      to the time at which the integral of the rate reaches it, through a table of the integral at every hour """
+      def __init__(self,
+                   meanInterArrival: float,
+                   hourOfDay: list = None,
+                   dayOfWeek: list = None
+                   ):
+            hourOfDay = np.ones(24) if hourOfDay is None else np.asarray(hourOfDay, dtype=float)
+            dayOfWeek = np.ones(7) if dayOfWeek is None else np.asarray(dayOfWeek, dtype=float)
+            if hourOfDay.shape != (24,) or dayOfWeek.shape != (7,):
+                  raise ValueError("An arrival profile takes 24 hour-of-day and 7 day-of-week weights")
+            if (hourOfDay < 0).any() or (dayOfWeek < 0).any() or not hourOfDay.any() or not dayOfWeek.any():
+                  raise ValueError("Arrival profile weights must be non-negative and not all 0")
+            weights = (dayOfWeek[:, None] * hourOfDay[None, :]).ravel()
+            self.rates = weights / weights.mean() / meanInterArrival # arrivals per minute, hour by hour
+            with np.errstate(divide="ignore"):
+                  self.inverseRates = 1 / self.rates
+            self.starts = np.arange(len(self.rates)) * HOUR
+            self.cumulative = np.concatenate([[0], np.cumsum(self.rates * HOUR)]) # integral of the rate up to each hour
+            self.perWeek = self.cumulative[-1]
+            return None
+
+      @classmethod
+      def fromVariables(cls, variables: dict):
+            """ Profile of the ARRIVAL section, or None when the rate is constant """
+            arrival = variables["ARRIVAL"]
+            if arrival["hourOfDayProfile"] is None and arrival["dayOfWeekProfile"] is None:
+                  return None
+            return cls(arrival["arrivalRate"], arrival["hourOfDayProfile"], arrival["dayOfWeekProfile"])
+
+      def times(self, cumulativeRates: np.ndarray) -> np.ndarray:
+            """ Times at which the integral of the rate reaches each of the (non-decreasing) cumulativeRates """
+            times = np.floor(cumulativeRates / self.perWeek)
+            remainder = cumulativeRates - times * self.perWeek
+            # side="right" skips the hours without arrivals (they add nothing to the integral)
+            hours = np.searchsorted(self.cumulative, remainder, side="right")
+            hours -= 1
+            np.clip(hours, 0, len(self.rates) - 1, out=hours)
+            # In place: a few million arrivals take a few tens of milliseconds
+            remainder -= self.cumulative[hours]
+            remainder *= self.inverseRates[hours]
+            times *= WEEK
+            times += self.starts[hours]
+            times += remainder
+            return times
+
+
+class ProfileInterArrivals():
+      """ Draw function (size -> inter-arrival times) of a non-homogeneous Poisson arrival process: a block of unit
+      exponentials is cumulated into cumulative rates, turned into arrival times by the profile in one vectorized
+      pass and differenced. One exponential per arrival, as with a constant rate, and the same times however
+      the arrivals are split into blocks """
+      def __init__(self,
+                   profile: ArrivalProfile,
+                   stream: np.random.Generator
+                   ):
+            self.profile = profile
+            self.stream = stream
+            self.cumulativeRate = 0.0
+            self.time = 0.0
+            return None
+
+      def __call__(self, size: int) -> np.ndarray:
+            cumulativeRates = np.cumsum(np.concatenate([[self.cumulativeRate], self.stream.standard_exponential(size)]))[1:]
+            times = self.profile.times(cumulativeRates)
+            interArrivals = np.diff(times, prepend=self.time)
+            self.cumulativeRate, self.time = cumulativeRates[-1], times[-1]
+            return interArrivals
+
+
+def interArrivalTimes(interArrivalMean: float, profile: ArrivalProfile, stream: np.random.Generator):
+      """ Draw function (size -> inter-arrival times) of the arrival stream: exponential with mean interArrivalMean, or
+      following the hour-of-day and day-of-week profile (None when the rate is constant) """
+      if profile is None:
+            return lambda size: interArrivalMean * stream.standard_exponential(size)
+      return ProfileInterArrivals(profile, stream)
+
+
+if __name__ == "__main__":
+      # python arrivals.py 5000000: time to build that many arrivals with the profile of paramters.yaml
+      from parameters import loadVariables
+      variables = loadVariables()
+      arrivals = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+      draw = interArrivalTimes(variables["ARRIVAL"]["arrivalRate"], ArrivalProfile.fromVariables(variables), np.random.default_rng(variables["GENERAL_SETTINGS"]["seed"]))
+      start = time.perf_counter()
+      times = np.cumsum(draw(arrivals))
+      elapsed = time.perf_counter() - start
+      print(f"{arrivals} arrivals in {elapsed * 1000:.0f} ms, up to day {times[-1] / DAY:.1f}")
+      weekly = np.bincount((times % WEEK // HOUR).astype(np.intp), minlength=WEEK // HOUR) / (times[-1] / WEEK)
+      print("arrivals per hour by day:", np.round(weekly.reshape(7, 24).sum(axis=1) / 24, 1))
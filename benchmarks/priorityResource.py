@@ -0,0 +1,71 @@
+""" Cost of a request on sim.PriorityResource vs HeapPriorityResource as the queue grows.
+
+Run from the repository root: python -m benchmarks.priorityResource
+"""
+import time
+import numpy as np
+import simpy as sim
+
+from resources import HeapPriorityResource
+
+
+QUEUE_LENGTHS = (100, 1000, 5000, 20000)
+REQUESTS = 2000
+
+
+def patient(env, resource, priority):
+      with resource.request(priority=priority) as request:
+            yield request
+            yield env.timeout(1)
+
+
+def arrivals(env, resource, rng):
+      """ One arrival per service time, so the queue keeps the length it started with """
+      while True:
+            yield env.timeout(1)
+            env.process(patient(env, resource, int(rng.integers(1, 5))))
+
+
+def costPerRequest(resourceType, queueLength: int, requests: int = REQUESTS) -> float:
+      """ Seconds per request (arrival, service and release) with queueLength patients waiting on a single server """
+      rng = np.random.default_rng(0)
+      env = sim.Environment()
+      resource = resourceType(env, capacity=1)
+      for _ in range(queueLength + 1):
+            env.process(patient(env, resource, int(rng.integers(1, 5))))
+      env.process(arrivals(env, resource, rng))
+      env.run(until=1) # requests of the initial queue are in place
+      start = time.perf_counter()
+      env.run(until=1 + requests)
+      return (time.perf_counter() - start) / requests
+
+
+def sameOrder(queueLength: int = 2000) -> bool:
+      """ Whether both resources serve the same patients in the same order """
+      orders = []
+      for resourceType in (sim.PriorityResource, HeapPriorityResource):
+            rng = np.random.default_rng(1)
+            env = sim.Environment()
+            resource = resourceType(env, capacity=2)
+            served = []
+
+            def tracked(env, identifier, priority):
+                  with resource.request(priority=priority) as request:
+                        yield request
+                        served.append(identifier)
+                        yield env.timeout(float(rng.exponential()))
+
+            for identifier in range(queueLength):
+                  env.process(tracked(env, identifier, int(rng.integers(1, 5))))
+            env.run()
+            orders.append(served)
+      return orders[0] == orders[1]
+
+
+if __name__ == "__main__":
+      print(f"Same service order: {sameOrder()}")
+      print(f"{'waiting':>8} {'PriorityResource (us/request)':>30} {'HeapPriorityResource (us/request)':>34}")
+      for queueLength in QUEUE_LENGTHS:
+            sortedCost = costPerRequest(sim.PriorityResource, queueLength)
+            heapCost = costPerRequest(HeapPriorityResource, queueLength)
+            print(f"{queueLength:>8} {sortedCost * 1e6:>30.1f} {heapCost * 1e6:>34.1f}")
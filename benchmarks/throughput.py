@@ -0,0 +1,211 @@
+""" Throughput, scaling and memory of the simulation: patients and events per second, time per replication and peak
+memory of Simulation.__setUp__ from 1e3 to 1e6 patients, light to overloaded staffing and every engine, and of
+Simulation.start run serially and in parallel. Results go to a JSON file so commits can be compared.
+
+Run from the repository root:
+      python -m benchmarks.throughput [quick|full] [output.json]
+      python -m benchmarks.throughput compare base.json new.json [tolerance]
+
+compare exits with status 1 when a case takes more than tolerance (default 0.1, i.e. 10%) longer per replication
+than in base. Every case runs in a fresh interpreter, so its peak memory (maximum resident set size) is its own.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import subprocess
+import tempfile
+import numpy as np
+import simpy as sim
+
+from parameters import loadVariables
+
+
+# Capacities of the staffing configurations (default is the one in paramters.yaml)
+STAFFING = {
+      "light": {"receptionist": 3, "nurse": 6, "doctor": 9}, # utilization around 0.5
+      "default": {},
+      "overloaded": {"receptionist": 2, "nurse": 2, "doctor": 4} # doctor queue grows for the whole run
+}
+ENGINES = ("simpy", "fast")
+SUITES = {
+      # sizes at default staffing, staffing at stressSize, start() at startPatients x startRuns
+      "quick": {"sizes": (1_000, 10_000), "stressSize": 10_000, "startPatients": 10_000, "startRuns": 8},
+      "full": {"sizes": (1_000, 10_000, 100_000, 1_000_000), "stressSize": 100_000, "startPatients": 10_000, "startRuns": 32}
+}
+# Replications timed per __setUp__ case: the median is reported, so small cases get a few
+PATIENTS_PER_CASE = 50_000
+MAX_REPLICATIONS = 5
+
+
+def cases(suite: str) -> list:
+      """ Cases of a suite: replication cases time Simulation.__setUp__, start cases time Simulation.start """
+      settings = SUITES[suite]
+      cases = []
+      for totalPatients in settings["sizes"]:
+            for engine in ENGINES:
+                  cases.append({"kind": "replication", "engine": engine, "totalPatients": totalPatients, "staffing": "default"})
+      for staffing in ("light", "overloaded"):
+            for engine in ("simpy", "fast"):
+                  cases.append({"kind": "replication", "engine": engine, "totalPatients": settings["stressSize"], "staffing": staffing})
+      # Parallel takes every core, and at least two workers so the process pool is measured on one core too
+      for engine in ENGINES:
+            for workers in (1, max(2, os.cpu_count())):
+                  cases.append({"kind": "start", "engine": engine, "totalPatients": settings["startPatients"], "staffing": "default",
+                                "numberOfRuns": settings["startRuns"], "workers": workers})
+      for case in cases:
+            case["name"] = caseName(case)
+      return cases
+
+
+def caseName(case: dict) -> str:
+      if case["kind"] == "start":
+            return f"start-{case['engine']}-{case['totalPatients']}x{case['numberOfRuns']}-workers{case['workers']}"
+      return f"replication-{case['engine']}-{case['totalPatients']}-{case['staffing']}"
+
+
+def caseVariables(case: dict, outputDirectory: str) -> dict:
+      """ paramters.yaml with the engine, size and staffing of case, and nothing that is not simulation (output,
+      tracing, caching, journeys, level samples, warm-up detection) """
+      variables = loadVariables()
+      variables["GENERAL_SETTINGS"].update({
+            "engine": case["engine"],
+            "totalPatients": case["totalPatients"],
+            "numberOfRuns": case.get("numberOfRuns", 1),
+            "csvFilePath": os.path.join(outputDirectory, "results.csv"),
+            "resultsFormat": "csv",
+            "adaptiveRuns": False,
+            "warmUpDetection": "fixed",
+            "warmStartRuns": 0,
+            "horizon": None,
+            "cache": False,
+            "verbosity": "silent",
+            "journeyLog": False,
+            "levelSampleInterval": None
+      })
+      variables["RESOURCES_CAPACITY"].update(STAFFING[case["staffing"]])
+      return variables
+
+
+def eventsPerPatient(metricsValues: dict) -> float:
+      """ Events per patient after the warm-up: the arrival, and the start and end of every service """
+      patients = metricsValues["general_totalPatients"]
+      if patients == 0:
+            return 0.0
+      services = patients - metricsValues["count_totalPatientsDeclinedAccess"] + metricsValues["nurse_totalPatients"] + metricsValues["doctor_totalPatients"]
+      return (patients + 2 * services) / patients
+
+
+def peakMemoryMegabytes() -> float:
+      """ Largest resident set size of this process and of its finished children """
+      peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+      return peak / 2**20 if sys.platform == "darwin" else peak / 2**10 # bytes on macOS, kilobytes elsewhere
+
+
+def runCase(case: dict) -> dict:
+      """ Times case in this process. Patients and events per second count the warm-up too: events are the
+      events per patient after the warm-up times totalPatients """
+      from simulation import Simulation
+
+      with tempfile.TemporaryDirectory() as outputDirectory:
+            variables = caseVariables(case, outputDirectory)
+            if case["kind"] == "start":
+                  start = time.perf_counter()
+                  Simulation(variables).start(workers=case["workers"])
+                  seconds = [time.perf_counter() - start]
+                  replications, perPatient = case["numberOfRuns"], None
+            else:
+                  replications = max(1, min(MAX_REPLICATIONS, PATIENTS_PER_CASE // case["totalPatients"]))
+                  seconds, perPatient = [], []
+                  for replication in range(replications):
+                        simulation = Simulation(variables)
+                        start = time.perf_counter()
+                        simulation.__setUp__(replication)
+                        seconds.append(time.perf_counter() - start)
+                        perPatient.append(eventsPerPatient(simulation.metricsValues))
+                  perPatient = float(np.mean(perPatient))
+
+      # start() runs every replication in one timing, the __setUp__ cases take the median replication
+      secondsPerReplication = seconds[0] / replications if case["kind"] == "start" else float(np.median(seconds))
+      return {
+            **case,
+            "replications": replications,
+            "seconds": seconds,
+            "secondsPerReplication": secondsPerReplication,
+            "patientsPerSecond": case["totalPatients"] / secondsPerReplication,
+            "eventsPerSecond": None if perPatient is None else perPatient * case["totalPatients"] / secondsPerReplication,
+            "peakMemoryMegabytes": peakMemoryMegabytes()
+      }
+
+
+def runSuite(suite: str) -> dict:
+      """ Runs every case of suite in its own interpreter and returns the results with the commit and machine """
+      results = []
+      print(f"{'case':<48} {'s/replication':>14} {'patients/s':>12} {'events/s':>12} {'peak MB':>9}")
+      for case in cases(suite):
+            completed = subprocess.run([sys.executable, "-m", "benchmarks.throughput", "case", json.dumps(case)],
+                                       capture_output=True, text=True, check=True)
+            result = json.loads(completed.stdout.splitlines()[-1])
+            events = "-" if result["eventsPerSecond"] is None else f"{result['eventsPerSecond']:.0f}"
+            print(f"{result['name']:<48} {result['secondsPerReplication']:>14.4f} {result['patientsPerSecond']:>12.0f} {events:>12} {result['peakMemoryMegabytes']:>9.1f}")
+            results.append(result)
+      return {
+            "suite": suite,
+            "commit": gitDescription(),
+            "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "machine": {
+                  "platform": platform.platform(),
+                  "processor": platform.processor(),
+                  "cpuCount": os.cpu_count(),
+                  "python": platform.python_version(),
+                  "numpy": np.__version__,
+                  "simpy": sim.__version__
+            },
+            "cases": results
+      }
+
+
+def gitDescription() -> str:
+      """ Commit of the working tree (with -dirty when it has uncommitted changes), or unknown outside git """
+      try:
+            return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True).stdout.strip()
+      except (OSError, subprocess.CalledProcessError):
+            return "unknown"
+
+
+def compare(basePath: str, newPath: str, tolerance: float = 0.1) -> bool:
+      """ Prints the time and memory ratios (new / base) of the cases in both files and returns whether none of them
+      takes more than tolerance longer per replication """
+      base, new = (json.load(open(path)) for path in (basePath, newPath))
+      baseCases = {case["name"]: case for case in base["cases"]}
+      print(f"{base['commit']} -> {new['commit']}")
+      print(f"{'case':<48} {'time':>8} {'memory':>8}")
+      regressions = []
+      for case in new["cases"]:
+            if case["name"] not in baseCases:
+                  continue
+            timeRatio = case["secondsPerReplication"] / baseCases[case["name"]]["secondsPerReplication"]
+            memoryRatio = case["peakMemoryMegabytes"] / baseCases[case["name"]]["peakMemoryMegabytes"]
+            flag = " slower" if timeRatio > 1 + tolerance else ""
+            print(f"{case['name']:<48} {timeRatio:>8.2f} {memoryRatio:>8.2f}{flag}")
+            if flag:
+                  regressions.append(case["name"])
+      if regressions:
+            print(f"{len(regressions)} case(s) more than {tolerance:.0%} slower")
+      return not regressions
+
+
+if __name__ == "__main__":
+      match (sys.argv[1] if len(sys.argv) > 1 else "quick"):
+            case "case":
+                  print(json.dumps(runCase(json.loads(sys.argv[2]))))
+            case "compare":
+                  sys.exit(0 if compare(sys.argv[2], sys.argv[3], float(sys.argv[4]) if len(sys.argv) > 4 else 0.1) else 1)
+            case suite:
+                  results = runSuite(suite)
+                  outputPath = sys.argv[2] if len(sys.argv) > 2 else f"other/benchmark_{suite}_{results['commit']}.json"
+                  with open(outputPath, "w") as file:
+                        json.dump(results, file, indent=2)
+                  print(f"Results written to {outputPath}")
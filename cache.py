@@ -0,0 +1,121 @@
+import os
+import sys
+import json
+import hashlib
+
+from parameters import loadVariables
+
+
+# Bump whenever a change to the model alters the results of a replication, so older entries are not reused
+ENGINE_VERSION = 4
+
+# GENERAL_SETTINGS entries that change the results of a replication (all engines give the same results)
+RESULT_SETTINGS = ("warmUpPeriod", "totalPatients", "seed", "commonRandomNumbers", "warmStartRuns")
+
+
+class ResultCache():
+      """ On-disk cache of replication metrics, content-addressed by a hash of the effective variables,
+      the replication (its seed) and ENGINE_VERSION. One JSON file per entry; file modification times
+      track use, and the least recently used entries are evicted past maxMegabytes.
+      """
+      def __init__(self,
+                   directory: str,
+                   maxMegabytes: float
+                   ):
+            self.directory = directory
+            self.maxBytes = maxMegabytes * 2**20
+            return None
+
+      @classmethod
+      def fromVariables(cls, variables: dict):
+            """ Cache configured in GENERAL_SETTINGS, or None when it is disabled (or when journeys are logged, levels
+            sampled or replications profiled, which takes running every replication) """
+            settings = variables["GENERAL_SETTINGS"]
+            if (not settings["cache"] or settings["journeyLog"] or settings["levelSampleInterval"] is not None
+                        or settings["profiling"] is not None):
+                  return None
+            return cls(settings["cacheDirectory"], settings["cacheMaxMegabytes"])
+
+      @staticmethod
+      def scenarioKey(variables: dict) -> str:
+            """ Stable hash of everything in variables that changes the results """
+            effective = {section: values for section, values in variables.items() if section != "GENERAL_SETTINGS"}
+            effective["GENERAL_SETTINGS"] = {setting: variables["GENERAL_SETTINGS"][setting] for setting in RESULT_SETTINGS}
+            effective["ENGINE_VERSION"] = ENGINE_VERSION
+            return hashlib.sha256(json.dumps(effective, sort_keys=True).encode()).hexdigest()
+
+      def __path__(self, scenarioKey: str, replication: int) -> str:
+            key = hashlib.sha256(f"{scenarioKey}:{replication}".encode()).hexdigest()
+            return os.path.join(self.directory, key[:2], f"{key}.json")
+
+      def get(self, scenarioKey: str, replication: int):
+            """ Cached metrics of a replication, or None """
+            path = self.__path__(scenarioKey, replication)
+            try:
+                  with open(path) as file:
+                        metrics = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                  return None
+            os.utime(path) # most recently used
+            return metrics
+
+      def put(self, scenarioKey: str, replication: int, metrics: dict):
+            path = self.__path__(scenarioKey, replication)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and moved into place, so concurrent workers never read half an entry
+            temporaryPath = f"{path}.{os.getpid()}.tmp"
+            with open(temporaryPath, "w") as file:
+                  json.dump(metrics, file)
+            os.replace(temporaryPath, path)
+
+      def __entries__(self) -> list:
+            """ (modification time, size, path) of every entry """
+            entries = []
+            for root, _, files in os.walk(self.directory):
+                  for name in files:
+                        if name.endswith(".json"):
+                              path = os.path.join(root, name)
+                              status = os.stat(path)
+                              entries.append((status.st_mtime, status.st_size, path))
+            return entries
+
+      def evict(self) -> int:
+            """ Removes the least recently used entries until the cache fits in maxMegabytes; returns how many """
+            entries = sorted(self.__entries__())
+            size = sum(entry[1] for entry in entries)
+            evicted = 0
+            for _, entrySize, path in entries:
+                  if size <= self.maxBytes:
+                        break
+                  os.remove(path)
+                  size -= entrySize
+                  evicted += 1
+            return evicted
+
+      def clear(self) -> int:
+            """ Invalidates the whole cache; returns how many entries were removed """
+            entries = self.__entries__()
+            for _, _, path in entries:
+                  os.remove(path)
+            return len(entries)
+
+      def stats(self) -> dict:
+            entries = self.__entries__()
+            return {"entries": len(entries), "megabytes": sum(entry[1] for entry in entries) / 2**20, "maxMegabytes": self.maxBytes / 2**20}
+
+
+if __name__ == "__main__":
+      # python cache.py [stats | evict | clear] [--file=paramters.yaml]
+      arguments = [argument for argument in sys.argv[1:] if not argument.startswith("--file=")]
+      variables = loadVariables(next((argument.split("=", 1)[1] for argument in sys.argv[1:] if argument.startswith("--file=")), "paramters.yaml"))
+      settings = variables["GENERAL_SETTINGS"]
+      cache = ResultCache(settings["cacheDirectory"], settings["cacheMaxMegabytes"])
+      match (arguments[0] if arguments else "stats"):
+            case "stats":
+                  print(cache.stats())
+            case "evict":
+                  print(f"Evicted {cache.evict()} entries")
+            case "clear":
+                  print(f"Removed {cache.clear()} entries")
+            case command:
+                  raise ValueError(f"Unknown cache command: {command} (stats | evict | clear)")
@@ -0,0 +1,61 @@
+import math
+from statistics import NormalDist
+
+
+def tQuantile(probability: float, degreesOfFreedom: int) -> float:
+      """ Quantile of Student's t distribution: exact for 1 and 2 degrees of freedom, Cornish-Fisher expansion
+      around the normal quantile otherwise (relative error below 1% from 3 degrees of freedom on) """
+      p, n = probability, degreesOfFreedom
+      if n == 1:
+            return math.tan(math.pi * (p - 0.5))
+      if n == 2:
+            return (2*p - 1) / math.sqrt(2*p * (1 - p))
+      z = NormalDist().inv_cdf(p)
+      return (z
+              + (z**3 + z) / (4*n)
+              + (5*z**5 + 16*z**3 + 3*z) / (96*n**2)
+              + (3*z**7 + 19*z**5 + 17*z**3 - 15*z) / (384*n**3)
+              + (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z) / (92160*n**4))
+
+
+class RunningStatistics():
+      """ Streaming mean and variance of a metric across replications (Welford's algorithm). Replications where the
+      metric is undefined (NaN, e.g. a tail quantile of a class no patient reached) are only counted, as missing """
+      def __init__(self):
+            self.count = 0
+            self.missing = 0
+            self.mean = math.nan # until a value is counted
+            self.squares = 0.0 # sum of squared deviations from the mean
+            return None
+
+      def update(self, value: float):
+            if math.isnan(value):
+                  self.missing += 1
+                  return
+            self.count += 1
+            if self.count == 1:
+                  self.mean = value
+                  return
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.squares += delta * (value - self.mean)
+
+      def variance(self) -> float:
+            """ Sample variance """
+            return self.squares / (self.count - 1) if self.count > 1 else math.nan
+
+      def std(self) -> float:
+            return math.sqrt(self.variance())
+
+      def halfWidth(self, confidence: float) -> float:
+            """ Half-width of the t confidence interval of the mean """
+            if self.count < 2:
+                  return math.inf
+            return tQuantile(0.5 + confidence/2, self.count - 1) * self.std() / math.sqrt(self.count)
+
+      def relativeHalfWidth(self, confidence: float) -> float:
+            """ Half-width relative to the mean (0 for a metric that is always 0) """
+            halfWidth = self.halfWidth(confidence)
+            if self.mean == 0:
+                  return 0.0 if halfWidth == 0 else math.inf
+            return halfWidth / abs(self.mean)
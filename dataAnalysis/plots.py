@@ -3,14 +3,36 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 
-def load_data(file_path='other/results.csv'):
-    """Load simulation results from CSV file"""
-    return pd.read_csv(file_path)
+from results import readResults
 
-def create_plots():
+# Columns read by each plot
+PLOT_COLUMNS = {
+    'patient_distribution': ['proportion_CriticalPatients', 'proportion_UrgentPatients', 'proportion_ModeratePatients', 'proportion_LowPatients',
+                             'proportion_NonUrgentPatients', 'proportion_totalPatientsDeclinedAccess', 'general_totalPatients'],
+    'financial_metrics': ['financials_revenue_total', 'financials_expenses_total', 'financials_profit_total'],
+    'staff_patient_distribution': ['proportion_CriticalPatients', 'proportion_UrgentPatients', 'proportion_ModeratePatients', 'proportion_LowPatients',
+                                   'proportion_NonUrgentPatients', 'nurse_proportion_moderatePatients', 'nurse_proportion_lowPatients'],
+    'service_time': ['reception_serviceTime_duration_total', 'reception_waitingInQueue_duration_total', 'arrival_waitingTime_total'],
+    'queue_service_time_per_staff': ['doctor_waitingInQueue_duration_critical_average', 'doctor_waitingInQueue_duration_urgent_average',
+                                     'doctor_waitingInQueue_duration_moderate_average', 'doctor_waitingInQueue_duration_low_average',
+                                     'nurse_waitingInQueue_duration_moderate_average', 'nurse_waitingInQueue_duration_low_average',
+                                     'reception_waitingInQueue_duration_average', 'proportion_CriticalPatients', 'proportion_UrgentPatients',
+                                     'proportion_ModeratePatients', 'proportion_LowPatients', 'nurse_proportion_moderatePatients',
+                                     'nurse_proportion_lowPatients', 'doctor_serviceTime_duration_critical_average',
+                                     'doctor_serviceTime_duration_urgent_average', 'doctor_serviceTime_duration_moderate_average',
+                                     'doctor_serviceTime_duration_low_average', 'nurse_serviceTime_duration_moderate_average',
+                                     'nurse_serviceTime_duration_low_average', 'reception_serviceTime_duration_average'],
+}
+
+def load_data(file_path='other/results.csv', columns=None):
+    """Load simulation results (only the given columns, all by default) from a CSV file, or from a Parquet or
+    Arrow IPC file or directory partitioned by scenario (resultsFormat), with results.readResults"""
+    return pd.DataFrame(readResults(file_path, columns))
+
+def create_plots(file_path='other/results.csv'):
     """Create and save multiple plots from simulation data"""
-    # Load the data
-    df = load_data()
+    # Load only the columns the plots use
+    df = load_data(file_path, sorted(set().union(*PLOT_COLUMNS.values())))
     
     # Set the style for all plots
     sns.set_style("whitegrid")
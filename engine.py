@@ -0,0 +1,354 @@
+import copy
+from array import array
+from bisect import bisect_right
+from math import inf
+from collections import deque
+from heapq import heappush, heappop
+
+from utilities import CRITICAL, URGENT, NON_URGENT
+from metrics import (PRIORITY_SLOTS, TOTAL_TIME, TOTAL_PATIENTS, DECLINED, ARRIVAL_TIME, RECEPTION_SERVICE, RECEPTION_WAITING,
+                     NURSE_TOTAL, DOCTOR_TOTAL, REVENUE, ENTER_COUNT, EXIT_COUNT, ENTER_BY_PRIORITY, EXIT_BY_PRIORITY, COUNT, NURSE_PATIENTS, NURSE_SERVICE,
+                     NURSE_WAITING, NURSE_REVALUATIONS, DOCTOR_PATIENTS, DOCTOR_SERVICE, DOCTOR_WAITING, DOCTOR_ENTER,
+                     SKETCH_BINS, RECEPTION_WAITING_SKETCH, RECEPTION_SERVICE_SKETCH, NURSE_WAITING_SKETCH, NURSE_SERVICE_SKETCH,
+                     DOCTOR_WAITING_SKETCH, DOCTOR_SERVICE_SKETCH, LENGTH_OF_STAY_SKETCH, SKETCH_COUNT, sketchNumber, addToSketches)
+from samplers import Samplers
+from parameters import ModelParameters
+from journeys import Journey, JourneyLog, DECLINED_ACCESS, LEFT_AFTER_RECEPTION, LEFT_AFTER_NURSE, DISCHARGED, ADMITTED
+from levels import LevelSeries
+
+
+# Event kinds of the calendar
+GENERATE, RECEPTION_END, NURSE_END, DOCTOR_END = range(4)
+# Arrivals between two binnings of the quantile sketch values (bounds the memory they take)
+SKETCH_FLUSH = 4096
+# Patient fields (patients are plain lists; JOURNEY is None unless journeys are logged)
+ID, PRIORITY, REQUEST_TIME, SERVICE_START, ARRIVED, JOURNEY = range(6)
+
+
+class HeapEngine():
+      """ Simulates the reception (FCFS) -> nurse (priority) -> doctor (priority) network directly on a heapq
+      event calendar of (time, sequence, kind, payload) tuples, without SimPy processes or events.
+
+      It mirrors the SimPy model of Simulation step by step (same streams, same order of draws per stream,
+      same warm-up reset) and records into the simulation's accumulators, so both engines give the same
+      metricsValues/metrics. Priority queues are heaps of (priority, request time, sequence, patient),
+      which is the FIFO-within-priority order of sim.PriorityResource.
+
+      With a JourneyLog, the journey of every patient is filled in at the end of each stage and recorded
+      when the patient leaves. With a LevelSeries, the queue lengths and servers in use are sampled as the
+      clock goes past each sampling time.
+      """
+      def __init__(self,
+                   parameters: ModelParameters,
+                   accumulators,
+                   samplers: Samplers,
+                   journeys: JourneyLog = None,
+                   levelSeries: LevelSeries = None
+                   ):
+            self.accumulators = accumulators
+            self.samplers = samplers
+            self.journeys = journeys
+            self.levelSeries = levelSeries
+            self.totalPatients = parameters.totalPatients
+            self.waitingRoomCapacity = parameters.waitingRoomCapacity
+            self.generalFee = parameters.generalFee
+            self.enterHospitalFee = parameters.enterHospitalFee
+
+            # Calendar and resources
+            self.now = 0
+            self.sequence = 0
+            self.calendar = []
+            self.receptionists = parameters.receptionists
+            self.nurses = parameters.nurses
+            self.doctors = parameters.doctors
+            self.receptionFree = parameters.receptionists
+            self.receptionQueue = deque()
+            self.nurseFree = self.nurses
+            self.nurseQueue = []
+            self.doctorFree = self.doctors
+            self.doctorQueue = []
+            self.currentReceptionWaitingRoomCapacity = 0
+            self.generatedPatients = 0
+            self.sketchValues = [array("d") for _ in range(SKETCH_COUNT)] # values not binned yet, one array per sketch
+            self.schedule(0, GENERATE, None)
+            return None
+
+      def schedule(self, time: float, kind: int, payload):
+            self.sequence += 1
+            heappush(self.calendar, (time, self.sequence, kind, payload))
+
+      def snapshot(self):
+            """ Picklable copy of the engine state (calendar with the pending arrival and service ends, queues,
+            patients in service, counters and accumulators), without the samplers, the journey log and the level samples """
+            state = copy.copy(self)
+            state.samplers = None
+            state.journeys = None
+            state.levelSeries = None
+            state.sketchValues = [array("d") for _ in range(SKETCH_COUNT)]
+            state.accumulators = array("d", self.accumulators)
+            # Deep-copied together, so patients keep being shared between the calendar and the queues
+            state.calendar, state.receptionQueue, state.nurseQueue, state.doctorQueue = copy.deepcopy(
+                  (self.calendar, self.receptionQueue, self.nurseQueue, self.doctorQueue))
+            return state
+
+      def fork(self, accumulators, samplers: Samplers, journeys: JourneyLog = None, levelSeries: LevelSeries = None):
+            """ Engine that continues from this snapshot, recording into accumulators (which get the snapshot
+            values) and drawing from samplers. Only the journeys of the patients arriving after the fork are logged,
+            and the levels are sampled from the fork on """
+            engine = self.snapshot()
+            accumulators[:] = engine.accumulators
+            engine.accumulators = accumulators
+            engine.samplers = samplers
+            engine.journeys = journeys
+            engine.levelSeries = levelSeries
+            if levelSeries is not None:
+                  levelSeries.startAfter(engine.now)
+            return engine
+
+      def patientsInSystem(self) -> int:
+            """ Patients in the reception waiting room, waiting for or with a nurse or a doctor """
+            return (self.currentReceptionWaitingRoomCapacity + len(self.nurseQueue) + self.nurses - self.nurseFree
+                    + len(self.doctorQueue) + self.doctors - self.doctorFree)
+
+      def carryOver(self, now: float) -> tuple:
+            """ Time the patients waiting and in service have spent so far at the reception, the nurse and the doctor
+            (queue, service for each; see metrics.resetWarmUpMetrics) """
+            inService = {RECEPTION_END: 0, NURSE_END: 0, DOCTOR_END: 0}
+            for _, _, kind, patient in self.calendar:
+                  if kind != GENERATE:
+                        inService[kind] += now - patient[SERVICE_START]
+            return (sum(now - patient[REQUEST_TIME] for patient in self.receptionQueue), inService[RECEPTION_END],
+                    sum(now - entry[3][REQUEST_TIME] for entry in self.nurseQueue), inService[NURSE_END],
+                    sum(now - entry[3][REQUEST_TIME] for entry in self.doctorQueue), inService[DOCTOR_END])
+
+      def run(self, until: float = inf) -> float:
+            """ Runs the events before until (all of them by default) and returns the time of the last one.
+
+            The whole network is handled inline in one loop over local variables (a method call or an
+            attribute lookup per step is a large share of the cost of an event), and the engine state is
+            stored back on the instance when the loop ends.
+            """
+            accumulators = self.accumulators
+            samplers = self.samplers
+            interArrivalTime = samplers.interArrivalTime
+            receptionServiceTime = samplers.receptionServiceTime
+            receptionPriority = samplers.receptionPriority
+            nurseService, nurseServiceMean = samplers.nurseService.next, samplers.nurseServiceMean
+            nurseUniform, nurseTables = samplers.nurseUniforms.next, samplers.nurseTables
+            doctorService, doctorServiceMean = samplers.doctorService.next, samplers.doctorServiceMean
+            doctorUniform, doctorEnterProbability = samplers.doctorUniforms.next, samplers.doctorEnterProbability
+            totalPatients = self.totalPatients
+            waitingRoomCapacity = self.waitingRoomCapacity
+            generalFee = self.generalFee
+            enterHospitalFee = self.enterHospitalFee
+            journeys = self.journeys
+            # Values for the quantile sketches are collected as they come and binned in bulk (see addToSketches)
+            sketchValues = self.sketchValues
+            receptionWaitingSketch = sketchValues[sketchNumber(RECEPTION_WAITING_SKETCH)].append
+            receptionServiceSketch = sketchValues[sketchNumber(RECEPTION_SERVICE_SKETCH)].append
+            nurseWaitingSketches = [values.append for values in sketchValues[sketchNumber(NURSE_WAITING_SKETCH):][:PRIORITY_SLOTS]]
+            nurseServiceSketches = [values.append for values in sketchValues[sketchNumber(NURSE_SERVICE_SKETCH):][:PRIORITY_SLOTS]]
+            doctorWaitingSketches = [values.append for values in sketchValues[sketchNumber(DOCTOR_WAITING_SKETCH):][:PRIORITY_SLOTS]]
+            doctorServiceSketches = [values.append for values in sketchValues[sketchNumber(DOCTOR_SERVICE_SKETCH):][:PRIORITY_SLOTS]]
+            lengthOfStaySketch = sketchValues[sketchNumber(LENGTH_OF_STAY_SKETCH)].append
+            levelSeries = self.levelSeries
+            nextSample = levelSeries.nextTime if levelSeries is not None else inf
+            receptionists, nurses, doctors = self.receptionists, self.nurses, self.doctors
+
+            calendar = self.calendar
+            receptionQueue = self.receptionQueue
+            nurseQueue = self.nurseQueue
+            doctorQueue = self.doctorQueue
+            receptionFree = self.receptionFree
+            nurseFree = self.nurseFree
+            doctorFree = self.doctorFree
+            waitingRoom = self.currentReceptionWaitingRoomCapacity
+            generatedPatients = self.generatedPatients
+            sequence = self.sequence
+            now = self.now
+
+            while calendar and calendar[0][0] < until:
+                  now, _, kind, patient = heappop(calendar)
+                  if now >= nextSample:
+                        # Levels before the events at the sampling times up to now
+                        nextSample = levelSeries.record(now, len(receptionQueue), receptionists - receptionFree, waitingRoom,
+                                                        len(nurseQueue), nurses - nurseFree, len(doctorQueue), doctors - doctorFree)
+
+                  if kind == GENERATE:
+                        # Generator step: closes the previous inter-arrival (its start is the payload) and creates the next patient
+                        if patient is not None:
+                              accumulators[TOTAL_TIME] = now
+                              accumulators[ARRIVAL_TIME] += now - patient
+                        if generatedPatients == totalPatients:
+                              continue
+                        generatedPatients += 1
+                        if generatedPatients % SKETCH_FLUSH == 0:
+                              addToSketches(accumulators, sketchValues)
+                        waitingRoom += 1
+                        sequence += 1
+                        heappush(calendar, (now + interArrivalTime(), sequence, GENERATE, now))
+
+                        # Arrival at the reception
+                        accumulators[TOTAL_PATIENTS] += 1
+                        journey = Journey(generatedPatients, now) if journeys is not None else None
+                        if waitingRoom > waitingRoomCapacity:
+                              # Declined access: leaves as non-urgent
+                              waitingRoom -= 1
+                              accumulators[DECLINED] += 1
+                              accumulators[COUNT + NON_URGENT] += 1
+                              if journey is not None:
+                                    journey.disposition = DECLINED_ACCESS
+                                    journeys.record(journey)
+                        elif receptionFree:
+                              receptionFree -= 1
+                              accumulators[RECEPTION_WAITING_SKETCH] += 1 # no wait
+                              serviceTime = receptionServiceTime()
+                              sequence += 1
+                              heappush(calendar, (now + serviceTime, sequence, RECEPTION_END, [generatedPatients, receptionPriority(), now, now, now, journey]))
+                        else:
+                              receptionQueue.append([generatedPatients, None, now, None, now, journey])
+                        continue
+
+                  if kind == RECEPTION_END:
+                        value = now - patient[SERVICE_START]
+                        accumulators[RECEPTION_SERVICE] += value
+                        receptionServiceSketch(value)
+                        if receptionQueue:
+                              following = receptionQueue.popleft()
+                              value = now - following[REQUEST_TIME]
+                              accumulators[RECEPTION_WAITING] += value
+                              receptionWaitingSketch(value)
+                              following[SERVICE_START] = now
+                              serviceTime = receptionServiceTime()
+                              following[PRIORITY] = receptionPriority()
+                              sequence += 1
+                              heappush(calendar, (now + serviceTime, sequence, RECEPTION_END, following))
+                        else:
+                              receptionFree += 1
+                        waitingRoom -= 1
+
+                        priority = patient[PRIORITY]
+                        journey = patient[JOURNEY]
+                        if journey is not None:
+                              journey.receptionStart = patient[SERVICE_START]
+                              journey.receptionEnd = now
+                              journey.receptionPriority = priority
+                        if priority == NON_URGENT:
+                              accumulators[COUNT + NON_URGENT] += 1
+                              lengthOfStaySketch(now - patient[ARRIVED])
+                              if journey is not None:
+                                    journey.disposition = LEFT_AFTER_RECEPTION
+                                    journeys.record(journey)
+                              continue
+                        if priority != CRITICAL and priority != URGENT:
+                              # Arrival at the nurse
+                              accumulators[NURSE_TOTAL] += 1
+                              accumulators[NURSE_PATIENTS + priority] += 1
+                              patient[REQUEST_TIME] = now
+                              if nurseFree:
+                                    nurseFree -= 1
+                                    accumulators[NURSE_WAITING_SKETCH + SKETCH_BINS * priority] += 1 # no wait
+                                    patient[SERVICE_START] = now
+                                    sequence += 1
+                                    heappush(calendar, (now + nurseService() * nurseServiceMean[priority], sequence, NURSE_END, patient))
+                              else:
+                                    sequence += 1
+                                    heappush(nurseQueue, (priority, now, sequence, patient))
+                              continue
+
+                  elif kind == NURSE_END:
+                        priority = patient[PRIORITY]
+                        newPriority = bisect_right(nurseTables[priority], nurseUniform()) + 1
+                        value = now - patient[SERVICE_START]
+                        accumulators[NURSE_SERVICE + priority] += value
+                        nurseServiceSketches[priority](value)
+                        accumulators[NURSE_REVALUATIONS + PRIORITY_SLOTS * priority + newPriority] += 1
+                        journey = patient[JOURNEY]
+                        if journey is not None:
+                              journey.nurseRequest = patient[REQUEST_TIME]
+                              journey.nurseStart = patient[SERVICE_START]
+                              journey.nurseEnd = now
+                              journey.nursePriority = newPriority
+                        if nurseQueue:
+                              following = heappop(nurseQueue)[3]
+                              value = now - following[REQUEST_TIME]
+                              accumulators[NURSE_WAITING + following[PRIORITY]] += value
+                              nurseWaitingSketches[following[PRIORITY]](value)
+                              following[SERVICE_START] = now
+                              sequence += 1
+                              heappush(calendar, (now + nurseService() * nurseServiceMean[following[PRIORITY]], sequence, NURSE_END, following))
+                        else:
+                              nurseFree += 1
+
+                        if newPriority == NON_URGENT:
+                              accumulators[COUNT + NON_URGENT] += 1
+                              lengthOfStaySketch(now - patient[ARRIVED])
+                              if journey is not None:
+                                    journey.disposition = LEFT_AFTER_NURSE
+                                    journeys.record(journey)
+                              continue
+                        patient[PRIORITY] = priority = newPriority
+
+                  else:
+                        # Doctor service end
+                        priority = patient[PRIORITY]
+                        enterHospital = doctorUniform() < doctorEnterProbability[priority]
+                        value = now - patient[SERVICE_START]
+                        accumulators[DOCTOR_SERVICE + priority] += value
+                        doctorServiceSketches[priority](value)
+                        lengthOfStaySketch(now - patient[ARRIVED])
+                        if enterHospital:
+                              accumulators[DOCTOR_ENTER + priority] += 1
+                        journey = patient[JOURNEY]
+                        if journey is not None:
+                              journey.doctorRequest = patient[REQUEST_TIME]
+                              journey.doctorStart = patient[SERVICE_START]
+                              journey.doctorEnd = now
+                              journey.disposition = ADMITTED if enterHospital else DISCHARGED
+                              journeys.record(journey)
+                        if doctorQueue:
+                              following = heappop(doctorQueue)[3]
+                              value = now - following[REQUEST_TIME]
+                              accumulators[DOCTOR_WAITING + following[PRIORITY]] += value
+                              doctorWaitingSketches[following[PRIORITY]](value)
+                              following[SERVICE_START] = now
+                              sequence += 1
+                              heappush(calendar, (now + doctorService() * doctorServiceMean[following[PRIORITY]], sequence, DOCTOR_END, following))
+                        else:
+                              doctorFree += 1
+
+                        # Financials (as in Simulation.getRevenue)
+                        accumulators[REVENUE] += generalFee
+                        if enterHospital:
+                              accumulators[REVENUE] += enterHospitalFee[priority]
+                              accumulators[ENTER_COUNT] += 1
+                              accumulators[ENTER_BY_PRIORITY + priority] += 1
+                        else:
+                              accumulators[EXIT_COUNT] += 1
+                              accumulators[EXIT_BY_PRIORITY + priority] += 1
+                        continue
+
+                  # Arrival at the doctor (critical and urgent patients from the reception, the rest from the nurse)
+                  accumulators[DOCTOR_TOTAL] += 1
+                  accumulators[DOCTOR_PATIENTS + priority] += 1
+                  accumulators[COUNT + priority] += 1
+                  patient[REQUEST_TIME] = now
+                  if doctorFree:
+                        doctorFree -= 1
+                        accumulators[DOCTOR_WAITING_SKETCH + SKETCH_BINS * priority] += 1 # no wait
+                        patient[SERVICE_START] = now
+                        sequence += 1
+                        heappush(calendar, (now + doctorService() * doctorServiceMean[priority], sequence, DOCTOR_END, patient))
+                  else:
+                        sequence += 1
+                        heappush(doctorQueue, (priority, now, sequence, patient))
+
+            addToSketches(accumulators, sketchValues)
+            self.now = now
+            self.sequence = sequence
+            self.receptionFree = receptionFree
+            self.nurseFree = nurseFree
+            self.doctorFree = doctorFree
+            self.currentReceptionWaitingRoomCapacity = waitingRoom
+            self.generatedPatients = generatedPatients
+            return now
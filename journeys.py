@@ -0,0 +1,115 @@
+import os
+import sys
+from math import nan
+import numpy as np
+
+
+## JOURNEY RECORDS ##
+# One fixed-size record per patient, appended to a raw binary file (no header) that np.memmap reads back.
+# Timestamps of the stages a patient did not go through are NaN, priorities they did not get are 0.
+JOURNEY_DTYPE = np.dtype([
+      ("id", "<i8"),
+      ("arrival", "<f8"),
+      ("receptionStart", "<f8"),
+      ("receptionEnd", "<f8"),
+      ("nurseRequest", "<f8"),
+      ("nurseStart", "<f8"),
+      ("nurseEnd", "<f8"),
+      ("doctorRequest", "<f8"),
+      ("doctorStart", "<f8"),
+      ("doctorEnd", "<f8"),
+      ("receptionPriority", "i1"), # triage at the reception
+      ("nursePriority", "i1"), # revaluation by the nurse
+      ("disposition", "i1")
+])
+
+# Dispositions: how the patient left
+DECLINED_ACCESS, LEFT_AFTER_RECEPTION, LEFT_AFTER_NURSE, DISCHARGED, ADMITTED = range(1, 6)
+DISPOSITION_NAMES = {DECLINED_ACCESS: "declined", LEFT_AFTER_RECEPTION: "leftAfterReception", LEFT_AFTER_NURSE: "leftAfterNurse",
+                     DISCHARGED: "discharged", ADMITTED: "admitted"}
+
+
+class Journey():
+      """ Timestamps, triage and disposition of a patient while in the hospital """
+      __slots__ = ("id", "arrival", "receptionStart", "receptionEnd", "nurseRequest", "nurseStart", "nurseEnd",
+                   "doctorRequest", "doctorStart", "doctorEnd", "receptionPriority", "nursePriority", "disposition")
+
+      def __init__(self, id: int, arrival: float):
+            self.id = id
+            self.arrival = arrival
+            self.receptionStart = self.receptionEnd = nan
+            self.nurseRequest = self.nurseStart = self.nurseEnd = nan
+            self.doctorRequest = self.doctorStart = self.doctorEnd = nan
+            self.receptionPriority = self.nursePriority = self.disposition = 0
+
+
+class JourneyLog():
+      """ Writes the journey of every patient that leaves the hospital into a buffer of bufferSize records,
+      appended to the file whenever it fills up, so only the patients in the hospital are kept as objects """
+      def __init__(self,
+                   path: str,
+                   bufferSize: int
+                   ):
+            self.file = open(path, "wb")
+            self.buffer = np.zeros(bufferSize, dtype=JOURNEY_DTYPE)
+            self.count = 0
+            return None
+
+      @classmethod
+      def fromVariables(cls, variables: dict, replication: int):
+            """ Journey log of a replication configured in GENERAL_SETTINGS, or None when it is disabled """
+            settings = variables["GENERAL_SETTINGS"]
+            if not settings["journeyLog"]:
+                  return None
+            return cls(settings["journeyFilePath"].format(replication=replication), settings["journeyBufferSize"])
+
+      def record(self, journey: Journey):
+            self.buffer[self.count] = (journey.id, journey.arrival, journey.receptionStart, journey.receptionEnd,
+                                       journey.nurseRequest, journey.nurseStart, journey.nurseEnd,
+                                       journey.doctorRequest, journey.doctorStart, journey.doctorEnd,
+                                       journey.receptionPriority, journey.nursePriority, journey.disposition)
+            self.count += 1
+            if self.count == len(self.buffer):
+                  self.flush()
+
+      def flush(self):
+            self.buffer[:self.count].tofile(self.file)
+            self.count = 0
+
+      def close(self):
+            self.flush()
+            self.file.close()
+
+
+def openJourneys(path: str) -> np.ndarray:
+      """ Memory-mapped (read-only) journey records of a replication, in the order the patients left """
+      if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=JOURNEY_DTYPE)
+      return np.memmap(path, dtype=JOURNEY_DTYPE, mode="r")
+
+
+def exitTimes(journeys: np.ndarray) -> np.ndarray:
+      """ Time each patient left: the end of the last stage it went through (its arrival when declined) """
+      return np.fmax.reduce([journeys["arrival"], journeys["receptionEnd"], journeys["nurseEnd"], journeys["doctorEnd"]])
+
+
+def waitingTimes(journeys: np.ndarray, stage: str) -> np.ndarray:
+      """ Time in the queue of a stage (reception, nurse or doctor), NaN for the patients that skipped it """
+      request = journeys["arrival"] if stage == "reception" else journeys[f"{stage}Request"]
+      return journeys[f"{stage}Start"] - request
+
+
+def serviceTimes(journeys: np.ndarray, stage: str) -> np.ndarray:
+      """ Service time of a stage (reception, nurse or doctor), NaN for the patients that skipped it """
+      return journeys[f"{stage}End"] - journeys[f"{stage}Start"]
+
+
+if __name__ == "__main__":
+      # python journeys.py other/journeys_0.bin: dispositions and time in the hospital
+      journeys = openJourneys(sys.argv[1] if len(sys.argv) > 1 else "other/journeys_0.bin")
+      timeInHospital = exitTimes(journeys) - journeys["arrival"]
+      print(f"{len(journeys)} patients")
+      for disposition, name in DISPOSITION_NAMES.items():
+            selected = timeInHospital[journeys["disposition"] == disposition]
+            if len(selected):
+                  print(f"{name:>20}: {len(selected):>8} patients, time in hospital p50 {np.median(selected):8.1f}, p90 {np.quantile(selected, 0.9):8.1f}")
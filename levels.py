@@ -0,0 +1,77 @@
+import sys
+import numpy as np
+
+
+## LEVEL SAMPLES ##
+# Queue lengths, patients in service and reception waiting-room occupancy, sampled every levelSampleInterval
+# simulated minutes (just before the events at each sampling time) and saved as one .npy record array per replication.
+LEVEL_DTYPE = np.dtype([
+      ("time", "<f8"),
+      ("receptionQueue", "<i4"),
+      ("receptionInService", "<i4"),
+      ("waitingRoom", "<i4"),
+      ("nurseQueue", "<i4"),
+      ("nurseInService", "<i4"),
+      ("doctorQueue", "<i4"),
+      ("doctorInService", "<i4")
+])
+
+
+class LevelSeries():
+      """ Fixed-interval samples of the levels of a replication, in an array preallocated for the expected length
+      of the run (doubled if the run outlasts it). The engines call record once the clock reaches nextTime, so
+      sampling costs one comparison per event """
+      def __init__(self,
+                   path: str,
+                   interval: float,
+                   expectedDuration: float
+                   ):
+            self.path = path
+            self.interval = interval
+            self.samples = np.zeros(int(expectedDuration // interval) + 1, dtype=LEVEL_DTYPE)
+            self.count = 0
+            self.nextIndex = 0
+            self.nextTime = 0.0
+            return None
+
+      @classmethod
+      def fromVariables(cls, variables: dict, replication: int):
+            """ Level samples of a replication configured in GENERAL_SETTINGS, or None when they are disabled """
+            settings = variables["GENERAL_SETTINGS"]
+            if settings["levelSampleInterval"] is None:
+                  return None
+            # A run lasts about totalPatients mean inter-arrival times
+            return cls(settings["levelFilePath"].format(replication=replication), settings["levelSampleInterval"],
+                       settings["totalPatients"] * variables["ARRIVAL"]["arrivalRate"])
+
+      def startAfter(self, time: float):
+            """ Skips the sampling times up to time (replications forked at the end of the warm-up) """
+            self.nextIndex = int(time // self.interval) + 1
+            self.nextTime = self.nextIndex * self.interval
+
+      def record(self, now: float, *levels) -> float:
+            """ Records levels (in LEVEL_DTYPE order) at every sampling time up to now and returns the next one """
+            while self.nextTime <= now:
+                  if self.count == len(self.samples):
+                        self.samples = np.concatenate([self.samples, np.zeros_like(self.samples)])
+                  self.samples[self.count] = (self.nextTime, *levels)
+                  self.count += 1
+                  self.nextIndex += 1
+                  self.nextTime = self.nextIndex * self.interval
+            return self.nextTime
+
+      def close(self):
+            np.save(self.path, self.samples[:self.count])
+
+
+def openLevels(path: str) -> np.ndarray:
+      """ Memory-mapped (read-only) level samples of a replication """
+      return np.load(path, mmap_mode="r")
+
+
+if __name__ == "__main__":
+      # python levels.py other/levels_0.npy: time-averaged levels of a replication
+      samples = openLevels(sys.argv[1] if len(sys.argv) > 1 else "other/levels_0.npy")
+      print(f"{len(samples)} samples")
+      for name in LEVEL_DTYPE.names[1:]:
+            print(f"{name:>20}: mean {samples[name].mean():8.2f}, max {samples[name].max():6d}")
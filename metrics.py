@@ -0,0 +1,262 @@
+import math
+from array import array
+import numpy as np
+
+from utilities import PRIORITY_MAP
+
+
+## ACCUMULATOR LAYOUT ##
+# All the raw metrics of a replication live in one flat array of doubles. Per-priority metrics take
+# one slot per priority code (slot 0 is unused), so the hot path indexes them with `block + priority`
+# instead of building a key, and replications are merged by adding their arrays.
+PRIORITY_SLOTS = len(PRIORITY_MAP) + 1
+
+## QUANTILE SKETCHES ##
+# Waits, service times and lengths of stay are also counted in log-spaced bins (DDSketch style), so their
+# quantiles are known within SKETCH_ACCURACY (relative) in constant memory, and add up across replications
+# like the rest of the buffer. Bin 0 holds the values below SKETCH_MINIMUM (mostly waits of 0), bin k >= 1
+# the values in [SKETCH_MINIMUM * SKETCH_GAMMA^(k-1), SKETCH_MINIMUM * SKETCH_GAMMA^k), and the last bin
+# everything above SKETCH_MAXIMUM.
+SKETCH_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_MINIMUM = 0.01 # minutes
+SKETCH_MAXIMUM = 1e9 # longer than any simulated horizon
+SKETCH_SCALE = 1 / math.log(SKETCH_GAMMA)
+SKETCH_OFFSET = 1 - math.log(SKETCH_MINIMUM) * SKETCH_SCALE
+SKETCH_BINS = math.ceil(math.log(SKETCH_MAXIMUM / SKETCH_MINIMUM) * SKETCH_SCALE) + 2
+LAST_BIN = SKETCH_BINS - 1
+# Quantiles reported for every sketch
+TAIL_QUANTILES = {"p90": 0.9, "p99": 0.99}
+
+# 1. Scalar slots
+TOTAL_TIME = 0
+TOTAL_PATIENTS = 1
+DECLINED = 2
+ARRIVAL_TIME = 3
+RECEPTION_SERVICE = 4
+RECEPTION_WAITING = 5
+NURSE_TOTAL = 6
+DOCTOR_TOTAL = 7
+REVENUE = 8
+EXPENSES = 9
+ENTER_COUNT = 10
+EXIT_COUNT = 11
+# 2. Per-priority blocks
+COUNT = 12
+NURSE_PATIENTS = COUNT + PRIORITY_SLOTS
+NURSE_SERVICE = NURSE_PATIENTS + PRIORITY_SLOTS
+NURSE_WAITING = NURSE_SERVICE + PRIORITY_SLOTS
+DOCTOR_PATIENTS = NURSE_WAITING + PRIORITY_SLOTS
+DOCTOR_SERVICE = DOCTOR_PATIENTS + PRIORITY_SLOTS
+DOCTOR_WAITING = DOCTOR_SERVICE + PRIORITY_SLOTS
+DOCTOR_ENTER = DOCTOR_WAITING + PRIORITY_SLOTS
+# 3. Nurse revaluations (from priority -> to priority): NURSE_REVALUATIONS + PRIORITY_SLOTS * from + to
+NURSE_REVALUATIONS = DOCTOR_ENTER + PRIORITY_SLOTS
+# 4. Time-weighted levels. Waiting and service totals count whole waits and services, so the areas under the queue
+#    lengths and numbers in service after the warm-up are those totals minus the carry-over: the time the patients
+#    waiting or in service at the end of the warm-up had already spent there. MEASURED_TIME is the length of that period
+RECEPTION_QUEUE_CARRYOVER = NURSE_REVALUATIONS + PRIORITY_SLOTS * PRIORITY_SLOTS
+RECEPTION_SERVICE_CARRYOVER = RECEPTION_QUEUE_CARRYOVER + 1
+NURSE_QUEUE_CARRYOVER = RECEPTION_QUEUE_CARRYOVER + 2
+NURSE_SERVICE_CARRYOVER = RECEPTION_QUEUE_CARRYOVER + 3
+DOCTOR_QUEUE_CARRYOVER = RECEPTION_QUEUE_CARRYOVER + 4
+DOCTOR_SERVICE_CARRYOVER = RECEPTION_QUEUE_CARRYOVER + 5
+MEASURED_TIME = RECEPTION_QUEUE_CARRYOVER + 6
+# 5. Pricing statistics: what the fees and salaries multiply, over the same period as revenue and expenses (the whole
+#    run, or the batch of a long run), so the financials can be recomputed for other prices (see pricing.py).
+#    Patients seen by the doctor who enter and leave the hospital, by priority, and minutes the staff is paid for
+ENTER_BY_PRIORITY = MEASURED_TIME + 1
+EXIT_BY_PRIORITY = ENTER_BY_PRIORITY + PRIORITY_SLOTS
+STAFFED_TIME = EXIT_BY_PRIORITY + PRIORITY_SLOTS
+# 6. Quantile sketches (SKETCH_BINS slots each; per-priority ones hold one sketch per priority code: block + SKETCH_BINS * priority + bin)
+RECEPTION_WAITING_SKETCH = STAFFED_TIME + 1
+RECEPTION_SERVICE_SKETCH = RECEPTION_WAITING_SKETCH + SKETCH_BINS
+NURSE_WAITING_SKETCH = RECEPTION_SERVICE_SKETCH + SKETCH_BINS
+NURSE_SERVICE_SKETCH = NURSE_WAITING_SKETCH + SKETCH_BINS * PRIORITY_SLOTS
+DOCTOR_WAITING_SKETCH = NURSE_SERVICE_SKETCH + SKETCH_BINS * PRIORITY_SLOTS
+DOCTOR_SERVICE_SKETCH = DOCTOR_WAITING_SKETCH + SKETCH_BINS * PRIORITY_SLOTS
+LENGTH_OF_STAY_SKETCH = DOCTOR_SERVICE_SKETCH + SKETCH_BINS * PRIORITY_SLOTS # patients that were not declined
+ACCUMULATOR_SIZE = LENGTH_OF_STAY_SKETCH + SKETCH_BINS
+SKETCH_COUNT = (ACCUMULATOR_SIZE - RECEPTION_WAITING_SKETCH) // SKETCH_BINS
+# Slots that are not reset at the end of the warm-up
+WHOLE_RUN = (REVENUE, EXPENSES, ENTER_COUNT, EXIT_COUNT, *range(ENTER_BY_PRIORITY, STAFFED_TIME))
+# Priorities the doctor sees, which have an entry fee
+PRICED_PRIORITIES = ("critical", "urgent", "moderate", "low")
+# Sketches reported as tail metrics (<name>_p90, <name>_p99)
+TAIL_SKETCHES = {
+      "reception_waitingInQueue_duration": RECEPTION_WAITING_SKETCH,
+      "reception_serviceTime_duration": RECEPTION_SERVICE_SKETCH,
+      **{f"nurse_waitingInQueue_duration_{priority}": NURSE_WAITING_SKETCH + SKETCH_BINS * PRIORITY_MAP[priority] for priority in ("moderate", "low")},
+      **{f"nurse_serviceTime_duration_{priority}": NURSE_SERVICE_SKETCH + SKETCH_BINS * PRIORITY_MAP[priority] for priority in ("moderate", "low")},
+      **{f"doctor_waitingInQueue_duration_{priority}": DOCTOR_WAITING_SKETCH + SKETCH_BINS * PRIORITY_MAP[priority] for priority in ("critical", "urgent", "moderate", "low")},
+      **{f"doctor_serviceTime_duration_{priority}": DOCTOR_SERVICE_SKETCH + SKETCH_BINS * PRIORITY_MAP[priority] for priority in ("critical", "urgent", "moderate", "low")},
+      "general_lengthOfStay": LENGTH_OF_STAY_SKETCH
+}
+# Staff headcount of the replication (set from RESOURCES_CAPACITY, not accumulated), the other pricing statistic
+STAFF_METRICS = ["pricing_receptionists", "pricing_nurses", "pricing_doctors"]
+PRICING_METRICS = ["pricing_staffedTime", *(f"pricing_{disposition}_{priority}" for disposition in ("admitted", "discharged") for priority in PRICED_PRIORITIES)]
+TAIL_METRICS = [f"{name}_{suffix}" for name in TAIL_SKETCHES for suffix in TAIL_QUANTILES]
+
+
+def newAccumulators() -> array:
+      """ Zeroed accumulator buffer of a replication """
+      return array("d", bytes(8 * ACCUMULATOR_SIZE))
+
+
+def resetWarmUpMetrics(accumulators, carryOver: tuple = (0, 0, 0, 0, 0, 0)):
+      """ Drops what was recorded during the warm-up. Revenue, expenses and the hospital enter/exit counts
+      (also by priority) cover the whole run, so they are kept. carryOver is the time already spent by the patients waiting and
+      in service at the reception, the nurse and the doctor (queue, service for each, see RECEPTION_QUEUE_CARRYOVER) """
+      kept = [accumulators[slot] for slot in WHOLE_RUN]
+      accumulators[:] = newAccumulators()
+      for slot, value in zip(WHOLE_RUN, kept):
+            accumulators[slot] = value
+      accumulators[RECEPTION_QUEUE_CARRYOVER:MEASURED_TIME] = array("d", carryOver)
+
+
+def closeBatch(accumulators, carryOver: tuple) -> array:
+      """ Accumulators of the batch of a long run that ends now, and resets them for the next one (nothing is kept).
+      carryOver (as in resetWarmUpMetrics) is the time the patients still waiting or in service have spent so far:
+      it belongs to the areas of this batch and is discounted from the totals of the next """
+      batch = array("d", accumulators)
+      for slot, value in zip(range(RECEPTION_QUEUE_CARRYOVER, MEASURED_TIME), carryOver):
+            batch[slot] -= value
+      accumulators[:] = newAccumulators()
+      accumulators[RECEPTION_QUEUE_CARRYOVER:MEASURED_TIME] = array("d", carryOver)
+      return batch
+
+
+def sketchBin(value: float) -> int:
+      """ Bin of a value in a quantile sketch """
+      if value < SKETCH_MINIMUM:
+            return 0
+      return min(int(math.log(value) * SKETCH_SCALE + SKETCH_OFFSET), LAST_BIN)
+
+
+def sketchBins(values: np.ndarray) -> np.ndarray:
+      """ sketchBin of every value """
+      bins = (np.log(np.maximum(values, SKETCH_MINIMUM)) * SKETCH_SCALE + SKETCH_OFFSET).astype(np.intp)
+      return np.where(values < SKETCH_MINIMUM, 0, np.minimum(bins, LAST_BIN))
+
+
+def sketchNumber(sketch: int) -> int:
+      """ Position of a sketch (its first slot) among all the sketches """
+      return (sketch - RECEPTION_WAITING_SKETCH) // SKETCH_BINS
+
+
+def addToSketches(accumulators: array, sketchValues: list):
+      """ Counts pending values (one array("d") per sketch, in layout order) into the sketches of the accumulators and
+      empties them. Binning values in bulk is much cheaper than binning them one by one in the event loop """
+      counts = asArray(accumulators)[RECEPTION_WAITING_SKETCH:].reshape(SKETCH_COUNT, SKETCH_BINS)
+      for sketch, values in enumerate(sketchValues):
+            if values:
+                  counts[sketch] += np.bincount(sketchBins(np.frombuffer(values)), minlength=SKETCH_BINS)
+                  del values[:]
+
+
+def tailQuantiles(accumulators) -> dict:
+      """ TAIL_QUANTILES of every sketch in TAIL_SKETCHES (NaN when it is empty, which RunningStatistics counts as missing), within SKETCH_ACCURACY of the exact ones """
+      sketches = np.fromiter(TAIL_SKETCHES.values(), dtype=np.intp)
+      cumulative = np.cumsum(np.asarray(accumulators)[sketches[:, None] + np.arange(SKETCH_BINS)], axis=1)
+      total = cumulative[:, -1]
+      quantiles = {}
+      for suffix, quantile in TAIL_QUANTILES.items():
+            index = (cumulative <= (quantile * (total - 1))[:, None]).sum(axis=1)
+            # Value at the same relative distance from both ends of the bin
+            values = np.where(index == 0, 0.0, SKETCH_MINIMUM * 2 * SKETCH_GAMMA ** index / (SKETCH_GAMMA + 1))
+            quantiles[suffix] = np.where(total == 0, math.nan, values).tolist()
+      return {f"{name}_{suffix}": quantiles[suffix][number] for number, name in enumerate(TAIL_SKETCHES) for suffix in TAIL_QUANTILES}
+
+
+def asArray(accumulators: array) -> np.ndarray:
+      """ Numpy view (no copy) of an accumulator buffer, e.g. to add up replications """
+      return np.frombuffer(accumulators, dtype=np.float64)
+
+
+def collectMetricsValues(accumulators) -> dict:
+      """ Builds the named raw metrics (metricsValues) out of an accumulator buffer """
+      a = accumulators
+      critical, urgent, moderate, low, nonUrgent = (PRIORITY_MAP[priority] for priority in ("critical", "urgent", "moderate", "low", "non-urgent"))
+
+      def revaluations(fromPriority, name):
+            block = NURSE_REVALUATIONS + PRIORITY_SLOTS * fromPriority
+            return {
+                  f"nurse_revaluations_{name}_toCritical": int(a[block + critical]),
+                  f"nurse_revaluations_{name}_toUrgent": int(a[block + urgent]),
+                  f"nurse_revaluations_{name}_toModerate": int(a[block + moderate]),
+                  f"nurse_revaluations_{name}_toLow": int(a[block + low]),
+                  f"nurse_revaluations_{name}_toNon-urgent": int(a[block + nonUrgent])
+            }
+
+      return {
+            # 1. General metrics
+            "general_totalTime": a[TOTAL_TIME],
+            "general_totalPatients": int(a[TOTAL_PATIENTS]),
+            # 2. Proportions of patients
+            "count_totalCriticalPatients": int(a[COUNT + critical]),
+            "count_totalUrgentPatients": int(a[COUNT + urgent]),
+            "count_totalModeratePatients": int(a[COUNT + moderate]),
+            "count_totalLowPatients": int(a[COUNT + low]),
+            "count_totalNonUrgentPatients": int(a[COUNT + nonUrgent]),
+            "count_totalPatientsDeclinedAccess": int(a[DECLINED]),
+            # 3. Arrival metrics
+            "arrival_totalArrivalTime": a[ARRIVAL_TIME],
+            # 4. Reception metrics
+            "reception_totalServiceTime": a[RECEPTION_SERVICE],
+            "reception_totalWaitingInQueueTime": a[RECEPTION_WAITING],
+            # 5. Nurse metrics
+            # 5.1 Proportions
+            "nurse_totalPatients": int(a[NURSE_TOTAL]),
+            "nurse_totalPatientsModerate": int(a[NURSE_PATIENTS + moderate]),
+            "nurse_totalPatientsLow": int(a[NURSE_PATIENTS + low]),
+            # 5.2 Service time
+            "nurse_totalServiceTimeModerate": a[NURSE_SERVICE + moderate],
+            "nurse_totalServiceTimeLow": a[NURSE_SERVICE + low],
+            # 5.3 Waiting in queue
+            "nurse_totalWaitingInQueueTimeModerate": a[NURSE_WAITING + moderate],
+            "nurse_totalWaitingInQueueTimeLow": a[NURSE_WAITING + low],
+            # 5.4 Revaluations
+            **revaluations(moderate, "moderate"),
+            **revaluations(low, "low"),
+            # 6. Doctor metrics
+            # 6.1 Proportions
+            "doctor_totalPatients": int(a[DOCTOR_TOTAL]),
+            "doctor_totalPatientsCritical": int(a[DOCTOR_PATIENTS + critical]),
+            "doctor_totalPatientsUrgent": int(a[DOCTOR_PATIENTS + urgent]),
+            "doctor_totalPatientsModerate": int(a[DOCTOR_PATIENTS + moderate]),
+            "doctor_totalPatientsLow": int(a[DOCTOR_PATIENTS + low]),
+            # 6.2 Service time
+            "doctor_totalServiceTimeCritical": a[DOCTOR_SERVICE + critical],
+            "doctor_totalServiceTimeUrgent": a[DOCTOR_SERVICE + urgent],
+            "doctor_totalServiceTimeModerate": a[DOCTOR_SERVICE + moderate],
+            "doctor_totalServiceTimeLow": a[DOCTOR_SERVICE + low],
+            # 6.3 Waiting in queue
+            "doctor_totalWaitingInQueueTimeCritical": a[DOCTOR_WAITING + critical],
+            "doctor_totalWaitingInQueueTimeUrgent": a[DOCTOR_WAITING + urgent],
+            "doctor_totalWaitingInQueueTimeModerate": a[DOCTOR_WAITING + moderate],
+            "doctor_totalWaitingInQueueTimeLow": a[DOCTOR_WAITING + low],
+            # 6.4 Doctor Assesment
+            "doctor_assesment_criticalEnterHospitalCount": int(a[DOCTOR_ENTER + critical]),
+            "doctor_assesment_urgentEnterHospitalCount": int(a[DOCTOR_ENTER + urgent]),
+            "doctor_assesment_moderateEnterHospitalCount": int(a[DOCTOR_ENTER + moderate]),
+            "doctor_assesment_lowEnterHospitalCount": int(a[DOCTOR_ENTER + low]),
+            # 7. Financials
+            "financials_revenue_total": a[REVENUE],
+            "financials_expenses_total": a[EXPENSES],
+            "financials_hospital_enterCount": int(a[ENTER_COUNT]),
+            "financials_hospital_exitCount": int(a[EXIT_COUNT]),
+            # 7.1 Pricing statistics (see pricing.py)
+            "pricing_staffedTime": a[STAFFED_TIME],
+            **{f"pricing_admitted_{priority}": int(a[ENTER_BY_PRIORITY + PRIORITY_MAP[priority]]) for priority in PRICED_PRIORITIES},
+            **{f"pricing_discharged_{priority}": int(a[EXIT_BY_PRIORITY + PRIORITY_MAP[priority]]) for priority in PRICED_PRIORITIES},
+            # 8. Tail quantiles
+            **tailQuantiles(a),
+            # 9. Time-weighted levels: areas under the queue lengths and numbers in service after the warm-up
+            "levels_measuredTime": a[MEASURED_TIME],
+            "reception_queueLengthArea": a[RECEPTION_WAITING] - a[RECEPTION_QUEUE_CARRYOVER],
+            "reception_inServiceArea": a[RECEPTION_SERVICE] - a[RECEPTION_SERVICE_CARRYOVER],
+            "nurse_queueLengthArea": sum(a[NURSE_WAITING:NURSE_WAITING + PRIORITY_SLOTS]) - a[NURSE_QUEUE_CARRYOVER],
+            "nurse_inServiceArea": sum(a[NURSE_SERVICE:NURSE_SERVICE + PRIORITY_SLOTS]) - a[NURSE_SERVICE_CARRYOVER],
+            "doctor_queueLengthArea": sum(a[DOCTOR_WAITING:DOCTOR_WAITING + PRIORITY_SLOTS]) - a[DOCTOR_QUEUE_CARRYOVER],
+            "doctor_inServiceArea": sum(a[DOCTOR_SERVICE:DOCTOR_SERVICE + PRIORITY_SLOTS]) - a[DOCTOR_SERVICE_CARRYOVER]
+      }
@@ -0,0 +1,258 @@
+import os
+import sys
+import csv
+import math
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+import numpy as np
+import yaml
+
+from confidence import RunningStatistics
+from parameters import loadVariables, validateVariables
+from sweep import applyOverrides, gridScenarios, runScenarios
+
+
+## STAFFING OPTIMIZATION ##
+# Searches a grid of staffing levels for the Pareto set of cost vs the target waits and the cheapest staffing whose
+# mean waits meet their targets. Rather than running every staffing the same number of times, replications are
+# spent in rounds where they can change the answer (OCBA style): a staffing gets a share of a round proportional to
+# (noise / margin)^2, its margin being how far its means are from changing its Pareto or feasibility status, and
+# none once that status is settled at confidenceLevel. Staffings dominated at confidenceLevel are pruned.
+# Replication r of every staffing uses the same seeds, so the comparisons between them are on common random numbers.
+
+# Margins below this (in units of the objective scales) count as a tie, so the share of a staffing stays finite
+TIE = 1e-9
+
+
+class Candidate():
+      """ A staffing of the search: its overrides and the running statistics of the objectives over its replications so far """
+      def __init__(self,
+                   index: int,
+                   overrides: dict,
+                   objectives: list
+                   ):
+            self.index = index
+            self.overrides = overrides
+            self.statistics = {metricName: RunningStatistics() for metricName in objectives}
+            self.prunedAt = None # round in which it was found dominated
+            return None
+
+      @property
+      def replications(self) -> int:
+            """ Replications run so far, with or without a value of the objectives """
+            statistics = next(iter(self.statistics.values()))
+            return statistics.count + statistics.missing
+
+      def means(self, objectives: list) -> np.ndarray:
+            return np.array([self.statistics[metricName].mean for metricName in objectives])
+
+      def stds(self, objectives: list) -> np.ndarray:
+            return np.array([self.statistics[metricName].std() if self.replications > 1 else math.inf for metricName in objectives])
+
+      def halfWidths(self, objectives: list, confidence: float) -> np.ndarray:
+            return np.array([self.statistics[metricName].halfWidth(confidence) for metricName in objectives])
+
+
+class StaffingOptimizer():
+      """ Ranking-and-selection search of a staffing grid: every staffing gets initialReplications, then every round
+      spreads replicationsPerRound over the staffings whose status is still uncertain, until their statuses are
+      settled, every one of them has maxReplications or the budget of replications is spent """
+      def __init__(self,
+                   variables: dict,
+                   grid: dict,
+                   cost: str,
+                   targets: dict,
+                   initialReplications: int = 5,
+                   replicationsPerRound: int = 40,
+                   maxReplications: int = 50,
+                   budget: int = None,
+                   indifference: dict = None
+                   ):
+            settings = variables["GENERAL_SETTINGS"]
+            if settings["horizon"] is not None:
+                  raise ValueError("The staffing optimizer compares replications of totalPatients (horizon: null)")
+            if initialReplications < 2 or maxReplications < initialReplications:
+                  raise ValueError("The optimizer needs 2 <= initialReplications <= maxReplications")
+            self.variables = variables
+            self.cost = cost
+            self.targets = targets
+            self.objectives = [cost, *targets]
+            self.initialReplications = initialReplications
+            self.replicationsPerRound = replicationsPerRound
+            self.maxReplications = maxReplications
+            self.budget = budget
+            # Differences of the means not worth resolving, per objective (0 where missing)
+            self.indifference = np.array([(indifference or {}).get(metricName, 0) for metricName in self.objectives], dtype=float)
+            self.confidence = settings["confidenceLevel"]
+            self.candidates = [Candidate(index, overrides, self.objectives) for index, overrides in enumerate(gridScenarios(grid))]
+            for candidate in self.candidates:
+                  validateVariables(applyOverrides(variables, candidate.overrides)) # fails on unknown or invalid parameters before anything runs
+            self.rounds = 0
+            # Variables (resolved warm-up), compiled parameters and warm-start snapshots of the candidates set up so far, by candidate
+            self.setUps = {}
+            return None
+
+      @property
+      def spent(self) -> int:
+            return sum(candidate.replications for candidate in self.candidates)
+
+      def __simulate__(self, allocation: dict, workers: int, executor: ProcessPoolExecutor = None):
+            """ Runs the next allocation[candidate] replications of each candidate (setting up, on the pool, the ones
+            run for the first time) and adds their objectives to the candidates. Results are added in replication
+            order, so the statistics do not depend on the completion order """
+            replications = {index: range(self.candidates[index].replications, self.candidates[index].replications + count) for index, count in allocation.items()}
+            results = {index: {} for index in allocation}
+            for index, block in runScenarios(replications, lambda index: applyOverrides(self.variables, self.candidates[index].overrides),
+                                             self.setUps, workers, executor):
+                  results[index].update(block)
+            for index, blocks in results.items():
+                  candidate = self.candidates[index]
+                  for replication in sorted(blocks):
+                        for metricName in self.objectives:
+                              candidate.statistics[metricName].update(blocks[replication][metricName])
+
+      def __active__(self) -> list:
+            return [candidate for candidate in self.candidates if candidate.prunedAt is None]
+
+      def __prune__(self):
+            """ Prunes the candidates another active candidate dominates at confidenceLevel: the confidence interval of
+            each of its objectives lies below the other's (strictly for one of them) """
+            active = self.__active__()
+            upper = {candidate.index: candidate.means(self.objectives) + candidate.halfWidths(self.objectives, self.confidence) for candidate in active}
+            lower = {candidate.index: candidate.means(self.objectives) - candidate.halfWidths(self.objectives, self.confidence) for candidate in active}
+            for candidate in active:
+                  for other in active:
+                        if other is not candidate and other.prunedAt is None \
+                           and (upper[other.index] <= lower[candidate.index]).all() and (upper[other.index] < lower[candidate.index]).any():
+                              candidate.prunedAt = self.rounds
+                              break
+
+      def __shares__(self) -> dict:
+            """ OCBA-style weight of every active candidate that can still take replications: (noise / margin)^2 in units
+            of the objective scales, where the margin is the smallest change of its means that would flip whether
+            another candidate dominates it, or whether it meets a target. Candidates whose margin exceeds the
+            confidence-interval half-width of their means, or whose half-widths are all within the indifference, are
+            settled and get nothing """
+            active = self.__active__()
+            means = np.array([candidate.means(self.objectives) for candidate in active])
+            stds = np.array([candidate.stds(self.objectives) for candidate in active])
+            counts = np.array([candidate.replications for candidate in active])
+            resolved = (np.array([candidate.halfWidths(self.objectives, self.confidence) for candidate in active]) <= self.indifference).all(axis=1)
+            # Objectives are compared in units of their typical replication noise (1 for a noiseless objective)
+            scales = np.nanmean(np.where(np.isfinite(stds), stds, np.nan), axis=0)
+            scales = np.where(np.isfinite(scales) & (scales > 0), scales, 1.0)
+            means, stds = means / scales, stds / scales
+
+            # gaps[j, i]: how far j is from dominating i (> 0: it does not, < 0: it does)
+            gaps = (means[:, None, :] - means[None, :, :]).max(axis=2)
+            np.fill_diagonal(gaps, np.inf)
+            margins = np.abs(gaps.min(axis=0)) if len(active) > 1 else np.full(len(active), np.inf)
+            targets = np.array([limit for limit in self.targets.values()]) / scales[1:]
+            margins = np.minimum(margins, np.abs(targets - means[:, 1:]).min(axis=1))
+
+            noise = stds.max(axis=1)
+            z = NormalDist().inv_cdf(0.5 + self.confidence / 2)
+            shares = {}
+            for candidate, margin, sigma, count, isResolved in zip(active, margins, noise, counts, resolved):
+                  if count < self.maxReplications and not isResolved and 0 < sigma and margin <= z * sigma / math.sqrt(count):
+                        shares[candidate.index] = (sigma / max(margin, TIE))**2
+            return shares
+
+      def __allocate__(self, shares: dict, replications: int) -> dict:
+            """ replications split in proportion to the shares (largest remainders), within maxReplications """
+            total = sum(shares.values())
+            room = {index: self.maxReplications - self.candidates[index].replications for index in shares}
+            exact = {index: replications * share / total for index, share in shares.items()}
+            allocation = {index: min(room[index], int(exact[index])) for index in shares}
+            for index in sorted(shares, key=lambda index: exact[index] - int(exact[index]), reverse=True):
+                  if sum(allocation.values()) >= replications:
+                        break
+                  if allocation[index] < room[index]:
+                        allocation[index] += 1
+            return {index: count for index, count in allocation.items() if count}
+
+      def run(self, workers: int = None):
+            """ Runs the search and returns the candidates """
+            settings = self.variables["GENERAL_SETTINGS"]
+            if workers is None:
+                  workers = settings["workers"] or os.cpu_count()
+            budget = math.inf if self.budget is None else self.budget
+
+            # One pool for the whole search: its workers stay up between rounds
+            executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+            try:
+                  self.__simulate__({candidate.index: self.initialReplications for candidate in self.candidates}, workers, executor)
+                  while True:
+                        self.rounds += 1
+                        self.__prune__()
+                        shares = self.__shares__()
+                        replications = min(self.replicationsPerRound, budget - self.spent)
+                        if not shares or replications <= 0:
+                              break
+                        self.__simulate__(self.__allocate__(shares, replications), workers, executor)
+            finally:
+                  if executor is not None:
+                        executor.shutdown(cancel_futures=True)
+            return self.candidates
+
+      def pareto(self) -> list:
+            """ Active candidates no other active candidate dominates on the means of the objectives """
+            active = self.__active__()
+            means = {candidate.index: candidate.means(self.objectives) for candidate in active}
+            return [candidate for candidate in active
+                    if not any((means[other.index] <= means[candidate.index]).all() and (means[other.index] < means[candidate.index]).any()
+                               for other in active if other is not candidate)]
+
+      def feasible(self, candidate: Candidate) -> bool:
+            """ Whether the mean of every target metric of candidate meets its target """
+            return all(candidate.statistics[metricName].mean <= limit for metricName, limit in self.targets.items())
+
+      def cheapest(self) -> Candidate:
+            """ Cheapest feasible candidate on the Pareto set (None when no candidate meets the targets) """
+            feasible = [candidate for candidate in self.pareto() if self.feasible(candidate)]
+            return min(feasible, key=lambda candidate: candidate.statistics[self.cost].mean) if feasible else None
+
+      def write(self, outputPath: str):
+            """ One row per candidate: overrides, replications, mean and half-width of the objectives, feasibility,
+            Pareto membership and the round it was pruned in """
+            parameters = list(self.candidates[0].overrides)
+            pareto = {candidate.index for candidate in self.pareto()}
+            with open(outputPath, "w", newline="") as file:
+                  writer = csv.writer(file)
+                  writer.writerow(["candidate", *parameters, "replications",
+                                   *(f"{metricName}_{statistic}" for metricName in self.objectives for statistic in ("mean", "halfWidth")),
+                                   "feasible", "pareto", "prunedAt"])
+                  for candidate in self.candidates:
+                        row = [candidate.index, *(candidate.overrides[path] for path in parameters), candidate.replications]
+                        for metricName in self.objectives:
+                              row += [candidate.statistics[metricName].mean, candidate.statistics[metricName].halfWidth(self.confidence)]
+                        writer.writerow(row + [self.feasible(candidate), candidate.index in pareto, "" if candidate.prunedAt is None else candidate.prunedAt])
+
+
+def loadOptimizer(optimizerFilePath: str, variables: dict = None) -> tuple:
+      """ Optimizer and output path described by an optimizer file (grid, cost, targets, indifference, replication
+      settings, outputPath) """
+      if variables is None:
+            variables = loadVariables()
+      definition = yaml.load(open(optimizerFilePath), Loader=yaml.FullLoader)
+      optimizer = StaffingOptimizer(variables, definition["grid"], definition.get("cost", "financials_expenses_total"), definition["targets"],
+                                    definition.get("initialReplications", 5), definition.get("replicationsPerRound", 40),
+                                    definition.get("maxReplications", 50), definition.get("budget"), definition.get("indifference"))
+      return optimizer, definition.get("outputPath", "other/optimizer.csv")
+
+
+if __name__ == "__main__":
+      # python optimizer.py optimizer.yaml
+      optimizer, outputPath = loadOptimizer(sys.argv[1] if len(sys.argv) > 1 else "optimizer.yaml")
+      optimizer.run()
+      optimizer.write(outputPath)
+      grid = len(optimizer.candidates) * optimizer.maxReplications
+      print(f"{optimizer.spent} replications in {optimizer.rounds} rounds ({optimizer.spent / grid:.0%} of a full grid of {grid}); "
+            f"{sum(candidate.prunedAt is not None for candidate in optimizer.candidates)} of {len(optimizer.candidates)} staffings pruned")
+      print("Pareto set:")
+      for candidate in sorted(optimizer.pareto(), key=lambda candidate: candidate.statistics[optimizer.cost].mean):
+            means = ", ".join(f"{metricName} {candidate.statistics[metricName].mean:.2f}" for metricName in optimizer.objectives)
+            print(f"  {candidate.overrides} ({candidate.replications} replications): {means}{'' if optimizer.feasible(candidate) else ' (misses a target)'}")
+      cheapest = optimizer.cheapest()
+      print(f"Cheapest staffing meeting the targets: {cheapest.overrides if cheapest is not None else 'none'}")
+      print(f"Written to {outputPath}")
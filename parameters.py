@@ -0,0 +1,252 @@
+import sys
+import math
+from dataclasses import dataclass
+import numpy as np
+import yaml
+
+from utilities import PRIORITY_MAP
+from arrivals import ArrivalProfile
+from results import FORMATS
+
+
+## MODEL PARAMETERS ##
+# paramters.yaml is loaded and validated once, and compiled into ModelParameters: capacities, service means,
+# cumulative assessment tables and fees laid out by priority code, so the engines index them per patient
+# instead of walking the nested sections.
+
+# Tables are laid out in priority-code order, so the inverted index + 1 is the priority code
+PRIORITIES = sorted(PRIORITY_MAP, key=PRIORITY_MAP.get)
+# Priorities the nurse and the doctor see (the reception sends the other ones straight on, or home)
+NURSE_PRIORITIES = ("moderate", "low")
+DOCTOR_PRIORITIES = ("critical", "urgent", "moderate", "low")
+FEE_NAMES = {"critical": "enterHospitalCritical", "urgent": "enterHospitalUrgent", "moderate": "enterHospitalModerate", "low": "enterHospitalLow"}
+# Values of the GENERAL_SETTINGS that pick a mode
+SETTING_CHOICES = {
+      "engine": ("simpy", "fast"),
+      "verbosity": ("silent", "summary", "trace"),
+      "traceSink": ("file", "memory", "console"),
+      "resultsFormat": tuple(FORMATS),
+      "warmUpDetection": ("fixed", "mser5"),
+      "profiling": (None, "timers", "cprofile")
+}
+# Percentage tables must sum to 100 up to this (math.fsum makes the sum independent of the order of the entries)
+PERCENTAGE_TOLERANCE = 1e-9
+
+
+def byPriorityCode(values: dict) -> list:
+      """ List indexed by priority code out of a table keyed by priority name (None where missing) """
+      table = [None] * (len(PRIORITY_MAP) + 1)
+      for priority, value in values.items():
+            table[PRIORITY_MAP[priority]] = value
+      return table
+
+
+def cumulativeProbabilities(percentages: list) -> np.ndarray:
+      """ Normalized cumulative distribution of a table of percentages """
+      cumulative = np.cumsum(np.asarray(percentages, dtype=float))
+      return cumulative / cumulative[-1]
+
+
+def validateVariables(variables: dict):
+      """ Raises a ValueError listing every problem of variables: missing entries, the general settings (engine,
+      verbosity, run lengths, adaptive and warm-up settings...), capacities, means, percentages, fees and salaries """
+      problems = []
+
+      def number(path: str, value, minimum: float = 0, integer: bool = False, positive: bool = False):
+            if isinstance(value, bool) or not isinstance(value, int if integer else (int, float)):
+                  problems.append(f"{path} must be {'an integer' if integer else 'a number'} (got {value!r})")
+            elif value < minimum or (positive and value == 0) or math.isnan(value):
+                  problems.append(f"{path} must be {'positive' if positive else f'at least {minimum}'} (got {value})")
+
+      def flag(path: str, value):
+            if not isinstance(value, bool):
+                  problems.append(f"{path} must be true or false (got {value!r})")
+
+      def choice(path: str, value, options: tuple):
+            if value not in options:
+                  problems.append(f"{path} must be one of {' | '.join('null' if option is None else option for option in options)} (got {value!r})")
+
+      def percentages(path: str, table: dict):
+            if set(table) != set(PRIORITIES):
+                  problems.append(f"{path} must have one percentage per priority ({', '.join(PRIORITIES)})")
+                  return
+            found = len(problems)
+            for priority in PRIORITIES:
+                  number(f"{path}.{priority}", table[priority])
+            if len(problems) == found and abs(math.fsum(table.values()) - 100) > PERCENTAGE_TOLERANCE:
+                  problems.append(f"{path} must sum to 100 (sums to {math.fsum(table.values())!r})")
+
+      def entry(path: str, isSection: bool = False):
+            """ Entry at a dotted path, or None (recorded as a problem) when it is missing """
+            value = variables
+            for name in path.split("."):
+                  if not isinstance(value, dict) or name not in value:
+                        problems.append(f"{path} is missing")
+                        return None
+                  value = value[name]
+            if isSection and not isinstance(value, dict):
+                  problems.append(f"{path} must be a section")
+                  return None
+            return value
+
+      settings = entry("GENERAL_SETTINGS", isSection=True)
+      if settings is not None:
+            def setting(name: str, check, *arguments, optional: bool = False, **options):
+                  """ Checks a general setting (null is accepted as is when optional) """
+                  if name not in settings:
+                        problems.append(f"GENERAL_SETTINGS.{name} is missing")
+                  elif not (optional and settings[name] is None):
+                        check(f"GENERAL_SETTINGS.{name}", settings[name], *arguments, **options)
+
+            for name, options in SETTING_CHOICES.items():
+                  setting(name, choice, options)
+            for name in ("totalPatients", "numberOfRuns", "resultsBatchSize", "samplerBlockSize", "traceRingSize", "journeyBufferSize", "warmUpPilotRuns"):
+                  setting(name, number, minimum=1, integer=True)
+            for name in ("minRuns", "maxRuns", "batchCount"): # a confidence interval needs two runs (or batches)
+                  setting(name, number, minimum=2, integer=True)
+            for name in ("warmStartRuns", "seed"):
+                  setting(name, number, integer=True)
+            setting("workers", number, minimum=1, integer=True, optional=True)
+            for name in ("warmUpPeriod", "cacheMaxMegabytes"):
+                  setting(name, number)
+            for name in ("adaptiveRelativeHalfWidth", "warmUpSampleInterval", "confidenceLevel"):
+                  setting(name, number, positive=True)
+            for name in ("horizon", "levelSampleInterval"):
+                  setting(name, number, positive=True, optional=True)
+            for name in ("adaptiveRuns", "commonRandomNumbers", "cache", "journeyLog"):
+                  setting(name, flag)
+            metricNames = settings.get("adaptiveMetrics")
+            if not isinstance(metricNames, list) or not all(isinstance(metricName, str) for metricName in metricNames):
+                  problems.append(f"GENERAL_SETTINGS.adaptiveMetrics must be a list of metric names (got {metricNames!r})")
+            confidence = settings.get("confidenceLevel")
+            if isinstance(confidence, (int, float)) and confidence >= 1:
+                  problems.append(f"GENERAL_SETTINGS.confidenceLevel must be below 1 (got {confidence})")
+            minRuns, maxRuns = settings.get("minRuns"), settings.get("maxRuns")
+            if isinstance(minRuns, int) and isinstance(maxRuns, int) and maxRuns < minRuns:
+                  problems.append(f"GENERAL_SETTINGS.maxRuns must be at least minRuns (got {maxRuns} < {minRuns})")
+
+      capacity = entry("RESOURCES_CAPACITY", isSection=True)
+      if capacity is not None:
+            for resource in ("receptionWaitingRoom", "receptionist", "nurse", "doctor"):
+                  number(f"RESOURCES_CAPACITY.{resource}", capacity.get(resource), minimum=1, integer=True)
+      arrivalRate = entry("ARRIVAL.arrivalRate")
+      if arrivalRate is not None:
+            number("ARRIVAL.arrivalRate", arrivalRate, positive=True)
+      receptionTable = entry("RECEPTION.receptionistAssesment", isSection=True)
+      if receptionTable is not None:
+            percentages("RECEPTION.receptionistAssesment", receptionTable)
+      receptionMean = entry("RECEPTION.receptionServiceTime.mean")
+      if receptionMean is not None:
+            number("RECEPTION.receptionServiceTime.mean", receptionMean, positive=True)
+      for priority in NURSE_PRIORITIES:
+            table = entry(f"NURSE.nurseAssesment.{priority}", isSection=True)
+            if table is not None:
+                  percentages(f"NURSE.nurseAssesment.{priority}", table)
+            mean = entry(f"NURSE.nurseServiceTime.{priority}.mean")
+            if mean is not None:
+                  number(f"NURSE.nurseServiceTime.{priority}.mean", mean, positive=True)
+      for priority in DOCTOR_PRIORITIES:
+            percentage = entry(f"DOCTOR.doctorAssesment.{priority}")
+            if percentage is not None:
+                  number(f"DOCTOR.doctorAssesment.{priority}", percentage)
+                  if isinstance(percentage, (int, float)) and percentage > 100:
+                        problems.append(f"DOCTOR.doctorAssesment.{priority} must be at most 100 (got {percentage})")
+            mean = entry(f"DOCTOR.doctorServiceTime.{priority}.mean")
+            if mean is not None:
+                  number(f"DOCTOR.doctorServiceTime.{priority}.mean", mean, positive=True)
+      for fee in ("generalUrgenceFee", *FEE_NAMES.values()):
+            value = entry(f"FINANCIALS.FEES.{fee}")
+            if value is not None:
+                  number(f"FINANCIALS.FEES.{fee}", value)
+      for salary in ("receptionistPerMinute", "nursePerMinute", "doctorPerMinute"):
+            value = entry(f"FINANCIALS.SALARIES.{salary}")
+            if value is not None:
+                  number(f"FINANCIALS.SALARIES.{salary}", value)
+
+      if problems:
+            raise ValueError("Invalid parameters:\n  " + "\n  ".join(problems))
+
+
+def loadVariables(path: str = "paramters.yaml") -> dict:
+      """ Parameters in the YAML file at path, validated """
+      with open(path) as file:
+            variables = yaml.load(file, Loader=yaml.FullLoader)
+      validateVariables(variables)
+      return variables
+
+
+@dataclass(frozen=True, slots=True)
+class ModelParameters():
+      """ Validated model sections of variables, compiled once per scenario into tuples indexed by priority
+      code (None, or 0 for fees, at the priorities a stage never sees), shared by the samplers and every engine so
+      they all work from the same numbers. Frozen and without the variables it comes from: a handful of small
+      tables, cheap to pickle, so it is compiled in the parent process and sent to the workers as is """
+      # In a long run (horizon) patients keep arriving until the run is stopped
+      totalPatients: float
+      # Capacities
+      waitingRoomCapacity: int
+      receptionists: int
+      nurses: int
+      doctors: int
+      # Arrivals: mean time between arrivals, and the hour-of-day/day-of-week profile (None when flat)
+      interArrivalMean: float
+      arrivalProfile: ArrivalProfile
+      # Reception
+      receptionMean: float
+      receptionTable: tuple
+      # Nurse: cumulative tables by current priority, as lists (bisect)
+      nurseServiceMean: tuple
+      nurseTables: tuple
+      # Doctor
+      doctorServiceMean: tuple
+      doctorEnterProbability: tuple
+      # Financials
+      generalFee: float
+      enterHospitalFee: tuple
+      staffSalaries: tuple # (headcount, salary per minute) of every role
+
+      @classmethod
+      def fromVariables(cls, variables: dict):
+            """ Validates variables and compiles them """
+            validateVariables(variables)
+            settings = variables["GENERAL_SETTINGS"]
+            capacity = variables["RESOURCES_CAPACITY"]
+            reception = variables["RECEPTION"]
+            nurseTables = {priority: cumulativeProbabilities([table[newPriority] for newPriority in PRIORITIES])
+                           for priority, table in variables["NURSE"]["nurseAssesment"].items()}
+            fees = variables["FINANCIALS"]["FEES"]
+            salaries = variables["FINANCIALS"]["SALARIES"]
+            return cls(
+                  totalPatients=settings["totalPatients"] if settings["horizon"] is None else math.inf,
+                  waitingRoomCapacity=capacity["receptionWaitingRoom"],
+                  receptionists=capacity["receptionist"],
+                  nurses=capacity["nurse"],
+                  doctors=capacity["doctor"],
+                  interArrivalMean=variables["ARRIVAL"]["arrivalRate"],
+                  arrivalProfile=ArrivalProfile.fromVariables(variables),
+                  receptionMean=reception["receptionServiceTime"]["mean"],
+                  receptionTable=tuple(cumulativeProbabilities([reception["receptionistAssesment"][priority] for priority in PRIORITIES]).tolist()),
+                  nurseServiceMean=tuple(byPriorityCode({priority: values["mean"] for priority, values in variables["NURSE"]["nurseServiceTime"].items()})),
+                  nurseTables=tuple(byPriorityCode({priority: table.tolist() for priority, table in nurseTables.items()})),
+                  doctorServiceMean=tuple(byPriorityCode({priority: values["mean"] for priority, values in variables["DOCTOR"]["doctorServiceTime"].items()})),
+                  doctorEnterProbability=tuple(byPriorityCode({priority: percentage/100 for priority, percentage in variables["DOCTOR"]["doctorAssesment"].items()})),
+                  generalFee=fees["generalUrgenceFee"],
+                  enterHospitalFee=tuple(0 if fee is None else fee for fee in byPriorityCode({priority: fees[name] for priority, name in FEE_NAMES.items()})),
+                  staffSalaries=((capacity["receptionist"], salaries["receptionistPerMinute"]),
+                                 (capacity["nurse"], salaries["nursePerMinute"]),
+                                 (capacity["doctor"], salaries["doctorPerMinute"]))
+            )
+
+      def expenses(self, duration: float) -> float:
+            """ Salaries of the staff over duration minutes """
+            return sum(duration * staff * salary for staff, salary in self.staffSalaries)
+
+
+if __name__ == "__main__":
+      # python parameters.py paramters.yaml: validates a parameter file
+      path = sys.argv[1] if len(sys.argv) > 1 else "paramters.yaml"
+      try:
+            loadVariables(path)
+      except ValueError as error:
+            sys.exit(f"{path}: {error}")
+      print(f"{path}: valid")
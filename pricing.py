@@ -0,0 +1,128 @@
+import sys
+import csv
+import time
+import numpy as np
+import yaml
+
+from metrics import PRICED_PRIORITIES, PRICING_METRICS, STAFF_METRICS
+from confidence import tQuantile
+from parameters import FEE_NAMES, loadVariables, validateVariables
+from results import readResults
+from sweep import applyOverrides, gridScenarios
+
+
+## RE-PRICING ##
+# Patient flow does not depend on prices, so every replication also records what the fees and salaries multiply
+# (PRICING_METRICS and the staff headcount: the pricing statistics). The financials of stored replications can then
+# be recomputed for other FINANCIALS sections in one vectorized pass, without simulating them again.
+STAFF = ("receptionist", "nurse", "doctor") # order of STAFF_METRICS
+PRICING_COLUMNS = ["general_totalPatients", *PRICING_METRICS, *STAFF_METRICS]
+REPRICED_METRICS = ["financials_revenue_total", "financials_revenue_perPatientAverage", "financials_expenses_total",
+                    "financials_expenses_perPatientAverage", "financials_profit_total", "financials_profit_perPatientAverage"]
+
+
+class PriceTables():
+      """ Fees and salaries of one or more pricing scenarios, one row per scenario: generalFee (scenarios,),
+      enterHospitalFee (scenarios, PRICED_PRIORITIES) and salaries per minute (scenarios, STAFF) """
+      def __init__(self,
+                   generalFee: np.ndarray,
+                   enterHospitalFee: np.ndarray,
+                   salaries: np.ndarray
+                   ):
+            self.generalFee = generalFee
+            self.enterHospitalFee = enterHospitalFee
+            self.salaries = salaries
+            return None
+
+      @classmethod
+      def fromVariables(cls, variablesList: list):
+            """ Prices of the FINANCIALS section of each of variablesList (validated) """
+            for variables in variablesList:
+                  validateVariables(variables)
+            fees = [variables["FINANCIALS"]["FEES"] for variables in variablesList]
+            salaries = [variables["FINANCIALS"]["SALARIES"] for variables in variablesList]
+            return cls(np.array([fee["generalUrgenceFee"] for fee in fees], dtype=float),
+                       np.array([[fee[FEE_NAMES[priority]] for priority in PRICED_PRIORITIES] for fee in fees], dtype=float),
+                       np.array([[salary[f"{staff}PerMinute"] for staff in STAFF] for salary in salaries], dtype=float))
+
+
+def reprice(statistics: dict, prices: PriceTables) -> dict:
+      """ Financial metrics of every replication (columns of statistics, PRICING_COLUMNS) under every pricing
+      scenario: one (scenarios, replications) array per REPRICED_METRICS, computed like Simulation.getRevenue
+      and Simulation.expenses """
+      admitted = np.stack([statistics[f"pricing_admitted_{priority}"] for priority in PRICED_PRIORITIES])
+      discharged = np.stack([statistics[f"pricing_discharged_{priority}"] for priority in PRICED_PRIORITIES])
+      staff = np.stack([statistics[metricName] for metricName in STAFF_METRICS])
+      patients = statistics["general_totalPatients"]
+
+      # Every patient seen by the doctor pays the general fee, and the ones entering the hospital the fee of their priority
+      revenue = prices.generalFee[:, None] * (admitted.sum(axis=0) + discharged.sum(axis=0)) + prices.enterHospitalFee @ admitted
+      expenses = (prices.salaries @ staff) * statistics["pricing_staffedTime"]
+      profit = revenue - expenses
+      with np.errstate(divide="ignore", invalid="ignore"):
+            return {
+                  "financials_revenue_total": revenue,
+                  "financials_revenue_perPatientAverage": revenue / patients,
+                  "financials_expenses_total": expenses,
+                  "financials_expenses_perPatientAverage": expenses / patients,
+                  "financials_profit_total": profit,
+                  "financials_profit_perPatientAverage": profit / patients
+            }
+
+
+def loadStatistics(path: str, groupBy: str = "scenario") -> tuple:
+      """ Pricing statistics of the replications in a results file (CSV, or Parquet/Arrow file or partitioned
+      directory), as numeric arrays by column, and the groupBy column (None when the results have none, e.g. they
+      come from simulation.py rather than sweep.py) """
+      columns = readResults(path, PRICING_COLUMNS + [groupBy])
+      missing = [column for column in PRICING_COLUMNS if column not in columns]
+      if missing:
+            raise ValueError(f"{path} has no pricing statistics ({', '.join(missing)}): simulate the replications again")
+      statistics = {column: columns[column] for column in PRICING_COLUMNS}
+      groups = columns[groupBy].astype(str) if groupBy in columns else None
+      return statistics, groups
+
+
+def repriceFile(pricingFilePath: str, variables: dict = None):
+      """ Re-prices the results named in a pricing file (grid or scenarios of FINANCIALS overrides, resultsPath,
+      outputPath) and writes, for every pricing scenario (and simulation scenario of a sweep), the mean and
+      confidence-interval half-width of the repriced metrics """
+      if variables is None:
+            variables = loadVariables()
+      definition = yaml.load(open(pricingFilePath), Loader=yaml.FullLoader)
+      scenarios = gridScenarios(definition["grid"]) if "grid" in definition else definition["scenarios"]
+      for overrides in scenarios:
+            if any(not path.startswith("FINANCIALS.") for path in overrides):
+                  raise ValueError(f"Pricing scenarios only override FINANCIALS (got {', '.join(overrides)})")
+      prices = PriceTables.fromVariables([applyOverrides(variables, overrides) for overrides in scenarios])
+      statistics, groups = loadStatistics(definition.get("resultsPath", variables["GENERAL_SETTINGS"]["csvFilePath"]))
+
+      start = time.perf_counter()
+      repriced = reprice(statistics, prices)
+      elapsed = time.perf_counter() - start
+
+      confidence = variables["GENERAL_SETTINGS"]["confidenceLevel"]
+      parameters = list(dict.fromkeys(path for overrides in scenarios for path in overrides))
+      groupNames = [None] if groups is None else list(dict.fromkeys(groups))
+      outputPath = definition.get("outputPath", "other/pricing.csv")
+      with open(outputPath, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["pricingScenario", *([] if groups is None else ["scenario"]), *parameters, "replications",
+                             *(f"{metricName}_{statistic}" for metricName in REPRICED_METRICS for statistic in ("mean", "halfWidth"))])
+            for group in groupNames:
+                  rows = slice(None) if group is None else groups == group
+                  for scenario, overrides in enumerate(scenarios):
+                        row = [scenario, *([] if group is None else [group]), *(overrides.get(path, "") for path in parameters)]
+                        count = len(repriced["financials_profit_total"][scenario, rows])
+                        row.append(count)
+                        for metricName in REPRICED_METRICS:
+                              values = repriced[metricName][scenario, rows]
+                              halfWidth = tQuantile((1 + confidence) / 2, count - 1) * values.std(ddof=1) / np.sqrt(count) if count > 1 else float("nan")
+                              row += [values.mean(), halfWidth]
+                        writer.writerow(row)
+      print(f"Repriced {len(statistics['general_totalPatients'])} replications under {len(scenarios)} pricing scenarios in {elapsed * 1000:.1f} ms; written to {outputPath}")
+
+
+if __name__ == "__main__":
+      # python pricing.py pricing.yaml
+      repriceFile(sys.argv[1] if len(sys.argv) > 1 else "pricing.yaml")
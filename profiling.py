@@ -0,0 +1,160 @@
+import sys
+import json
+import time
+import cProfile
+from functools import wraps
+
+
+## PROFILING ##
+# With GENERAL_SETTINGS.profiling set to timers or cprofile, every replication writes a JSON report of the wall-clock
+# time and calls of its stages to profileFilePath, and start() merges them into one report. Nothing is wrapped when
+# profiling is off (null), so the simulation runs the same code as without this module.
+STAGES = ("activity_reception", "activity_nurse", "activity_doctor", "getRevenue", "update_metrics")
+# Sampler draws behind the nested evaluation functions of the stages (their times are included in the stages)
+EVALUATIONS = {"receptionEvaluation": "receptionPriority", "nurseEvaluation": "nursePriority", "doctorEvaluation": "doctorEntersHospital"}
+
+
+class StageTimers():
+      """ Wall-clock seconds and calls per stage, gathered by wrapping the methods of an instance. Generator stages
+      (SimPy processes) are timed on every resume, so their time excludes the simulated waits and the scheduling
+      between them """
+      def __init__(self):
+            self.seconds = {}
+            self.calls = {}
+            return None
+
+      def __timer__(self, name: str):
+            self.seconds.setdefault(name, 0.0)
+            self.calls.setdefault(name, 0)
+
+      def wrap(self, name: str, function):
+            self.__timer__(name)
+            @wraps(function)
+            def timed(*args, **kwargs):
+                  start = time.perf_counter()
+                  try:
+                        return function(*args, **kwargs)
+                  finally:
+                        self.seconds[name] += time.perf_counter() - start
+                        self.calls[name] += 1
+            return timed
+
+      def wrapGenerator(self, name: str, generatorFunction):
+            self.__timer__(name)
+            @wraps(generatorFunction)
+            def timed(*args, **kwargs):
+                  self.calls[name] += 1
+                  generator = generatorFunction(*args, **kwargs)
+                  sent = None
+                  while True:
+                        start = time.perf_counter()
+                        try:
+                              event = generator.send(sent)
+                        except StopIteration as stop:
+                              self.seconds[name] += time.perf_counter() - start
+                              return stop.value
+                        self.seconds[name] += time.perf_counter() - start
+                        sent = yield event
+            return timed
+
+      def report(self) -> dict:
+            """ Seconds and calls of the stages that ran """
+            return {name: {"seconds": self.seconds[name], "calls": self.calls[name]} for name in self.seconds if self.calls[name]}
+
+
+class ReplicationProfile():
+      """ Profiling of one replication (or long run): stage timers on the Simulation, its samplers and its trace,
+      the wall-clock time of the whole replication and, with cprofile, a cProfile capture saved next to the report
+      (readable with pstats or snakeviz) """
+      def __init__(self,
+                   path: str,
+                   capture: bool
+                   ):
+            self.path = path
+            self.timers = StageTimers()
+            self.profiler = cProfile.Profile() if capture else None
+            self.start = time.perf_counter()
+            if self.profiler is not None:
+                  self.profiler.enable()
+            return None
+
+      @classmethod
+      def fromVariables(cls, variables: dict, replication: int):
+            """ Profile of a replication configured in GENERAL_SETTINGS, or None when profiling is off """
+            settings = variables["GENERAL_SETTINGS"]
+            match (settings["profiling"]):
+                  case None:
+                        return None
+                  case "timers" | "cprofile":
+                        return cls(settings["profileFilePath"].format(replication=replication), settings["profiling"] == "cprofile")
+                  case _:
+                        raise ValueError(f"Unknown profiling mode: {settings['profiling']}")
+
+      def instrument(self, simulation):
+            """ Times the stages of simulation. The activities, getRevenue and the triage draws only run as such on the
+            SimPy engine: the fast engine inlines them, so their reports hold update_metrics, the whole
+            replication and cProfile """
+            if simulation.variables["GENERAL_SETTINGS"]["engine"] != "simpy":
+                  self.instrumentResults(simulation)
+                  return
+            for name in STAGES:
+                  method = getattr(simulation, name)
+                  wrap = self.timers.wrapGenerator if name.startswith("activity_") else self.timers.wrap
+                  setattr(simulation, name, wrap(name, method))
+            for name, draw in EVALUATIONS.items():
+                  setattr(simulation.samplers, draw, self.timers.wrap(name, getattr(simulation.samplers, draw)))
+            if simulation.tracing:
+                  simulation.auxiliaryFunctions.eventPrint = self.timers.wrap("eventPrint", simulation.auxiliaryFunctions.eventPrint)
+
+      def instrumentResults(self, simulation):
+            """ Times update_metrics of a Simulation that only turns accumulators into metrics (a batch of a long run,
+            or a replication of the fast engine) """
+            simulation.update_metrics = self.timers.wrap("update_metrics", simulation.update_metrics)
+
+      def close(self, engine: str):
+            """ Writes the report (and the cProfile capture) of the replication """
+            if self.profiler is not None:
+                  self.profiler.disable()
+                  self.profiler.dump_stats(self.path.rsplit(".", 1)[0] + ".prof")
+            report = {"engine": engine, "replications": 1, "seconds": time.perf_counter() - self.start, "stages": self.timers.report()}
+            with open(self.path, "w") as file:
+                  json.dump(report, file, indent=2)
+
+
+def mergeReports(paths: list) -> dict:
+      """ Sums the replication reports at paths (the ones missing, e.g. served from the result cache, are skipped).
+      unaccounted is the time of the replications outside the top-level stages: SimPy scheduling or the inlined
+      engine, the warm-up reset and the metric collection """
+      merged = {"engine": None, "replications": 0, "seconds": 0.0, "stages": {}}
+      for path in paths:
+            try:
+                  with open(path) as file:
+                        report = json.load(file)
+            except FileNotFoundError:
+                  continue
+            merged["engine"] = report["engine"]
+            merged["replications"] += report["replications"]
+            merged["seconds"] += report["seconds"]
+            for name, timer in report["stages"].items():
+                  stage = merged["stages"].setdefault(name, {"seconds": 0.0, "calls": 0})
+                  stage["seconds"] += timer["seconds"]
+                  stage["calls"] += timer["calls"]
+      # The evaluations and eventPrint run inside the activities
+      topLevel = sum(timer["seconds"] for name, timer in merged["stages"].items() if name in STAGES)
+      merged["unaccounted"] = merged["seconds"] - topLevel
+      return merged
+
+
+def printReport(report: dict):
+      print(f"{report['replications']} replications ({report['engine']} engine), {report['seconds']:.3f} s")
+      print(f"{'stage':<20} {'seconds':>10} {'share':>7} {'calls':>10} {'us/call':>9}")
+      for name, timer in sorted(report["stages"].items(), key=lambda item: -item[1]["seconds"]):
+            perCall = timer["seconds"] / timer["calls"] * 1e6 if timer["calls"] else 0
+            print(f"{name:<20} {timer['seconds']:>10.3f} {timer['seconds'] / report['seconds']:>7.1%} {timer['calls']:>10} {perCall:>9.2f}")
+      print(f"{'unaccounted':<20} {report['unaccounted']:>10.3f} {report['unaccounted'] / report['seconds']:>7.1%}")
+
+
+if __name__ == "__main__":
+      # python profiling.py other/profile_summary.json: stages of a report (or the merge of several replication reports)
+      paths = sys.argv[1:] if len(sys.argv) > 1 else ["other/profile_summary.json"]
+      printReport(json.load(open(paths[0])) if len(paths) == 1 else mergeReports(paths))
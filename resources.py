@@ -0,0 +1,79 @@
+from heapq import heappush, heappop, heapify
+from itertools import count
+
+import simpy as sim
+from simpy.core import BoundClass
+
+
+class HeapQueue():
+      """ Put queue of a priority resource backed by a binary heap.
+
+      sim.PriorityResource keeps its queue in a list that is re-sorted on every request, which gets slow
+      once thousands of patients wait. Requests are kept here as (key, sequence, request): same order as
+      the stable sort of SortedQueue (request key, then arrival order), with O(log n) insertion and removal
+      of the head. SimPy only looks at the head of the put queue ([0], pop(0)) and removes cancelled requests.
+      """
+      def __init__(self, maxlen: int = None):
+            self.maxlen = maxlen
+            self.heap = []
+            self.sequence = count()
+            return None
+
+      def append(self, item):
+            if self.maxlen is not None and len(self.heap) >= self.maxlen:
+                  raise RuntimeError("Cannot append event. Queue is full.")
+            heappush(self.heap, (item.key, next(self.sequence), item))
+
+      def __len__(self):
+            return len(self.heap)
+
+      def __getitem__(self, index: int):
+            if index == 0 and self.heap:
+                  return self.heap[0][2]
+            return self.__ordered__()[index]
+
+      def pop(self, index: int = -1):
+            if index == 0 and self.heap:
+                  return heappop(self.heap)[2]
+            item = self.__ordered__()[index]
+            self.remove(item)
+            return item
+
+      def remove(self, item):
+            """ Removes a (cancelled) request, O(n) """
+            for position, entry in enumerate(self.heap):
+                  if entry[2] is item:
+                        self.heap[position] = self.heap[-1]
+                        self.heap.pop()
+                        heapify(self.heap)
+                        return
+            raise ValueError(f"{item} is not in the queue")
+
+      def __iter__(self):
+            return iter(self.__ordered__())
+
+      def __ordered__(self) -> list:
+            """ Requests in service order (O(n log n), only for inspection) """
+            return [entry[2] for entry in sorted(self.heap)]
+
+
+class HeapPriorityResource(sim.PriorityResource):
+      """ Drop-in sim.PriorityResource whose waiting requests are kept in a HeapQueue """
+      PutQueue = HeapQueue
+
+
+class TimedRequest(sim.resources.resource.Request):
+      """ sim.Request that keeps the time it was made, like sim.PriorityRequest """
+      def __init__(self, resource: sim.Resource):
+            self.time = resource._env.now
+            super().__init__(resource)
+
+
+class TimedResource(sim.Resource):
+      """ sim.Resource whose requests keep the time they were made """
+      request = BoundClass(TimedRequest)
+
+
+def timeInResource(resource: sim.Resource, now: float) -> tuple:
+      """ Time the requests of a (timed or priority) resource have spent so far waiting and in service """
+      return sum(now - request.time for request in resource.queue), sum(now - request.usage_since for request in resource.users)
@@ -0,0 +1,153 @@
+import os
+import csv
+import shutil
+import numpy as np
+
+
+# Extension of the results file (or partitioned directory) of every results format
+FORMATS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+
+def resultsPath(path: str, format: str) -> str:
+      """ path with the extension of the results format """
+      if format not in FORMATS:
+            raise ValueError(f"Unknown results format: {format} ({' | '.join(FORMATS)})")
+      return os.path.splitext(path)[0] + FORMATS[format]
+
+
+def columnType(values) -> str:
+      """ Arrow type of a column holding values: int64, float64 or string """
+      if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            return "int64"
+      if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            return "float64"
+      return "string"
+
+
+def parseColumn(values: list) -> np.ndarray:
+      """ Array of the CSV text of a column, typed like columnType types the columns written: int64 or float64 when
+      every value is a number (empty cells are missing, nan), strings otherwise """
+      try:
+            return np.array(values, dtype=np.int64)
+      except ValueError:
+            pass
+      try:
+            return np.array([float(value) if value else np.nan for value in values])
+      except ValueError:
+            return np.array(values, dtype=str)
+
+
+def readResults(path: str, columns: list = None) -> dict:
+      """ Columns (all by default) of a results file (CSV, or Parquet/Arrow file or partitioned directory) as typed
+      arrays; the columns the file does not have are left out """
+      if path.endswith(".csv"):
+            with open(path, newline="") as file:
+                  reader = csv.reader(file)
+                  header = next(reader)
+                  rows = list(reader)
+            indices = {column: index for index, column in enumerate(header)}
+            return {column: parseColumn([row[indices[column]] for row in rows]) for column in (header if columns is None else columns)
+                    if column in indices}
+      try:
+            import pyarrow.dataset as ds
+      except ImportError as error:
+            raise ImportError("Parquet and Arrow results need pyarrow (pip install pyarrow)") from error
+      dataset = ds.dataset(path, format="parquet" if path.rstrip("/").endswith(".parquet") else "ipc", partitioning="hive")
+      table = dataset.to_table(columns=None if columns is None else [column for column in columns if column in dataset.schema.names])
+      return {column: table[column].to_numpy() for column in table.column_names}
+
+
+class ResultsWriter():
+      """ Buffers result rows in memory and writes them batchSize rows at a time: as CSV text, or as typed columns
+      in Parquet row groups or Arrow IPC record batches (pyarrow). Columns are float64 unless types says otherwise.
+
+      With partitionBy, Parquet and Arrow results go to a directory with one subdirectory per value of that
+      column (hive style, e.g. scenario=3/), each batch adding a file to the partitions it touches.
+      """
+      def __init__(self,
+                   path: str,
+                   columns: list,
+                   format: str = "csv",
+                   batchSize: int = 1000,
+                   partitionBy: str = None,
+                   types: dict = None
+                   ):
+            if format not in FORMATS:
+                  raise ValueError(f"Unknown results format: {format} ({' | '.join(FORMATS)})")
+            self.path = path
+            self.columns = columns
+            self.format = format
+            self.batchSize = batchSize
+            self.partitionBy = partitionBy
+            self.rows = []
+            self.batches = 0
+            self.writer = None
+
+            if format == "csv":
+                  self.file = open(path, "w", newline="")
+                  self.csvWriter = csv.writer(self.file, delimiter = ",")
+                  self.csvWriter.writerow(columns)
+                  return None
+
+            try:
+                  import pyarrow as pa
+            except ImportError as error:
+                  raise ImportError(f"Results format {format} needs pyarrow (pip install pyarrow)") from error
+            self.pa = pa
+            self.schema = pa.schema([(column, (types or {}).get(column, "float64")) for column in columns])
+            # Like the CSV, the results of a previous run are replaced
+            if os.path.isdir(path):
+                  shutil.rmtree(path)
+            elif os.path.exists(path):
+                  os.remove(path)
+            return None
+
+      def __enter__(self):
+            return self
+
+      def __exit__(self, *exception):
+            self.close()
+
+      def write(self, row: list):
+            self.rows.append(row)
+            if len(self.rows) >= self.batchSize:
+                  self.flush()
+
+      def flush(self):
+            """ Writes the buffered rows """
+            if not self.rows:
+                  return
+            if self.format == "csv":
+                  self.csvWriter.writerows(self.rows)
+                  self.file.flush()
+            else:
+                  self.__writeTable__(self.pa.table([self.pa.array(values, type=field.type) for values, field in zip(zip(*self.rows), self.schema)],
+                                                    schema=self.schema))
+            self.rows = []
+            self.batches += 1
+
+      def __writeTable__(self, table):
+            if self.partitionBy is not None:
+                  import pyarrow.dataset as ds
+                  extension = FORMATS[self.format][1:]
+                  ds.write_dataset(table, self.path, format="parquet" if self.format == "parquet" else "ipc",
+                                   partitioning=[self.partitionBy], partitioning_flavor="hive",
+                                   basename_template=f"part-{self.batches}-{{i}}.{extension}",
+                                   existing_data_behavior="overwrite_or_ignore")
+                  return
+            if self.writer is None:
+                  if self.format == "parquet":
+                        import pyarrow.parquet as pq
+                        self.writer = pq.ParquetWriter(self.path, self.schema)
+                  else:
+                        self.writer = self.pa.ipc.new_file(self.path, self.schema)
+            self.writer.write_table(table)
+
+      def close(self):
+            self.flush()
+            if self.format != "csv" and self.writer is None and self.partitionBy is None:
+                  self.__writeTable__(self.schema.empty_table()) # the file exists even without results
+            if self.format == "csv":
+                  self.file.close()
+            elif self.writer is not None:
+                  self.writer.close()
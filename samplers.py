@@ -0,0 +1,79 @@
+import bisect
+from itertools import chain
+import numpy as np
+
+from streams import RandomStreams
+from arrivals import interArrivalTimes
+from parameters import ModelParameters
+
+
+class VariateBuffer():
+      """ Hands out variates one by one from blocks drawn with a single numpy call """
+      def __init__(self,
+                   draw,
+                   blockSize: int
+                   ):
+            self.draw = draw
+            self.blockSize = blockSize
+            # Blocks are drawn lazily, when the previous one is used up, and consumed through a C-level
+            # iterator (as python scalars, which are cheaper to consume than numpy ones)
+            self.next = chain.from_iterable(self.__blocks__()).__next__
+            return None
+
+      def __blocks__(self):
+            while True:
+                  yield self.draw(self.blockSize).tolist()
+
+
+class Samplers():
+      """ Buffered variates of every stochastic source of a replication.
+
+      Service times are drawn as standard exponentials and scaled by the mean of the patient's
+      priority, and assessments invert cumulative-probability tables built once per run, so the
+      values match what the streams would give if they were sampled one at a time. Priorities
+      are handled as codes (see PRIORITY_MAP).
+      """
+      def __init__(self,
+                   parameters: ModelParameters,
+                   streams: RandomStreams,
+                   blockSize: int
+                   ):
+            # 1. Arrivals (the generator replays them: constant rate or hour-of-day/day-of-week profile, see arrivals.py)
+            self.interArrival = VariateBuffer(interArrivalTimes(parameters.interArrivalMean, parameters.arrivalProfile, streams.arrival), blockSize)
+
+            # 2. Reception
+            receptionMean = parameters.receptionMean
+            self.receptionService = VariateBuffer(lambda size: receptionMean * streams.receptionService.standard_exponential(size), blockSize)
+            receptionTable = parameters.receptionTable
+            self.receptionAssesment = VariateBuffer(lambda size: np.searchsorted(receptionTable, streams.receptionAssesment.random(size), side="right") + 1, blockSize)
+
+            # 3. Nurse
+            self.nurseServiceMean = parameters.nurseServiceMean
+            self.nurseService = VariateBuffer(streams.nurseService.standard_exponential, blockSize)
+            self.nurseTables = parameters.nurseTables
+            self.nurseUniforms = VariateBuffer(streams.nurseAssesment.random, blockSize)
+
+            # 4. Doctor
+            self.doctorServiceMean = parameters.doctorServiceMean
+            self.doctorService = VariateBuffer(streams.doctorService.standard_exponential, blockSize)
+            self.doctorEnterProbability = parameters.doctorEnterProbability
+            self.doctorUniforms = VariateBuffer(streams.doctorAssesment.random, blockSize)
+
+            # Sources that need no per-patient work are handed out straight from their buffer
+            self.interArrivalTime = self.interArrival.next
+            self.receptionServiceTime = self.receptionService.next
+            self.receptionPriority = self.receptionAssesment.next
+            return None
+
+      def nurseServiceTime(self, priority: int):
+            return self.nurseService.next() * self.nurseServiceMean[priority]
+
+      def nursePriority(self, currentPriority: int):
+            """ Re-evaluated priority of a patient after the nurse assessment """
+            return bisect.bisect_right(self.nurseTables[currentPriority], self.nurseUniforms.next()) + 1
+
+      def doctorServiceTime(self, priority: int):
+            return self.doctorService.next() * self.doctorServiceMean[priority]
+
+      def doctorEntersHospital(self, priority: int):
+            return self.doctorUniforms.next() < self.doctorEnterProbability[priority]
@@ -1,26 +1,45 @@
-import random 
 import os
+import sys
 import csv
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 import simpy as sim
 import numpy as np
 
-from utilities import AuxiliaryFunctions
-import yaml
+from utilities import AuxiliaryFunctions, PRIORITY_MAP, PRIORITY_NAMES, CRITICAL, URGENT, NON_URGENT
+from metrics import (newAccumulators, collectMetricsValues, resetWarmUpMetrics, closeBatch, PRIORITY_SLOTS, TOTAL_TIME, TOTAL_PATIENTS, DECLINED, ARRIVAL_TIME,
+                     RECEPTION_SERVICE, RECEPTION_WAITING, NURSE_TOTAL, DOCTOR_TOTAL, REVENUE, EXPENSES, ENTER_COUNT, EXIT_COUNT, ENTER_BY_PRIORITY, EXIT_BY_PRIORITY, STAFFED_TIME, COUNT,
+                     NURSE_PATIENTS, NURSE_SERVICE, NURSE_WAITING, NURSE_REVALUATIONS, DOCTOR_PATIENTS, DOCTOR_SERVICE, DOCTOR_WAITING, DOCTOR_ENTER,
+                     SKETCH_BINS, RECEPTION_WAITING_SKETCH, RECEPTION_SERVICE_SKETCH, NURSE_WAITING_SKETCH, NURSE_SERVICE_SKETCH,
+                     DOCTOR_WAITING_SKETCH, DOCTOR_SERVICE_SKETCH, LENGTH_OF_STAY_SKETCH, MEASURED_TIME, TAIL_METRICS, PRICING_METRICS, STAFF_METRICS, sketchBin)
+from streams import RandomStreams
+from samplers import Samplers
+from engine import HeapEngine
+from resources import HeapPriorityResource, TimedResource, timeInResource
+from warmup import withWarmUp, warmUpSnapshots
+from confidence import RunningStatistics
+from cache import ResultCache
+from results import ResultsWriter, resultsPath
+from journeys import Journey, JourneyLog, DECLINED_ACCESS, LEFT_AFTER_RECEPTION, LEFT_AFTER_NURSE, DISCHARGED, ADMITTED
+from levels import LevelSeries
+from parameters import ModelParameters, loadVariables
+from profiling import ReplicationProfile, mergeReports
 
 
 class Simulation():
-      def __init__(self) -> None:
+      def __init__(self, variables: dict = None, path: str = "paramters.yaml", parameters: ModelParameters = None) -> None:
             
-            self.variables = yaml.load(open("paramters.yaml"), Loader=yaml.FullLoader)
+            if variables is None:
+                  variables = loadVariables(path)
+            self.variables = variables
+            # Validated once and compiled into tables by priority code for the samplers and engines (the replications
+            # of a scenario get the parameters compiled in the parent process)
+            self.parameters = ModelParameters.fromVariables(variables) if parameters is None else parameters
 
             self.auxiliaryFunctions = AuxiliaryFunctions(self.variables)
-            self.priority_map = {
-                  "critical": 1,
-                  "urgent": 2,
-                  "moderate": 3,
-                  "low": 4,
-                  "non-urgent": 5
-            }
+            self.priority_map = PRIORITY_MAP
             self.__metrics__()
             self.currentReceptionWaitingRoomCapacity = 0
             
@@ -28,74 +47,10 @@ class Simulation():
       
       def __metrics__(self):
             """ Initializes metrics """
-            self.metricsValues = {
-                  # 1. General metrics
-                  "general_totalTime": 0,
-                  "general_totalPatients": 0,
-                  # 2. Proportions of patients
-                  "count_totalCriticalPatients": 0,
-                  "count_totalUrgentPatients": 0,
-                  "count_totalModeratePatients": 0,
-                  "count_totalLowPatients": 0,
-                  "count_totalNonUrgentPatients": 0,
-                  "count_totalPatientsDeclinedAccess": 0,
-                  # 3. Arrival metrics
-                  "arrival_totalArrivalTime": 0,
-                  # 4. Reception metrics
-                  "reception_totalServiceTime": 0,
-                  "reception_totalWaitingInQueueTime": 0,
-                  # 5. Nurse metrics
-                  # 5.1 Proportions
-                  "nurse_totalPatients": 0,
-                  "nurse_totalPatientsModerate": 0,
-                  "nurse_totalPatientsLow": 0,
-                  # 5.2 Service time
-                  "nurse_totalServiceTimeModerate": 0,
-                  "nurse_totalServiceTimeLow": 0,
-                  # 5.3 Waiting in queue
-                  "nurse_totalWaitingInQueueTimeModerate": 0,
-                  "nurse_totalWaitingInQueueTimeLow": 0,
-                  # 5.4 Revaluations
-                  # 5.4.1 Moderate
-                  "nurse_revaluations_moderate_toCritical": 0,
-                  "nurse_revaluations_moderate_toUrgent": 0,
-                  "nurse_revaluations_moderate_toModerate": 0,
-                  "nurse_revaluations_moderate_toLow": 0,
-                  "nurse_revaluations_moderate_toNon-urgent": 0,
-                  # 5.4.2 Low
-                  "nurse_revaluations_low_toCritical": 0,
-                  "nurse_revaluations_low_toUrgent": 0,
-                  "nurse_revaluations_low_toModerate": 0,
-                  "nurse_revaluations_low_toLow": 0,
-                  "nurse_revaluations_low_toNon-urgent": 0,
-                  # 6. Doctor metrics
-                  # 6.1 Proportions
-                  "doctor_totalPatients": 0,
-                  "doctor_totalPatientsCritical": 0,
-                  "doctor_totalPatientsUrgent": 0,
-                  "doctor_totalPatientsModerate": 0,
-                  "doctor_totalPatientsLow": 0,
-                  # 6.2 Service time
-                  "doctor_totalServiceTimeCritical": 0,
-                  "doctor_totalServiceTimeUrgent": 0,
-                  "doctor_totalServiceTimeModerate": 0,
-                  "doctor_totalServiceTimeLow": 0,
-                  # 6.3 Waiting in queue
-                  "doctor_totalWaitingInQueueTimeCritical": 0,
-                  "doctor_totalWaitingInQueueTimeUrgent": 0,
-                  "doctor_totalWaitingInQueueTimeModerate": 0,
-                  "doctor_totalWaitingInQueueTimeLow": 0,
-                  # 6.4 Doctor Assesment
-                  "doctor_assesment_criticalEnterHospitalCount": 0,
-                  "doctor_assesment_urgentEnterHospitalCount": 0,
-                  "doctor_assesment_moderateEnterHospitalCount": 0,
-                  "doctor_assesment_lowEnterHospitalCount": 0,         
-                  # 7. Financials 
-                  "financials_revenue_total": 0,
-                  "financials_expenses_total": 0,
-                  "financials_hospital_enterCount": 0,
-                  "financials_hospital_exitCount": 0         
-            }
+            # Raw metrics are accumulated in a flat buffer indexed by priority code (see metrics.py);
+            # metricsValues is built out of it once the run is over
+            self.accumulators = newAccumulators()
+            self.metricsValues = collectMetricsValues(self.accumulators)
             self.metrics = {
                   # 1. General metrics
                   "general_totalTime": 0,
@@ -195,7 +150,22 @@ class Simulation():
                   "financials_expenses_perPatientAverage": 0,
                   # 7.3 Profit
                   "financials_profit_total": 0,
-                  "financials_profit_perPatientAverage": 0
+                  "financials_profit_perPatientAverage": 0,
+                  # 7.4 Pricing statistics: the price-independent counts and times the financials are computed from (see pricing.py)
+                  **{metricName: 0 for metricName in PRICING_METRICS + STAFF_METRICS},
+                  # 8. Tail quantiles of the waits, service times and length of stay (see metrics.TAIL_SKETCHES)
+                  **{metricName: 0 for metricName in TAIL_METRICS},
+                  # 9. Time-weighted levels (averages over the time after the warm-up)
+                  "reception_queueLength_average": 0,
+                  "reception_inService_average": 0,
+                  "reception_utilization": 0,
+                  "reception_waitingRoom_averageOccupancy": 0,
+                  "nurse_queueLength_average": 0,
+                  "nurse_inService_average": 0,
+                  "nurse_utilization": 0,
+                  "doctor_queueLength_average": 0,
+                  "doctor_inService_average": 0,
+                  "doctor_utilization": 0
             }
 
       def update_metrics(self):
@@ -303,23 +273,40 @@ class Simulation():
                         # 7.3 Profit
                         self.metrics["financials_profit_total"] = self.metricsValues["financials_revenue_total"] - self.metricsValues["financials_expenses_total"]
                         self.metrics["financials_profit_perPatientAverage"] = (self.metricsValues["financials_revenue_total"] - self.metricsValues["financials_expenses_total"]) / self.metricsValues["general_totalPatients"]
+                        # 7.4 Pricing statistics
+                        for metricName in PRICING_METRICS:
+                              self.metrics[metricName] = self.metricsValues[metricName]
+                        for metricName, staff in zip(STAFF_METRICS, (self.parameters.receptionists, self.parameters.nurses, self.parameters.doctors)):
+                              self.metrics[metricName] = staff
+                        # 8. Tail quantiles
+                        for metricName in TAIL_METRICS:
+                              self.metrics[metricName] = self.metricsValues[metricName]
+                        # 9. Time-weighted levels
+                        measuredTime = self.metricsValues["levels_measuredTime"]
+                        if measuredTime > 0:
+                              for stage, resource in (("reception", "receptionist"), ("nurse", "nurse"), ("doctor", "doctor")):
+                                    self.metrics[f"{stage}_queueLength_average"] = self.metricsValues[f"{stage}_queueLengthArea"] / measuredTime
+                                    self.metrics[f"{stage}_inService_average"] = self.metricsValues[f"{stage}_inServiceArea"] / measuredTime
+                                    self.metrics[f"{stage}_utilization"] = self.metrics[f"{stage}_inService_average"] / self.variables["RESOURCES_CAPACITY"][resource]
+                              # Patients in the waiting room are waiting for or with a receptionist
+                              self.metrics["reception_waitingRoom_averageOccupancy"] = self.metrics["reception_queueLength_average"] + self.metrics["reception_inService_average"]
 
-      def _isWarmUpOver_(self):
-            """ Checks if the warm up period is over """
-            return self.env.now >= self.variables["GENERAL_SETTINGS"]["warmUpPeriod"]
-      
       def __generator__(self):
             """ Generates patients"""
             patient_id = 0  # Starting counter
+            # In a long run (horizon) patients keep arriving until the run is stopped
+            totalPatients = self.variables["GENERAL_SETTINGS"]["totalPatients"] if self.variables["GENERAL_SETTINGS"]["horizon"] is None else math.inf
             
-            for i in range(self.variables["GENERAL_SETTINGS"]["totalPatients"]):
+            while patient_id < totalPatients:
                   startGenarationTime = self.env.now
                   patient_id += 1  # Increment ID for each new patient
                   # Create a new patient object for each process
                   patient = {
                         "id": patient_id, 
                         "priority": None, 
-                        "enterHospital": None
+                        "enterHospital": None,
+                        "arrival": self.env.now,
+                        "journey": Journey(patient_id, self.env.now) if self.journeys is not None else None
                   }
                   self.currentReceptionWaitingRoomCapacity += 1
                   
@@ -327,23 +314,25 @@ class Simulation():
                   self.env.process(self.__activity__(patient))
                   
                   # Wait for next arrival
-                  timeBetweenArrivals = random.expovariate(1/self.variables["ARRIVAL"]["arrivalRate"])
+                  timeBetweenArrivals = self.samplers.interArrivalTime()
                   yield self.env.timeout(timeBetweenArrivals) # Let other patients arrive
-                  if self._isWarmUpOver_():
-                        self.metricsValues["general_totalTime"] = self.env.now
-                        self.metricsValues["arrival_totalArrivalTime"] += self.env.now - startGenarationTime
+                  self.accumulators[TOTAL_TIME] = self.env.now
+                  self.accumulators[ARRIVAL_TIME] += self.env.now - startGenarationTime
       
       def __activity__(self, patient):
             """ Simulates activity of the patients """
             
-            if (self._isWarmUpOver_()):
-                  self.metricsValues["general_totalPatients"] += 1
+            self.accumulators[TOTAL_PATIENTS] += 1
 
             # 1st Stage: Reception
             yield from self.activity_reception(patient)  
-            if (patient["priority"] == "non-urgent"):
-                  if (self._isWarmUpOver_()):
-                        self.metricsValues["count_totalNonUrgentPatients"] += 1
+            if (patient["priority"] == NON_URGENT):
+                  self.accumulators[COUNT + NON_URGENT] += 1
+                  if patient["journey"] is not None:
+                        if patient["journey"].disposition != DECLINED_ACCESS:
+                              patient["journey"].disposition = LEFT_AFTER_RECEPTION
+                        self.journeys.record(patient["journey"])
+                  if self.tracing:
                         self.auxiliaryFunctions.eventPrint(eventStage="exit",
                                                          justArrived=False,
                                                          patient_id=patient["id"],
@@ -352,17 +341,20 @@ class Simulation():
                   return  # Exit after reception
             
             # 2nd Stage: Nurse - All patients that are not critical or urgent go to nurse now, including non-urgent
-            if (patient["priority"] not in ["critical", "urgent"]):
+            if (patient["priority"] not in (CRITICAL, URGENT)):
                   yield from self.activity_nurse(patient)
                   # Non-urgent patients leave after nurse assessment
-                  if (patient["priority"] == "non-urgent"):
-                        if (self._isWarmUpOver_()):
-                              self.metricsValues["count_totalNonUrgentPatients"] += 1
-                        self.auxiliaryFunctions.eventPrint(eventStage="exit",
-                                                         justArrived=False,
-                                                         patient_id=patient["id"],
-                                                         time=self.env.now,
-                                                         otherInfo="Patient exited after nurse assessment due to non-urgent priority")
+                  if (patient["priority"] == NON_URGENT):
+                        self.accumulators[COUNT + NON_URGENT] += 1
+                        if patient["journey"] is not None:
+                              patient["journey"].disposition = LEFT_AFTER_NURSE
+                              self.journeys.record(patient["journey"])
+                        if self.tracing:
+                              self.auxiliaryFunctions.eventPrint(eventStage="exit",
+                                                               justArrived=False,
+                                                               patient_id=patient["id"],
+                                                               time=self.env.now,
+                                                               otherInfo="Patient exited after nurse assessment due to non-urgent priority")
                         return  # Exit after nurse assessment
 
             # 3rd Stage: Doctor
@@ -371,305 +363,477 @@ class Simulation():
             # Calculate financials
             self.getRevenue(patient)
 
-            self.auxiliaryFunctions.eventPrint(eventStage="exit",
-                                                 justArrived=False,
-                                                 patient_id=patient["id"],
-                                                 time=self.env.now,
-                                                 otherInfo=f"{ 'entering hospital' if patient['enterHospital'] == 'yes' else 'not entering hospital' } -- priority: {patient['priority']}\
-                                                      -- Financials: {self.metricsValues['financials_revenue_total']}")
+            if self.tracing:
+                  self.auxiliaryFunctions.eventPrint(eventStage="exit",
+                                                       justArrived=False,
+                                                       patient_id=patient["id"],
+                                                       time=self.env.now,
+                                                       otherInfo=f"{ 'entering hospital' if patient['enterHospital'] == 'yes' else 'not entering hospital' } -- priority: {PRIORITY_NAMES[patient['priority']]}\
+                                                            -- Financials: {self.accumulators[REVENUE]}")
       
-      def __resetMetrics__(self):
-            for metric in self.metricsValues:
-                  self.metricsValues[metric] = 0
-            for metric in self.metrics:
-                  self.metrics[metric] = 0
-
-      def __setUp__(self):
-            """Set ups a simulation instance to be ran """
+      def __startSimPy__(self):
+            """ SimPy environment, resources and patient generator of a replication """
             self.env = sim.Environment()
             
-            # Change the nurse resource to a PriorityResource
-            self.receptionist = sim.Resource(self.env, capacity=self.variables["RESOURCES_CAPACITY"]["receptionist"])
-            self.nurse = sim.PriorityResource(self.env, capacity=self.variables["RESOURCES_CAPACITY"]["nurse"])
-            self.doctor = sim.PriorityResource(self.env, capacity=self.variables["RESOURCES_CAPACITY"]["doctor"])
+            # Nurse and doctor serve by priority (heap-backed, so long queues in overload stay cheap)
+            self.receptionist = TimedResource(self.env, capacity=self.parameters.receptionists)
+            self.nurse = HeapPriorityResource(self.env, capacity=self.parameters.nurses)
+            self.doctor = HeapPriorityResource(self.env, capacity=self.parameters.doctors)
             
             self.env.process(self.__generator__())
-            self.env.run()
 
-            # Calculate expenses
-            self.expenses(currentTime = self.env.now)
+      def __carryOverSimPy__(self, now: float) -> tuple:
+            """ Time the patients waiting and in service have spent so far (see metrics.resetWarmUpMetrics) """
+            return timeInResource(self.receptionist, now) + timeInResource(self.nurse, now) + timeInResource(self.doctor, now)
+
+      def __runSimPy__(self):
+            """ Runs the replication on SimPy processes (reference engine) and returns the simulated end time """
+            self.__startSimPy__()
+            # Warm-up: metrics are recorded from the start and what was recorded before warmUpPeriod is dropped
+            # in one go, instead of checking the clock on every update
+            warmUpPeriod = self.variables["GENERAL_SETTINGS"]["warmUpPeriod"]
+            self.__stepUntil__(warmUpPeriod)
+            resetWarmUpMetrics(self.accumulators, self.__carryOverSimPy__(warmUpPeriod))
+            if self.levelSeries is None:
+                  self.env.run()
+            else:
+                  self.__stepUntil__(float("inf"))
+            return self.env.now
+
+      def __stepUntil__(self, until: float):
+            """ Processes the events before until, sampling the levels (when levelSeries is on) as the clock goes past
+            each sampling time, like the fast engine """
+            nextSample = self.levelSeries.nextTime if self.levelSeries is not None else float("inf")
+            while self.env.peek() < until:
+                  if self.env.peek() >= nextSample:
+                        nextSample = self.levelSeries.record(self.env.peek(), len(self.receptionist.queue), self.receptionist.count,
+                                                             self.currentReceptionWaitingRoomCapacity, len(self.nurse.queue), self.nurse.count,
+                                                             len(self.doctor.queue), self.doctor.count)
+                  self.env.step()
+
+      def __open__(self, replication: int):
+            """ Streams, samplers, trace, journey log and level samples of a replication """
+            # Every replication draws from its own streams, so it gives the same results in any process
+            self.streams = RandomStreams.fromVariables(self.variables, replication)
+            self.samplers = Samplers(self.parameters, self.streams, self.variables["GENERAL_SETTINGS"]["samplerBlockSize"])
+
+            self.auxiliaryFunctions.startTrace(replication)
+            self.tracing = self.auxiliaryFunctions.tracing
+            self.journeys = JourneyLog.fromVariables(self.variables, replication)
+            self.levelSeries = LevelSeries.fromVariables(self.variables, replication)
+            # Stage timers wrap the methods of this instance only when profiling is on
+            self.profile = ReplicationProfile.fromVariables(self.variables, replication)
+            if self.profile is not None:
+                  self.profile.instrument(self)
+
+      def __close__(self):
+            self.auxiliaryFunctions.closeTrace()
+            if self.journeys is not None:
+                  self.journeys.close()
+            if self.levelSeries is not None:
+                  self.levelSeries.close()
+
+      def __setUp__(self, replication: int = 0, warmState = None):
+            """Set ups a simulation instance to be ran and returns its metrics. With a warmState (see
+            warmup.warmUpSnapshots) the replication forks from it instead of simulating its own warm-up """
+            if self.variables["GENERAL_SETTINGS"]["horizon"] is not None:
+                  raise ValueError("With a horizon the simulation is one long run split into batches (Simulation.start), not replications")
+            self.__open__(replication)
+            # The trace is closed (a memory ring written out) even when the replication fails
+            try:
+                  match (self.variables["GENERAL_SETTINGS"]["engine"]):
+                        case "simpy":
+                              endTime = self.__runSimPy__()
+                        case "fast" if warmState is not None:
+                              endTime = warmState.fork(self.accumulators, self.samplers, self.journeys, self.levelSeries).run()
+                        case "fast":
+                              engine = HeapEngine(self.parameters, self.accumulators, self.samplers, self.journeys, self.levelSeries)
+                              engine.run(until=self.variables["GENERAL_SETTINGS"]["warmUpPeriod"])
+                              resetWarmUpMetrics(self.accumulators, engine.carryOver(self.variables["GENERAL_SETTINGS"]["warmUpPeriod"]))
+                              endTime = engine.run()
+                        case _:
+                              raise ValueError(f"Unknown engine: {self.variables['GENERAL_SETTINGS']['engine']}")
+            finally:
+                  self.__close__()
+            results = self.__results__(replication, endTime)
+            if self.profile is not None:
+                  self.profile.close(self.variables["GENERAL_SETTINGS"]["engine"])
+            return results
+
+      def __longRun__(self):
+            """ Simulates one replication up to horizon and yields the metrics of each of its batchCount batches (equal
+            stretches of simulated time after the warm-up), as soon as the clock gets past it. Patients are dropped as
+            they leave and the calendar only holds the next arrival and the services in progress, so memory stays flat """
+            settings = self.variables["GENERAL_SETTINGS"]
+            warmUpPeriod, horizon, batchCount = settings["warmUpPeriod"], settings["horizon"], settings["batchCount"]
+            if horizon <= warmUpPeriod:
+                  raise ValueError(f"The horizon ({horizon}) must be past the warm-up period ({warmUpPeriod})")
+            self.__open__(0)
+            match (settings["engine"]):
+                  case "simpy":
+                        self.__startSimPy__()
+                        def advance(until):
+                              self.__stepUntil__(until)
+                              return self.__carryOverSimPy__(until)
+                  case "fast":
+                        engine = HeapEngine(self.parameters, self.accumulators, self.samplers, self.journeys, self.levelSeries)
+                        def advance(until):
+                              engine.run(until=until)
+                              return engine.carryOver(until)
+                  case _:
+                        raise ValueError(f"A long run (horizon) needs engine: simpy or fast (got {settings['engine']})")
+
+            boundaries = [warmUpPeriod + (horizon - warmUpPeriod) * batch / batchCount for batch in range(batchCount + 1)]
+            closeBatch(self.accumulators, advance(warmUpPeriod)) # warm-up
+            try:
+                  for batch, (start, end) in enumerate(zip(boundaries, boundaries[1:])):
+                        batchSimulation = Simulation(self.variables, parameters=self.parameters)
+                        if self.profile is not None:
+                              self.profile.instrumentResults(batchSimulation)
+                        batchSimulation.accumulators[:] = closeBatch(self.accumulators, advance(end))
+                        yield batchSimulation.__results__(batch, end, start)
+            finally:
+                  self.__close__()
+                  if self.profile is not None:
+                        self.profile.close(settings["engine"])
+
+      def __results__(self, replication: int, endTime: float, startTime: float = None):
+            """ Turns the accumulators of a finished replication into its metrics, or those of the batch of a long
+            run from startTime to endTime (replication is then the batch) """
+            if startTime is None:
+                  # Calculate expenses
+                  self.expenses(currentTime = endTime)
+                  # Time-weighted levels are measured from the end of the warm-up to the last event
+                  self.accumulators[MEASURED_TIME] = max(endTime - self.variables["GENERAL_SETTINGS"]["warmUpPeriod"], 0)
+            else:
+                  self.expenses(currentTime = endTime - startTime)
+                  self.accumulators[MEASURED_TIME] = endTime - startTime
 
             # Update metrics before storing results
+            self.metricsValues = collectMetricsValues(self.accumulators)
             self.update_metrics()
-            
-            
-            # Storing results
-            with open(self.variables["GENERAL_SETTINGS"]["csvFilePath"], "a") as file:
-                  writer = csv.writer(file, delimiter = ",")
-                  writer.writerow([metricValue for metricValue in self.metrics.values()])
-            print(f"Simulation results are {self.metricsValues} completed")
+            self.auxiliaryFunctions.summaryPrint(f"{'Replication' if startTime is None else 'Batch'} {replication}: simulation results are {self.metricsValues} completed")
+            self.auxiliaryFunctions.closeTrace()
+
+            return dict(self.metrics)
+
+      def start(self, workers: int = None):
+            """ Runs all replications, in parallel when more than one worker is available, and stores their results in replication order
+            (resultsFormat, written resultsBatchSize rows at a time).
 
-      def start(self):
-            # <<==>> ADD MULTIHIREADING HERE <<==>>
-            with open(self.variables["GENERAL_SETTINGS"]["csvFilePath"], "w") as file:
+            With adaptiveRuns, replications are added (from minRuns up to maxRuns) until the confidence interval of every
+            adaptiveMetrics mean is within adaptiveRelativeHalfWidth of it. Either way, the mean, std and confidence
+            interval of every metric go to a summary file next to the per-run CSV.
+
+            With a horizon, one long replication is simulated instead and its batchCount batches take the place of
+            the replications: one row each, and batch-means confidence intervals in the summary.
+            """
+            settings = self.variables["GENERAL_SETTINGS"]
+            if workers is None:
+                  workers = settings["workers"] or os.cpu_count()
+            longRun = settings["horizon"] is not None
+            adaptive = settings["adaptiveRuns"] and not longRun
+            numberOfRuns = settings["maxRuns"] if adaptive else settings["numberOfRuns"]
+            if settings["warmUpDetection"] != "fixed":
+                  self.variables = withWarmUp(self.variables, self.parameters)
+                  self.auxiliaryFunctions.summaryPrint(f"Detected warm-up period: {self.variables['GENERAL_SETTINGS']['warmUpPeriod']} minutes")
+            # Warm-up simulated once per warm-start run; the replications fork from these states
+            warmStates = warmUpSnapshots(self.variables, self.parameters) if settings["warmStartRuns"] and not longRun else None
+
+            statistics = {metricName: RunningStatistics() for metricName in self.metrics.keys()}
+            runs = 0
+            resultsFormat = settings["resultsFormat"]
+            with ResultsWriter(resultsPath(settings["csvFilePath"], resultsFormat), list(self.metrics.keys()),
+                               resultsFormat, settings["resultsBatchSize"]) as writer:
+                  for metrics in self.__longRun__() if longRun else self.__replications__(numberOfRuns, workers, warmStates):
+                        writer.write([metricValue for metricValue in metrics.values()])
+                        for metricName, metricValue in metrics.items():
+                              statistics[metricName].update(metricValue)
+                        runs += 1
+                        if adaptive and runs >= settings["minRuns"] and self.__converged__(statistics):
+                              break
+
+            self.auxiliaryFunctions.summaryPrint(f"{runs} {'batches' if longRun else 'replications'} ran")
+            self.__writeSummary__(statistics)
+            if settings["profiling"] is not None:
+                  self.__writeProfile__(1 if longRun else runs)
+            cache = ResultCache.fromVariables(self.variables)
+            if cache is not None:
+                  cache.evict()
+
+      def __replications__(self, numberOfRuns: int, workers: int, warmStates: list = None):
+            """ Yields the metrics of each replication, in replication order """
+            blocks = [range(replication, replication + 1) for replication in range(numberOfRuns)]
+            if workers <= 1 or len(blocks) <= 1:
+                  for block in blocks:
+                        yield from runReplicationBlock(self.variables, self.parameters, block, warmStates)
+                  return
+
+            # Only a few blocks per worker are submitted ahead, so stopping early (adaptive runs) wastes little
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(blocks)))
+            try:
+                  pending = deque()
+                  for block in blocks:
+                        pending.append(executor.submit(runReplicationBlock, self.variables, self.parameters, block, warmStates))
+                        if len(pending) >= 2 * workers:
+                              yield from pending.popleft().result()
+                  while pending:
+                        yield from pending.popleft().result()
+            finally:
+                  executor.shutdown(cancel_futures=True)
+
+      def __writeProfile__(self, runs: int):
+            """ Merges the profiles of the first runs replications into the summary report, profileFilePath with
+            replication "summary" """
+            settings = self.variables["GENERAL_SETTINGS"]
+            report = mergeReports([settings["profileFilePath"].format(replication=replication) for replication in range(runs)])
+            summaryPath = settings["profileFilePath"].format(replication="summary")
+            with open(summaryPath, "w") as file:
+                  json.dump(report, file, indent=2)
+            self.auxiliaryFunctions.summaryPrint(f"Profile of {report['replications']} replications written to {summaryPath}")
+
+      def __converged__(self, statistics: dict) -> bool:
+            """ Whether the confidence interval of every adaptiveMetrics mean is narrow enough. A metric that no
+            replication so far has a value for (NaN, e.g. a tail quantile of a class no patient reached) has no mean to
+            estimate, so it does not hold the runs back """
+            settings = self.variables["GENERAL_SETTINGS"]
+            return all(statistics[metricName].count == 0
+                       or statistics[metricName].relativeHalfWidth(settings["confidenceLevel"]) <= settings["adaptiveRelativeHalfWidth"]
+                       for metricName in settings["adaptiveMetrics"])
+
+      def __writeSummary__(self, statistics: dict):
+            """ Mean, std and confidence interval of every metric, next to the per-run CSV (<name>_summary.csv). runs
+            counts the runs with a value, missing the ones where the metric is undefined (NaN) """
+            confidence = self.variables["GENERAL_SETTINGS"]["confidenceLevel"]
+            root, extension = os.path.splitext(self.variables["GENERAL_SETTINGS"]["csvFilePath"])
+            with open(f"{root}_summary{extension}", "w") as file:
                   writer = csv.writer(file, delimiter = ",")
-                  writer.writerow([metricName for metricName in self.metrics.keys()])
-            numberOfRuns = self.variables["GENERAL_SETTINGS"]["numberOfRuns"]
-            for i in range(numberOfRuns):
-                  self.__setUp__()
-                  self.__resetMetrics__()
+                  writer.writerow(["metric", "runs", "missing", "mean", "std", "ciLower", "ciUpper", "relativeHalfWidth"])
+                  for metricName, metricStatistics in statistics.items():
+                        halfWidth = metricStatistics.halfWidth(confidence)
+                        writer.writerow([metricName, metricStatistics.count, metricStatistics.missing, metricStatistics.mean, metricStatistics.std(),
+                                         metricStatistics.mean - halfWidth, metricStatistics.mean + halfWidth,
+                                         metricStatistics.relativeHalfWidth(confidence)])
       
       def getRevenue(self, patient):
             """ Calculates the financials of the simulation """
 
             # All patients pay the general urgency fee
-            self.metricsValues["financials_revenue_total"] += self.variables["FINANCIALS"]["FEES"]["generalUrgenceFee"]
+            self.accumulators[REVENUE] += self.parameters.generalFee
             
             if patient["enterHospital"] == "yes":
-                  # Add the appropriate hospital entry fee based on priority
-                  if patient["priority"] == "critical":
-                        self.metricsValues["financials_revenue_total"] += self.variables["FINANCIALS"]["FEES"]["enterHospitalCritical"]
-                  elif patient["priority"] == "urgent":
-                        self.metricsValues["financials_revenue_total"] += self.variables["FINANCIALS"]["FEES"]["enterHospitalUrgent"]
-                  elif patient["priority"] == "moderate":
-                        self.metricsValues["financials_revenue_total"] += self.variables["FINANCIALS"]["FEES"]["enterHospitalModerate"]
-                  elif patient["priority"] == "low":
-                        self.metricsValues["financials_revenue_total"] += self.variables["FINANCIALS"]["FEES"]["enterHospitalLow"]
+                  # Add the hospital entry fee of the priority
+                  self.accumulators[REVENUE] += self.parameters.enterHospitalFee[patient["priority"]]
                   
-                  self.metricsValues["financials_hospital_enterCount"] += 1
+                  self.accumulators[ENTER_COUNT] += 1
+                  self.accumulators[ENTER_BY_PRIORITY + patient["priority"]] += 1
             else:
-                  self.metricsValues["financials_hospital_exitCount"] += 1
+                  self.accumulators[EXIT_COUNT] += 1
+                  self.accumulators[EXIT_BY_PRIORITY + patient["priority"]] += 1
       
       def expenses(self, currentTime):
             """ Calculates the expenses of the simulation """
-            receptionistExpenses = currentTime * self.variables["RESOURCES_CAPACITY"]["receptionist"] * self.variables["FINANCIALS"]["SALARIES"]["receptionistPerMinute"]
-            nurseExpenses = currentTime * self.variables["RESOURCES_CAPACITY"]["nurse"] * self.variables["FINANCIALS"]["SALARIES"]["nursePerMinute"]
-            doctorExpenses = currentTime * self.variables["RESOURCES_CAPACITY"]["doctor"] * self.variables["FINANCIALS"]["SALARIES"]["doctorPerMinute"]
-            
-            self.metricsValues["financials_expenses_total"] = receptionistExpenses + nurseExpenses + doctorExpenses
+            self.accumulators[EXPENSES] = self.parameters.expenses(currentTime)
+            self.accumulators[STAFFED_TIME] = currentTime
       
       ##########################
       ## ACTIVITY SUBROUTINES ##
       ##########################
       def activity_reception(self, patient):
-            if (self.currentReceptionWaitingRoomCapacity > self.variables["RESOURCES_CAPACITY"]["receptionWaitingRoom"]):
-                  self.auxiliaryFunctions.eventPrint(eventStage = "arrival",
-                                               justArrived = True,
-                                               patient_id = patient["id"],
-                                               time = self.env.now,
-                                               otherInfo = "Patient exited prematurely.🚨🚨🚨System is OVERLOADED🚨🚨🚨")
-                  patient["priority"] = "non-urgent"
-                  if (self._isWarmUpOver_()):
-                        self.metricsValues["proportion_totalPatientsDeclinedAccess"] += 1
+            if (self.currentReceptionWaitingRoomCapacity > self.parameters.waitingRoomCapacity):
+                  if self.tracing:
+                        self.auxiliaryFunctions.eventPrint(eventStage = "arrival",
+                                                     justArrived = True,
+                                                     patient_id = patient["id"],
+                                                     time = self.env.now,
+                                                     otherInfo = "Patient exited prematurely.🚨🚨🚨System is OVERLOADED🚨🚨🚨")
+                  patient["priority"] = NON_URGENT
+                  # Declined patients leave the waiting room straight away
+                  self.currentReceptionWaitingRoomCapacity -= 1
+                  self.accumulators[DECLINED] += 1
+                  if patient["journey"] is not None:
+                        patient["journey"].disposition = DECLINED_ACCESS
                   return
             else:
-                  self.auxiliaryFunctions.eventPrint(eventStage = "arrival",
-                                               justArrived = True,
-                                               patient_id = patient["id"],
-                                               time = self.env.now,
-                                               )
+                  if self.tracing:
+                        self.auxiliaryFunctions.eventPrint(eventStage = "arrival",
+                                                     justArrived = True,
+                                                     patient_id = patient["id"],
+                                                     time = self.env.now,
+                                                     )
                   
             def receptionEvaluation():
                   """Stochastic evaluation following a categorical/discrete-probability distribution"""
-                  priorities = {
-                        "critical": self.variables["RECEPTION"]["receptionistAssesment"]["critical"]/100,
-                        "urgent": self.variables["RECEPTION"]["receptionistAssesment"]["urgent"]/100,
-                        "moderate": self.variables["RECEPTION"]["receptionistAssesment"]["moderate"]/100,
-                        "low": self.variables["RECEPTION"]["receptionistAssesment"]["low"]/100,
-                        "non-urgent": self.variables["RECEPTION"]["receptionistAssesment"]["non-urgent"]/100
-                  }
-                  print(f"Priorities of being low is: {self.variables['RECEPTION']['receptionistAssesment']['low']/100}")
-                  return np.random.choice(list(priorities.keys()), p=list(priorities.values()), size=1)[0]
+                  return self.samplers.receptionPriority()
             
             # Requesting resource (appending to queue)
             startReceptionRequestTime = self.env.now
             receptioninstRequest = self.receptionist.request()
             yield receptioninstRequest
-            self.auxiliaryFunctions.eventPrint(eventStage = "reception",
-                                               justArrived = True,
-                                               patient_id = patient["id"],
-                                               time = self.env.now)
-            if (self._isWarmUpOver_()):
-                  self.metricsValues["reception_totalWaitingInQueueTime"] += self.env.now - startReceptionRequestTime
+            if self.tracing:
+                  self.auxiliaryFunctions.eventPrint(eventStage = "reception",
+                                                     justArrived = True,
+                                                     patient_id = patient["id"],
+                                                     time = self.env.now)
+            self.accumulators[RECEPTION_WAITING] += self.env.now - startReceptionRequestTime
+            self.accumulators[RECEPTION_WAITING_SKETCH + sketchBin(self.env.now - startReceptionRequestTime)] += 1
 
             # Service time
             startReceptionServiceTime = self.env.now
-            receptionTime = random.expovariate(1/self.variables["RECEPTION"]["receptionServiceTime"]["mean"])
+            receptionTime = self.samplers.receptionServiceTime()
             # Evaluation of the patient: 
             patient["priority"] = receptionEvaluation()
 
             yield self.env.timeout(receptionTime)
             endReceptionServiceTime = self.env.now
-            if (self._isWarmUpOver_()):
-                  self.metricsValues["reception_totalServiceTime"] += endReceptionServiceTime - startReceptionServiceTime
+            self.accumulators[RECEPTION_SERVICE] += endReceptionServiceTime - startReceptionServiceTime
+            self.accumulators[RECEPTION_SERVICE_SKETCH + sketchBin(endReceptionServiceTime - startReceptionServiceTime)] += 1
+            if patient["priority"] == NON_URGENT:
+                  self.accumulators[LENGTH_OF_STAY_SKETCH + sketchBin(self.env.now - patient["arrival"])] += 1
+            if patient["journey"] is not None:
+                  patient["journey"].receptionStart = startReceptionServiceTime
+                  patient["journey"].receptionEnd = endReceptionServiceTime
+                  patient["journey"].receptionPriority = patient["priority"]
 
             # Releasing resource
             self.receptionist.release(receptioninstRequest)
-            self.auxiliaryFunctions.eventPrint(eventStage = "reception",
-                                               justArrived = False,
-                                               patient_id = patient["id"],
-                                               time = self.env.now,
-                                               otherInfo = f"Classified as {patient['priority']}")
+            if self.tracing:
+                  self.auxiliaryFunctions.eventPrint(eventStage = "reception",
+                                                     justArrived = False,
+                                                     patient_id = patient["id"],
+                                                     time = self.env.now,
+                                                     otherInfo = f"Classified as {PRIORITY_NAMES[patient['priority']]}")
             self.currentReceptionWaitingRoomCapacity -= 1
       
       def activity_nurse(self, patient):
             assert patient["priority"] is not None, "Patient priority must be set before calling nurse activity"
             def nurseEvaluation(currentPriority):
                   """Stochastic evaluation following a categorical/discrete-probability distribution"""
-                  match (currentPriority):
-                        case "moderate":
-                              priorities = {
-                                          "critical": self.variables["NURSE"]["nurseAssesment"]["moderate"]["critical"]/100,
-                                          "urgent": self.variables["NURSE"]["nurseAssesment"]["moderate"]["urgent"]/100,
-                                          "moderate": self.variables["NURSE"]["nurseAssesment"]["moderate"]["moderate"]/100,
-                                          "low": self.variables["NURSE"]["nurseAssesment"]["moderate"]["low"]/100,
-                                          "non-urgent": self.variables["NURSE"]["nurseAssesment"]["moderate"]["non-urgent"]/100
-                                    }
-                              newPriority=  np.random.choice(list(priorities.keys()), p=list(priorities.values()), size=1)[0]
-                              if (self._isWarmUpOver_()):
-                                    self.metricsValues[f"nurse_revaluations_moderate_to{newPriority.capitalize()}"] += 1
-                              return newPriority
-                        case "low":
-                              priorities = {
-                                          "critical": self.variables["NURSE"]["nurseAssesment"]["low"]["critical"]/100,
-                                          "urgent": self.variables["NURSE"]["nurseAssesment"]["low"]["urgent"]/100,
-                                          "moderate": self.variables["NURSE"]["nurseAssesment"]["low"]["moderate"]/100,
-                                          "low": self.variables["NURSE"]["nurseAssesment"]["low"]["low"]/100,
-                                          "non-urgent": self.variables["NURSE"]["nurseAssesment"]["low"]["non-urgent"]/100
-                                    }
-                              print(f"BY NURSE: Priorities of being low is: {self.variables['NURSE']['nurseAssesment']['low']['low']/100}")
-                              newPriority=  np.random.choice(list(priorities.keys()), p=list(priorities.values()), size=1)[0]
-                              if (self._isWarmUpOver_()):
-                                    self.metricsValues[f"nurse_revaluations_low_to{newPriority.capitalize()}"] += 1
-                              return newPriority
-
-            if (self._isWarmUpOver_()):
-                  self.metricsValues["nurse_totalPatients"] += 1
-                  self.metricsValues[f"nurse_totalPatients{patient['priority'].capitalize()}"] += 1
-            
-            self.auxiliaryFunctions.eventPrint(eventStage="nurse",
-                                               justArrived=True,
-                                               patient_id=patient["id"],
-                                               time=self.env.now)
+                  newPriority = self.samplers.nursePriority(currentPriority)
+                  self.accumulators[NURSE_REVALUATIONS + PRIORITY_SLOTS * currentPriority + newPriority] += 1
+                  return newPriority
+
+            self.accumulators[NURSE_TOTAL] += 1
+            self.accumulators[NURSE_PATIENTS + patient["priority"]] += 1
             
-            # Get priority based on patient category
-            priority = self.priority_map.get(patient["priority"]) 
+            if self.tracing:
+                  self.auxiliaryFunctions.eventPrint(eventStage="nurse",
+                                                     justArrived=True,
+                                                     patient_id=patient["id"],
+                                                     time=self.env.now)
             
             # Requesting resource with priority (appending to priority queue)
             startNurseRequestTime = self.env.now
             
-            nurseRequest = self.nurse.request(priority=priority)
+            nurseRequest = self.nurse.request(priority=patient["priority"])
             yield nurseRequest
             
-            # Fix the method name - add trailing underscore
-            if self._isWarmUpOver_():
-                self.metricsValues[f"nurse_totalWaitingInQueueTime{patient['priority'].capitalize()}"] += self.env.now - startNurseRequestTime
+            self.accumulators[NURSE_WAITING + patient["priority"]] += self.env.now - startNurseRequestTime
+            self.accumulators[NURSE_WAITING_SKETCH + SKETCH_BINS * patient["priority"] + sketchBin(self.env.now - startNurseRequestTime)] += 1
 
             # Service time
             startNurseServiceTime = self.env.now
-            nurseTime = random.expovariate(1/self.variables["NURSE"]["nurseServiceTime"][patient["priority"]]["mean"])
+            nurseTime = self.samplers.nurseServiceTime(patient["priority"])
             
             yield self.env.timeout(nurseTime)
             
-            if self._isWarmUpOver_():
-                self.metricsValues[f"nurse_totalServiceTime{patient['priority'].capitalize()}"] += self.env.now - startNurseServiceTime
+            self.accumulators[NURSE_SERVICE + patient["priority"]] += self.env.now - startNurseServiceTime
+            self.accumulators[NURSE_SERVICE_SKETCH + SKETCH_BINS * patient["priority"] + sketchBin(self.env.now - startNurseServiceTime)] += 1
 
             patient["priority"] = nurseEvaluation(patient["priority"])
+            if patient["priority"] == NON_URGENT:
+                  self.accumulators[LENGTH_OF_STAY_SKETCH + sketchBin(self.env.now - patient["arrival"])] += 1
+            if patient["journey"] is not None:
+                  patient["journey"].nurseRequest = startNurseRequestTime
+                  patient["journey"].nurseStart = startNurseServiceTime
+                  patient["journey"].nurseEnd = self.env.now
+                  patient["journey"].nursePriority = patient["priority"]
 
             self.nurse.release(nurseRequest)
 
-            self.auxiliaryFunctions.eventPrint(eventStage="nurse",
-                                               justArrived=False,
-                                               patient_id=patient["id"],
-                                               time=self.env.now,
-                                               otherInfo=f"Classified as {patient['priority']}")
+            if self.tracing:
+                  self.auxiliaryFunctions.eventPrint(eventStage="nurse",
+                                                     justArrived=False,
+                                                     patient_id=patient["id"],
+                                                     time=self.env.now,
+                                                     otherInfo=f"Classified as {PRIORITY_NAMES[patient['priority']]}")
 
       def activity_doctor(self, patient):
             assert patient["priority"] is not None, f"Patient priority must be set before calling doctor activity, current priority: {patient['priority']}"
-            self.auxiliaryFunctions.eventPrint(eventStage="doctor",
-                                               justArrived=True,
-                                               patient_id=patient["id"],
-                                               time=self.env.now)
+            if self.tracing:
+                  self.auxiliaryFunctions.eventPrint(eventStage="doctor",
+                                                     justArrived=True,
+                                                     patient_id=patient["id"],
+                                                     time=self.env.now)
             def doctorEvaluation(currentPriority):
                   """Stochastic evaluation following a categorical/discrete-probability distribution"""
-                  match (currentPriority):
-                        case "critical":
-                              enterHospital = {
-                                          True: self.variables["DOCTOR"]["doctorAssesment"]["critical"]/100,
-                                          False: 1 - self.variables["DOCTOR"]["doctorAssesment"]["critical"]/100
-                                    }
-                              
-                              enterHospital = np.random.choice(list(enterHospital.keys()), p=list(enterHospital.values()), size=1)[0]
-                              if (self._isWarmUpOver_()):
-                                    if (enterHospital):
-                                          self.metricsValues["doctor_assesment_criticalEnterHospitalCount"] += 1
-                              return enterHospital
-                        case "urgent":
-                              enterHospital = {
-                                          True: self.variables["DOCTOR"]["doctorAssesment"]["urgent"]/100,
-                                          False: 1 - self.variables["DOCTOR"]["doctorAssesment"]["urgent"]/100
-                                    }
-                              enterHospital = np.random.choice(list(enterHospital.keys()), p=list(enterHospital.values()), size=1)[0]
-                              if (self._isWarmUpOver_()):
-                                    if (enterHospital):
-                                          self.metricsValues["doctor_assesment_urgentEnterHospitalCount"] += 1
-                              return enterHospital
-                        case "moderate":
-                              enterHospital = {
-                                          True: self.variables["DOCTOR"]["doctorAssesment"]["moderate"]/100,
-                                          False: 1 - self.variables["DOCTOR"]["doctorAssesment"]["moderate"]/100
-                                    }
-                              enterHospital = np.random.choice(list(enterHospital.keys()), p=list(enterHospital.values()), size=1)[0]
-                              if (self._isWarmUpOver_()):
-                                    if (enterHospital):
-                                          self.metricsValues["doctor_assesment_moderateEnterHospitalCount"] += 1
-                              return enterHospital
-                        case "low":
-                              enterHospital = {
-                                          True: self.variables["DOCTOR"]["doctorAssesment"]["low"]/100,
-                                          False: 1 - self.variables["DOCTOR"]["doctorAssesment"]["low"]/100
-                                    }
-                              enterHospital = np.random.choice(list(enterHospital.keys()), p=list(enterHospital.values()), size=1)[0]
-                              if (self._isWarmUpOver_()):
-                                    if (enterHospital):
-                                          self.metricsValues["doctor_assesment_lowEnterHospitalCount"] += 1
-                              return enterHospital
-            if (self._isWarmUpOver_()):
-                  self.metricsValues["doctor_totalPatients"] += 1
-                  self.metricsValues[f"doctor_totalPatients{patient['priority'].capitalize()}"] += 1
-                  self.metricsValues[f"count_total{patient['priority'].capitalize()}Patients"] += 1
-            self.auxiliaryFunctions.eventPrint(eventStage="doctor",
-                                               justArrived=True,
-                                               patient_id=patient["id"],
-                                               time=self.env.now)
-            
-            # Get priority based on patient category
-            priority = self.priority_map.get(patient["priority"]) 
+                  enterHospital = self.samplers.doctorEntersHospital(currentPriority)
+                  if (enterHospital):
+                        self.accumulators[DOCTOR_ENTER + currentPriority] += 1
+                  return enterHospital
+            self.accumulators[DOCTOR_TOTAL] += 1
+            self.accumulators[DOCTOR_PATIENTS + patient["priority"]] += 1
+            self.accumulators[COUNT + patient["priority"]] += 1
+            if self.tracing:
+                  self.auxiliaryFunctions.eventPrint(eventStage="doctor",
+                                                     justArrived=True,
+                                                     patient_id=patient["id"],
+                                                     time=self.env.now)
             
             # Requesting resource with priority (appending to priority queue)
             startDoctorRequestTime = self.env.now
-            doctorRequest = self.doctor.request(priority=priority)
+            doctorRequest = self.doctor.request(priority=patient["priority"])
             yield doctorRequest
-            if (self._isWarmUpOver_()):
-                  self.metricsValues[f"doctor_totalWaitingInQueueTime{patient['priority'].capitalize()}"] += self.env.now - startDoctorRequestTime
+            self.accumulators[DOCTOR_WAITING + patient["priority"]] += self.env.now - startDoctorRequestTime
+            self.accumulators[DOCTOR_WAITING_SKETCH + SKETCH_BINS * patient["priority"] + sketchBin(self.env.now - startDoctorRequestTime)] += 1
 
             # Service time
             startDoctorServiceTime = self.env.now
-            doctorTime = random.expovariate(1/self.variables["DOCTOR"]["doctorServiceTime"][patient["priority"]]["mean"])
+            doctorTime = self.samplers.doctorServiceTime(patient["priority"])
             yield self.env.timeout(doctorTime)
             endDoctorServiceTime = self.env.now
-            if (self._isWarmUpOver_()):
-                  self.metricsValues[f"doctor_totalServiceTime{patient['priority'].capitalize()}"] += endDoctorServiceTime - startDoctorServiceTime
+            self.accumulators[DOCTOR_SERVICE + patient["priority"]] += endDoctorServiceTime - startDoctorServiceTime
+            self.accumulators[DOCTOR_SERVICE_SKETCH + SKETCH_BINS * patient["priority"] + sketchBin(endDoctorServiceTime - startDoctorServiceTime)] += 1
+            self.accumulators[LENGTH_OF_STAY_SKETCH + sketchBin(endDoctorServiceTime - patient["arrival"])] += 1
 
             # Releasing resource
             patient["enterHospital"] = "yes" if doctorEvaluation(patient["priority"]) else "no"
+            if patient["journey"] is not None:
+                  patient["journey"].doctorRequest = startDoctorRequestTime
+                  patient["journey"].doctorStart = startDoctorServiceTime
+                  patient["journey"].doctorEnd = endDoctorServiceTime
+                  patient["journey"].disposition = ADMITTED if patient["enterHospital"] == "yes" else DISCHARGED
+                  self.journeys.record(patient["journey"])
             self.doctor.release(doctorRequest)
 
-            self.auxiliaryFunctions.eventPrint(eventStage="doctor",
-                                               justArrived=False,
-                                               patient_id=patient["id"],
-                                               time=self.env.now)
+            if self.tracing:
+                  self.auxiliaryFunctions.eventPrint(eventStage="doctor",
+                                                     justArrived=False,
+                                                     patient_id=patient["id"],
+                                                     time=self.env.now)
+
+def runReplication(variables: dict, parameters: ModelParameters, replication: int, warmStates: list = None) -> dict:
+      """ Runs one replication on a fresh Simulation (own environment, resources and metrics) of the parameters
+      compiled from variables, forking from one of the warmStates when given """
+      warmState = warmStates[replication % len(warmStates)] if warmStates else None
+      return Simulation(variables, parameters=parameters).__setUp__(replication, warmState)
+
+def runReplicationBlock(variables: dict, parameters: ModelParameters, replications: range, warmStates: list = None) -> list:
+      """ Runs a block of replications one after the other and returns their metrics in order. With the result cache
+      on, only the replications that are not cached are simulated """
+      cache = ResultCache.fromVariables(variables)
+      if cache is None:
+            return [runReplication(variables, parameters, replication, warmStates) for replication in replications]
+      scenarioKey = cache.scenarioKey(variables)
+      results = {replication: cache.get(scenarioKey, replication) for replication in replications}
+      missing = [replication for replication, metrics in results.items() if metrics is None]
+      if missing:
+            for replication in missing:
+                  results[replication] = runReplication(variables, parameters, replication, warmStates)
+                  cache.put(scenarioKey, replication, results[replication])
+      return [results[replication] for replication in replications]
 
 if __name__ == "__main__":
-      simulation = Simulation()
-      simulation.start()
\ No newline at end of file
+      # python simulation.py [parameters.yaml]
+      simulation = Simulation(path=sys.argv[1] if len(sys.argv) > 1 else "paramters.yaml")
+      simulation.start()
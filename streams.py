@@ -0,0 +1,54 @@
+import hashlib
+import json
+import numpy as np
+
+
+# Substreams of a replication that are not part of its measurement (e.g. warm-up pilot runs)
+PILOT = 1
+WARM_UP = 2
+
+# GENERAL_SETTINGS entries that change the simulated model (the rest only control how it is ran)
+MODEL_SETTINGS = ("warmUpPeriod", "totalPatients")
+
+
+def scenarioHash(variables: dict) -> int:
+      """ Stable 64-bit hash of the parameters that define a scenario """
+      scenario = {section: values for section, values in variables.items() if section != "GENERAL_SETTINGS"}
+      scenario["GENERAL_SETTINGS"] = {setting: variables["GENERAL_SETTINGS"][setting] for setting in MODEL_SETTINGS}
+      digest = hashlib.sha256(json.dumps(scenario, sort_keys=True).encode()).digest()
+      return int.from_bytes(digest[:8], "little")
+
+
+class RandomStreams():
+      """ One independent numpy Generator per stochastic source of a replication """
+      SOURCES = (
+            "arrival",
+            "receptionService",
+            "receptionAssesment",
+            "nurseService",
+            "nurseAssesment",
+            "doctorService",
+            "doctorAssesment"
+      )
+
+      def __init__(self,
+                   seed: int,
+                   replication: int,
+                   scenario: int = None,
+                   substream: int = None
+                   ):
+            # With common random numbers (scenario is None) every scenario sees the same streams for a
+            # given replication, so differences between scenarios are not drowned by sampling noise
+            entropy = seed if scenario is None else [seed, scenario]
+            spawnKey = (replication,) if substream is None else (replication, substream)
+            sources = np.random.SeedSequence(entropy, spawn_key=spawnKey).spawn(len(self.SOURCES))
+            for source, seedSequence in zip(self.SOURCES, sources):
+                  setattr(self, source, np.random.default_rng(seedSequence))
+            return None
+
+      @classmethod
+      def fromVariables(cls, variables: dict, replication: int, substream: int = None):
+            """ Builds the streams of a replication from the GENERAL_SETTINGS seed and CRN option """
+            settings = variables["GENERAL_SETTINGS"]
+            scenario = None if settings["commonRandomNumbers"] else scenarioHash(variables)
+            return cls(settings["seed"], replication, scenario, substream)
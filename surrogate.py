@@ -0,0 +1,317 @@
+import sys
+import glob
+import math
+import time
+import itertools
+from statistics import NormalDist
+import numpy as np
+import yaml
+
+from parameters import loadVariables
+from results import readResults
+from sweep import Sweep
+
+
+## SURROGATE MODEL ##
+# A Gaussian process per metric, trained on the scenario means of stored sweep results, maps the inputs (capacities,
+# arrival rate) to the expected metrics and their uncertainty, so what-if queries take microseconds instead of a
+# simulation. The replication noise of every scenario mean is known (variance / replications), so the process
+# models the expected metric and its uncertainty shrinks where scenarios were simulated more. Where the uncertainty
+# is high, refine() simulates new scenarios chosen one at a time as if the earlier ones were already simulated.
+
+# Bounds of the log hyperparameters (inputs are scaled to [0, 1] and metrics standardized)
+LENGTHSCALE_BOUNDS = (math.log(0.05), math.log(20))
+SIGNAL_BOUNDS = (math.log(0.01), math.log(100))
+FIT_ITERATIONS = 200
+# Added to the noise of every scenario mean, so the kernel matrix stays well conditioned
+JITTER = 1e-6
+
+
+def parameterValue(variables: dict, path: str):
+      """ Parameter given by a dotted path (e.g. RESOURCES_CAPACITY.nurse) """
+      node = variables
+      for name in path.split("."):
+            node = node[name]
+      return node
+
+
+def kernel(a: np.ndarray, b: np.ndarray, lengthscales: np.ndarray, signal: float) -> np.ndarray:
+      """ Squared exponential kernel with one lengthscale per input, between the rows of a and of b """
+      distances = (((a[:, None, :] - b[None, :, :]) / lengthscales)**2).sum(axis=2)
+      return signal * np.exp(-0.5 * distances)
+
+
+def logMarginalLikelihood(X: np.ndarray, y: np.ndarray, noise: np.ndarray, logLengthscales: np.ndarray, logSignal: float) -> tuple:
+      """ Log marginal likelihood of y and its gradient with respect to the log lengthscales and log signal variance """
+      lengthscales, signal = np.exp(logLengthscales), math.exp(logSignal)
+      latent = kernel(X, X, lengthscales, signal)
+      cholesky = np.linalg.cholesky(latent + np.diag(noise))
+      alpha = np.linalg.solve(cholesky.T, np.linalg.solve(cholesky, y))
+      inverse = np.linalg.inv(cholesky)
+      inverse = inverse.T @ inverse
+      likelihood = -0.5 * y @ alpha - np.log(np.diag(cholesky)).sum() - 0.5 * len(y) * math.log(2 * math.pi)
+      # d likelihood / d theta = 1/2 tr((alpha alpha' - K^-1) dK / d theta)
+      outer = np.outer(alpha, alpha) - inverse
+      squared = (X[:, None, :] - X[None, :, :])**2 / lengthscales**2
+      gradient = np.append(0.5 * np.einsum("ij,ij,ijd->d", outer, latent, squared), 0.5 * (outer * latent).sum())
+      return likelihood, gradient
+
+
+def fitHyperparameters(X: np.ndarray, y: np.ndarray, noise: np.ndarray) -> tuple:
+      """ Lengthscales and signal variance maximizing the log marginal likelihood, by sign-based gradient ascent
+      (iRprop-) in log space within the bounds """
+      theta = np.append(np.full(X.shape[1], math.log(0.5)), 0.0)
+      lower = np.append(np.full(X.shape[1], LENGTHSCALE_BOUNDS[0]), SIGNAL_BOUNDS[0])
+      upper = np.append(np.full(X.shape[1], LENGTHSCALE_BOUNDS[1]), SIGNAL_BOUNDS[1])
+      steps = np.full(len(theta), 0.1)
+      previous = np.zeros(len(theta))
+      for _ in range(FIT_ITERATIONS):
+            _, gradient = logMarginalLikelihood(X, y, noise, theta[:-1], theta[-1])
+            agreement = gradient * previous
+            steps = np.clip(np.where(agreement > 0, steps * 1.2, np.where(agreement < 0, steps * 0.5, steps)), 1e-6, 1.0)
+            gradient = np.where(agreement < 0, 0.0, gradient)
+            theta = np.clip(theta + np.sign(gradient) * steps, lower, upper)
+            previous = gradient
+      return np.exp(theta[:-1]), math.exp(theta[-1])
+
+
+class Surrogate():
+      """ Gaussian processes of the metrics over the inputs, in stacked arrays (one row per metric): inputs scaled by
+      their bounds, metrics standardized, and the inverse of the kernel matrix of every metric kept so a query is
+      a few matrix-vector products """
+      def __init__(self,
+                   inputs: list,
+                   bounds: np.ndarray,
+                   metrics: list,
+                   X: np.ndarray,
+                   means: np.ndarray,
+                   scales: np.ndarray,
+                   lengthscales: np.ndarray,
+                   signals: np.ndarray,
+                   alphas: np.ndarray,
+                   inverses: np.ndarray,
+                   replicationNoise: np.ndarray
+                   ):
+            self.inputs = inputs
+            self.bounds = bounds # (inputs, 2): low and high
+            self.metrics = metrics
+            self.X = X # scaled training inputs (scenarios, inputs)
+            self.means = means # metric means and standard deviations across the training scenarios
+            self.scales = scales
+            self.lengthscales = lengthscales
+            self.signals = signals
+            self.alphas = alphas # K^-1 y, per metric
+            self.inverses = inverses # K^-1, per metric
+            self.replicationNoise = replicationNoise # pooled variance of one replication, standardized, per metric
+            return None
+
+      @classmethod
+      def fit(cls, inputs: list, bounds: np.ndarray, metrics: list, points: np.ndarray, scenarioMeans: np.ndarray, meanVariances: np.ndarray, replicationVariances: np.ndarray):
+            """ Trains on scenarios: their inputs (points), the means of the metrics over their replications and the
+            variances of those means, NaN where unknown (a single replication) """
+            X = (points - bounds[:, 0]) / (bounds[:, 1] - bounds[:, 0])
+            means = scenarioMeans.mean(axis=0)
+            scales = scenarioMeans.std(axis=0)
+            scales = np.where(scales > 0, scales, 1.0)
+            pooled = np.nanmedian(replicationVariances, axis=0) if not np.isnan(replicationVariances).all() else np.ones(len(metrics))
+            lengthscales, signals, alphas, inverses = [], [], [], []
+            for metric in range(len(metrics)):
+                  y = (scenarioMeans[:, metric] - means[metric]) / scales[metric]
+                  noise = np.where(np.isnan(meanVariances[:, metric]), pooled[metric], meanVariances[:, metric]) / scales[metric]**2 + JITTER
+                  lengthscale, signal = fitHyperparameters(X, y, noise)
+                  inverse = np.linalg.inv(kernel(X, X, lengthscale, signal) + np.diag(noise))
+                  lengthscales.append(lengthscale)
+                  signals.append(signal)
+                  alphas.append(inverse @ y)
+                  inverses.append(inverse)
+            return cls(inputs, bounds, metrics, X, means, scales, np.array(lengthscales), np.array(signals), np.array(alphas),
+                       np.array(inverses), pooled / scales**2)
+
+      def __scaled__(self, points: np.ndarray) -> np.ndarray:
+            return (np.atleast_2d(np.asarray(points, dtype=float)) - self.bounds[:, 0]) / (self.bounds[:, 1] - self.bounds[:, 0])
+
+      def predict(self, points: np.ndarray) -> tuple:
+            """ Means and standard deviations of the expected metrics at points (rows of inputs), as (points, metrics) arrays """
+            X = self.__scaled__(points)
+            means, stds = [], []
+            for metric in range(len(self.metrics)):
+                  crossed = kernel(X, self.X, self.lengthscales[metric], self.signals[metric])
+                  means.append(crossed @ self.alphas[metric])
+                  variance = self.signals[metric] - np.einsum("ij,jk,ik->i", crossed, self.inverses[metric], crossed)
+                  stds.append(np.sqrt(np.maximum(variance, 0)))
+            means, stds = np.array(means).T, np.array(stds).T
+            return self.means + means * self.scales, stds * self.scales
+
+      def query(self, values: dict) -> dict:
+            """ {metric: (mean, std)} at the inputs given as {dotted path: value} """
+            means, stds = self.predict([[values[path] for path in self.inputs]])
+            return {metric: (means[0, index], stds[0, index]) for index, metric in enumerate(self.metrics)}
+
+      def leaveOneOut(self) -> np.ndarray:
+            """ Root mean squared leave-one-out error of every metric, in standard deviations of the metric across the
+            training scenarios (closed form, no refitting) """
+            residuals = self.alphas / np.diagonal(self.inverses, axis1=1, axis2=2)
+            return np.sqrt((residuals**2).mean(axis=1))
+
+      def suggest(self, candidates: np.ndarray, count: int, threshold: float, replications: int) -> list:
+            """ Up to count of the candidates (rows of inputs) whose standardized predictive standard deviation exceeds
+            threshold for some metric, most uncertain first. After each pick, the covariances of the candidates are
+            updated as if it had been simulated with replications, so the picks spread over the uncertain regions """
+            X = self.__scaled__(candidates)
+            covariances = []
+            for metric in range(len(self.metrics)):
+                  crossed = kernel(X, self.X, self.lengthscales[metric], self.signals[metric])
+                  covariances.append(kernel(X, X, self.lengthscales[metric], self.signals[metric]) - crossed @ self.inverses[metric] @ crossed.T)
+            covariances = np.array(covariances)
+            chosen = []
+            for _ in range(count):
+                  uncertainty = np.sqrt(np.maximum(np.diagonal(covariances, axis1=1, axis2=2), 0)).max(axis=0)
+                  uncertainty[chosen] = 0
+                  best = int(uncertainty.argmax())
+                  if uncertainty[best] <= threshold:
+                        break
+                  chosen.append(best)
+                  column = covariances[:, :, best]
+                  noise = covariances[:, best, best] + self.replicationNoise / replications
+                  covariances = covariances - column[:, :, None] * column[:, None, :] / noise[:, None, None]
+            return [candidates[index] for index in chosen]
+
+      def save(self, path: str):
+            np.savez(path, inputs=np.array(self.inputs), bounds=self.bounds, metrics=np.array(self.metrics), X=self.X, means=self.means,
+                     scales=self.scales, lengthscales=self.lengthscales, signals=self.signals, alphas=self.alphas, inverses=self.inverses,
+                     replicationNoise=self.replicationNoise)
+
+      @classmethod
+      def load(cls, path: str):
+            arrays = np.load(path)
+            return cls(arrays["inputs"].tolist(), arrays["bounds"], arrays["metrics"].tolist(), arrays["X"], arrays["means"], arrays["scales"],
+                       arrays["lengthscales"], arrays["signals"], arrays["alphas"], arrays["inverses"], arrays["replicationNoise"])
+
+
+def scenarioStatistics(paths: list, inputs: list, metrics: list, variables: dict) -> tuple:
+      """ Inputs, metric means, variances of the means and variances of one replication of every scenario of the
+      results files at paths (the inputs a file has no column for take their value in variables) """
+      points, means, meanVariances, replicationVariances = [], [], [], []
+      for path in paths:
+            columns = readResults(path, ["scenario", *inputs, *metrics])
+            missing = [metric for metric in metrics if metric not in columns]
+            if missing:
+                  raise ValueError(f"{path} has no {', '.join(missing)} column")
+            rows = len(columns[metrics[0]])
+            scenarios = columns["scenario"].astype(str) if "scenario" in columns else np.zeros(rows, dtype=str)
+            for scenario in dict.fromkeys(scenarios):
+                  rows = scenarios == scenario
+                  point = [columns[path][rows][0] if path in columns else parameterValue(variables, path) for path in inputs]
+                  values = np.array([columns[metric][rows] for metric in metrics], dtype=float).T
+                  count = len(values)
+                  variance = values.var(axis=0, ddof=1) if count > 1 else np.full(len(metrics), np.nan)
+                  points.append([float(value) for value in point])
+                  means.append(values.mean(axis=0))
+                  replicationVariances.append(variance)
+                  meanVariances.append(variance / count)
+      return np.array(points), np.array(means), np.array(meanVariances), np.array(replicationVariances)
+
+
+def candidateGrid(bounds: dict, candidatePoints: int) -> np.ndarray:
+      """ Every combination of the integers between integer bounds and candidatePoints values between other bounds """
+      axes = [np.arange(low, high + 1) if isinstance(low, int) and isinstance(high, int) else np.linspace(low, high, candidatePoints)
+              for low, high in bounds.values()]
+      return np.array(list(itertools.product(*axes)), dtype=float)
+
+
+class SurrogateStudy():
+      """ Surrogate described by a surrogate file: inputs and their bounds, metrics, training results, refinement
+      settings and model path """
+      def __init__(self,
+                   definition: dict,
+                   variables: dict
+                   ):
+            self.definition = definition
+            self.variables = variables
+            self.inputs = list(definition["inputs"])
+            self.bounds = np.array(list(definition["inputs"].values()), dtype=float)
+            self.metrics = definition["metrics"]
+            self.modelPath = definition.get("modelPath", "other/surrogate.npz")
+            return None
+
+      def resultsPaths(self) -> list:
+            return sorted(set(path for pattern in self.definition["resultsPaths"] for path in glob.glob(pattern)))
+
+      def fit(self) -> Surrogate:
+            """ Trains the surrogate on the results and saves it """
+            paths = self.resultsPaths()
+            if not paths:
+                  raise ValueError(f"No results to train on ({', '.join(self.definition['resultsPaths'])})")
+            statistics = scenarioStatistics(paths, self.inputs, self.metrics, self.variables)
+            surrogate = Surrogate.fit(self.inputs, self.bounds, self.metrics, *statistics)
+            surrogate.save(self.modelPath)
+            return surrogate
+
+      def refine(self, rounds: int = 1) -> Surrogate:
+            """ Alternates training and simulating the most uncertain candidates (refineScenarios per round, of
+            refineReplications each, written to refinePath) until no candidate is above uncertaintyThreshold """
+            definition = self.definition
+            candidates = candidateGrid(definition["inputs"], definition.get("candidatePoints", 7))
+            replications = definition.get("refineReplications", 10)
+            surrogate = self.fit()
+            for _ in range(rounds):
+                  points = surrogate.suggest(candidates, definition.get("refineScenarios", 8), definition.get("uncertaintyThreshold", 0.05), replications)
+                  if not points:
+                        print("Every candidate is within uncertaintyThreshold")
+                        break
+                  scenarios = [{path: int(value) if isinstance(bound[0], int) and isinstance(bound[1], int) else float(value)
+                                for (path, bound), value in zip(definition["inputs"].items(), point)} for point in points]
+                  outputPath = self.__refinePath__()
+                  print(f"Simulating {len(scenarios)} scenarios of {replications} replications into {outputPath}")
+                  Sweep(self.variables, scenarios, replications).run(outputPath, format="csv")
+                  surrogate = self.fit()
+            return surrogate
+
+      def __refinePath__(self) -> str:
+            """ First refinePath that does not exist yet """
+            pattern = self.definition.get("refinePath", "other/surrogate_refine_{round}.csv")
+            return next(path for path in (pattern.format(round=round) for round in itertools.count()) if not glob.glob(path))
+
+
+def loadSurrogateStudy(surrogateFilePath: str, variables: dict = None) -> SurrogateStudy:
+      if variables is None:
+            variables = loadVariables()
+      return SurrogateStudy(yaml.load(open(surrogateFilePath), Loader=yaml.FullLoader), variables)
+
+
+def printQuery(surrogate: Surrogate, values: dict, confidence: float):
+      start = time.perf_counter()
+      predictions = surrogate.query(values)
+      elapsed = time.perf_counter() - start
+      z = NormalDist().inv_cdf(0.5 + confidence / 2)
+      outside = [path for path, (low, high) in zip(surrogate.inputs, surrogate.bounds) if not low <= values[path] <= high]
+      print(", ".join(f"{path} = {values[path]}" for path in surrogate.inputs) + (f" (outside the bounds of {', '.join(outside)})" if outside else ""))
+      for metric, (mean, std) in predictions.items():
+            print(f"  {metric:<52} {mean:>12.3f} +- {z * std:.3f}")
+      print(f"  ({elapsed * 1000:.2f} ms)")
+
+
+if __name__ == "__main__":
+      # python surrogate.py fit | refine [rounds] | query nurse=3 doctor=5 arrivalRate=2   (surrogate.yaml, or --file=path)
+      arguments = [argument for argument in sys.argv[1:] if not argument.startswith("--file=")]
+      surrogateFilePath = next((argument.split("=", 1)[1] for argument in sys.argv[1:] if argument.startswith("--file=")), "surrogate.yaml")
+      study = loadSurrogateStudy(surrogateFilePath)
+      match (arguments[0] if arguments else "fit"):
+            case "fit" | "refine" as command:
+                  start = time.perf_counter()
+                  surrogate = study.fit() if command == "fit" else study.refine(int(arguments[1]) if len(arguments) > 1 else 1)
+                  print(f"Surrogate of {len(surrogate.X)} scenarios saved to {study.modelPath} ({time.perf_counter() - start:.2f} s)")
+                  for metric, error in zip(surrogate.metrics, surrogate.leaveOneOut()):
+                        print(f"  {metric:<52} leave-one-out error {error:.3f} std")
+            case "query":
+                  surrogate = Surrogate.load(study.modelPath)
+                  values = {path: float(parameterValue(study.variables, path)) for path in surrogate.inputs}
+                  for argument in arguments[1:]:
+                        name, value = argument.split("=", 1)
+                        matches = [path for path in surrogate.inputs if path == name or path.rsplit(".", 1)[-1] == name]
+                        if not matches:
+                              sys.exit(f"Unknown input: {name} ({', '.join(surrogate.inputs)})")
+                        values[matches[0]] = float(value)
+                  printQuery(surrogate, values, study.variables["GENERAL_SETTINGS"]["confidenceLevel"])
+            case command:
+                  sys.exit(f"Unknown command: {command} (fit | refine [rounds] | query input=value ...)")
@@ -0,0 +1,172 @@
+import os
+import sys
+import copy
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import yaml
+
+from simulation import Simulation, runReplicationBlock
+from warmup import withWarmUp, warmUpSnapshots
+from cache import ResultCache
+from parameters import ModelParameters, loadVariables, validateVariables
+from results import ResultsWriter, resultsPath, columnType
+
+
+def setParameter(variables: dict, path: str, value):
+      """ Sets a parameter given by a dotted path (e.g. RESOURCES_CAPACITY.nurse) in place """
+      *sections, name = path.split(".")
+      node = variables
+      for section in sections:
+            node = node[section]
+      if name not in node:
+            raise KeyError(f"Unknown parameter: {path}")
+      node[name] = value
+
+
+def applyOverrides(variables: dict, overrides: dict) -> dict:
+      """ Copy of variables with the overrides ({dotted path: value}) applied """
+      variables = copy.deepcopy(variables)
+      for path, value in overrides.items():
+            setParameter(variables, path, value)
+      return variables
+
+
+def gridScenarios(grid: dict) -> list:
+      """ Every combination of the values of a grid ({dotted path: [values]}) """
+      return [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())]
+
+
+def runScenarioBlock(scenario: int, variables: dict, parameters: ModelParameters, replications: range, warmStates: list = None):
+      """ Runs a block of replications of a scenario; returns the scenario with the (replication, metrics) pairs """
+      return scenario, list(zip(replications, runReplicationBlock(variables, parameters, replications, warmStates)))
+
+
+def setUpScenario(scenario: int, variables: dict, parameters: ModelParameters) -> tuple:
+      """ Resolves the warm-up of a scenario (MSER-5 pilot runs) and simulates its warm-start snapshots; returns the
+      scenario with its variables and warm states, for its replications to start from """
+      variables = withWarmUp(variables, parameters)
+      warmStates = warmUpSnapshots(variables, parameters) if variables["GENERAL_SETTINGS"]["warmStartRuns"] else None
+      return scenario, variables, warmStates
+
+
+def replicationBlocks(variables: dict, replications: range) -> list:
+      """ Replications run as one task: one by one """
+      return [range(replication, replication + 1) for replication in replications]
+
+
+def runScenarios(replications: dict, scenarioVariables, setUps: dict, workers: int, executor: ProcessPoolExecutor = None):
+      """ Yields the (scenario, [(replication, metrics)]) blocks of the replications of every scenario ({scenario:
+      range}) as they finish. A scenario missing from setUps ({scenario: (variables, parameters, warmStates)}) gets
+      scenarioVariables(scenario) validated and compiled here, once, and is then set up as a task of its own and added
+      to setUps; its blocks, which take the compiled parameters along, are submitted once it is.
+      Runnable blocks go before set-ups, at most workers set-ups and 2 * workers tasks are in flight, so results stream
+      out as soon as the first scenario is set up and memory does not grow with the number of scenarios """
+      def blockTasks(scenario):
+            variables, parameters, warmStates = setUps[scenario]
+            return [(scenario, variables, parameters, block, warmStates) for block in replicationBlocks(variables, replications[scenario])]
+
+      if executor is None:
+            for scenario in replications:
+                  if scenario not in setUps:
+                        variables = scenarioVariables(scenario)
+                        parameters = ModelParameters.fromVariables(variables)
+                        _, variables, warmStates = setUpScenario(scenario, variables, parameters)
+                        setUps[scenario] = (variables, parameters, warmStates)
+                  for task in blockTasks(scenario):
+                        yield runScenarioBlock(*task)
+            return
+
+      runnable = deque(task for scenario in replications if scenario in setUps for task in blockTasks(scenario))
+      waiting = deque(scenario for scenario in replications if scenario not in setUps)
+      inFlight = {} # future: parameters of the scenario it sets up, None for a block
+      while runnable or waiting or inFlight:
+            while len(inFlight) < 2 * workers:
+                  if runnable:
+                        inFlight[executor.submit(runScenarioBlock, *runnable.popleft())] = None
+                  elif waiting and sum(parameters is not None for parameters in inFlight.values()) < workers:
+                        scenario = waiting.popleft()
+                        variables = scenarioVariables(scenario)
+                        parameters = ModelParameters.fromVariables(variables)
+                        inFlight[executor.submit(setUpScenario, scenario, variables, parameters)] = parameters
+                  else:
+                        break
+            done, _ = wait(inFlight, return_when=FIRST_COMPLETED)
+            for future in done:
+                  parameters = inFlight.pop(future)
+                  if parameters is not None:
+                        scenario, variables, warmStates = future.result()
+                        setUps[scenario] = (variables, parameters, warmStates)
+                        runnable.extend(blockTasks(scenario))
+                  else:
+                        yield future.result()
+
+
+class Sweep():
+      """ Runs the replications of many scenarios (overrides of the loaded variables) on a process pool and
+      streams their results, as they finish, into one table keyed by scenario and replication.
+
+      All scenarios use the same replication seeds, so with commonRandomNumbers their differences are not
+      drowned by sampling noise.
+      """
+      def __init__(self,
+                   variables: dict,
+                   scenarios: list,
+                   replications: int = None
+                   ):
+            self.variables = variables
+            self.scenarios = scenarios
+            self.replications = replications or variables["GENERAL_SETTINGS"]["numberOfRuns"]
+            self.parameters = list(dict.fromkeys(path for overrides in scenarios for path in overrides))
+            for overrides in scenarios:
+                  validateVariables(applyOverrides(variables, overrides)) # fails on unknown or invalid parameters before anything runs
+            return None
+
+      def run(self, outputPath: str, workers: int = None, format: str = None):
+            """ Runs the sweep and writes one row per (scenario, replication) to outputPath as soon as it is done, in the
+            given results format (resultsFormat by default); Parquet and Arrow results are partitioned by scenario """
+            settings = self.variables["GENERAL_SETTINGS"]
+            if workers is None:
+                  workers = settings["workers"] or os.cpu_count()
+            format = format or settings["resultsFormat"]
+            metricNames = list(Simulation(self.variables).metrics.keys())
+            types = {"scenario": "int64", "replication": "int64"}
+            for path in self.parameters:
+                  types[path] = columnType([overrides[path] for overrides in self.scenarios if path in overrides])
+
+            with ResultsWriter(resultsPath(outputPath, format), ["scenario", "replication"] + self.parameters + metricNames,
+                               format, settings["resultsBatchSize"], None if format == "csv" else "scenario", types) as writer:
+
+                  def write(scenario, results):
+                        overrides = self.scenarios[scenario]
+                        for replication, metrics in results:
+                              writer.write([scenario, replication] + [overrides.get(path) for path in self.parameters]
+                                           + [metrics[metricName] for metricName in metricNames])
+
+                  # Scenarios are set up (warm-up pilots, warm-start snapshots) on the pool too, not in this process
+                  executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+                  try:
+                        for scenario, results in runScenarios({scenario: range(self.replications) for scenario in range(len(self.scenarios))},
+                                                              lambda scenario: applyOverrides(self.variables, self.scenarios[scenario]), {}, workers, executor):
+                              write(scenario, results)
+                  finally:
+                        if executor is not None:
+                              executor.shutdown(cancel_futures=True)
+
+            cache = ResultCache.fromVariables(self.variables)
+            if cache is not None:
+                  cache.evict()
+
+
+def loadSweep(sweepFilePath: str, variables: dict = None) -> tuple:
+      """ Sweep, output path and results format described by a sweep file (grid or scenarios, replications, outputPath, format) """
+      if variables is None:
+            variables = loadVariables()
+      definition = yaml.load(open(sweepFilePath), Loader=yaml.FullLoader)
+      scenarios = gridScenarios(definition["grid"]) if "grid" in definition else definition["scenarios"]
+      return Sweep(variables, scenarios, definition.get("replications")), definition.get("outputPath", "other/sweep.csv"), definition.get("format")
+
+
+if __name__ == "__main__":
+      sweep, outputPath, format = loadSweep(sys.argv[1] if len(sys.argv) > 1 else "sweep.yaml")
+      sweep.run(outputPath, format=format)
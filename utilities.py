@@ -2,8 +2,20 @@ import simpy as sim
 import colorama
 import random 
 import numpy as np
+from collections import deque
 
 
+# Priority codes: lower values are more important (priority queues, metric buffers and patients use them)
+PRIORITY_MAP = {
+      "critical": 1,
+      "urgent": 2,
+      "moderate": 3,
+      "low": 4,
+      "non-urgent": 5
+}
+PRIORITY_NAMES = {code: priority for priority, code in PRIORITY_MAP.items()}
+CRITICAL, URGENT, MODERATE, LOW, NON_URGENT = PRIORITY_MAP.values()
+
       
 class AuxiliaryFunctions():
       def __init__(self,
@@ -11,6 +23,11 @@ class AuxiliaryFunctions():
                    ):
             self.__stageColors__()
             self.variables = variables
+            # Verbosity levels: silent, summary (one line per replication) or trace (every stage transition)
+            self.verbosity = variables["GENERAL_SETTINGS"]["verbosity"]
+            self.tracing = self.verbosity == "trace"
+            self.traceFile = None
+            self.trace = None
             return None
 
       def __stageColors__(self):
@@ -39,6 +56,40 @@ class AuxiliaryFunctions():
                   "exit": "👋"
             }
       
+      def startTrace(self, replication: int):
+            """ Opens the sink of the trace level. Traces never go to stdout unless the sink is the console """
+            if not self.tracing:
+                  return
+            settings = self.variables["GENERAL_SETTINGS"]
+            match (settings["traceSink"]):
+                  case "file":
+                        self.traceFile = open(settings["traceFilePath"].format(replication=replication), "w", buffering=1 << 20)
+                        self.writeTrace = lambda line: self.traceFile.write(line + "\n")
+                  case "memory":
+                        # Flight recorder: only the last events are kept, and written out when the replication ends or fails
+                        self.trace = deque(maxlen=settings["traceRingSize"])
+                        self.tracePath = settings["traceFilePath"].format(replication=replication)
+                        self.writeTrace = self.trace.append
+                  case "console":
+                        self.writeTrace = print
+                  case _:
+                        raise ValueError(f"Unknown trace sink: {settings['traceSink']}")
+
+      def closeTrace(self):
+            """ Closes the trace file, or writes the ring of the memory sink to traceFilePath """
+            if self.traceFile is not None:
+                  self.traceFile.close()
+                  self.traceFile = None
+            if self.trace is not None:
+                  with open(self.tracePath, "w") as file:
+                        file.writelines(line + "\n" for line in self.trace)
+                  self.trace = None
+
+      def summaryPrint(self, message: str):
+            """ Prints the summary of a replication unless running silent """
+            if self.verbosity != "silent":
+                  print(message)
+
       def eventPrint(self,
                      eventStage: str,
                      justArrived: bool,
@@ -46,8 +97,11 @@ class AuxiliaryFunctions():
                      time: float,
                      otherInfo: str = None
                      ):
+            """ Writes a stage transition to the trace sink. Callers check `tracing` first, so nothing is formatted when it is off """
             indentation = "\t" * self.stageIndentation[eventStage]
+            # Colors are only useful on a terminal
+            color, reset = (self.stageColors[eventStage], colorama.Style.RESET_ALL) if self.writeTrace is print else ("", "")
             if justArrived:
-                  print(f"{indentation}{self.stageEmojis[eventStage]} {self.stageColors[eventStage]} PATIENT {patient_id} -- START {eventStage}{colorama.Style.RESET_ALL}  -- {otherInfo if otherInfo else ''}: entered at {round(time,2)} (clock)")
+                  self.writeTrace(f"{indentation}{self.stageEmojis[eventStage]} {color} PATIENT {patient_id} -- START {eventStage}{reset}  -- {otherInfo if otherInfo else ''}: entered at {round(time,2)} (clock)")
             else:
-                  print(f"{indentation}{self.stageEmojis[eventStage]} {self.stageColors[eventStage]} PATIENT {patient_id} -- END {eventStage}{colorama.Style.RESET_ALL}  -- {otherInfo if otherInfo else ''}: finished at {round(time,2)} (clock)")
\ No newline at end of file
+                  self.writeTrace(f"{indentation}{self.stageEmojis[eventStage]} {color} PATIENT {patient_id} -- END {eventStage}{reset}  -- {otherInfo if otherInfo else ''}: finished at {round(time,2)} (clock)")
@@ -0,0 +1,84 @@
+import copy
+import numpy as np
+
+from engine import HeapEngine
+from metrics import newAccumulators, resetWarmUpMetrics
+from samplers import Samplers
+from parameters import ModelParameters
+from streams import RandomStreams, PILOT, WARM_UP
+
+
+def mser5(series) -> int:
+      """ MSER-5 truncation point: number of leading observations of the series to delete.
+
+      The series is averaged in batches of 5 and the truncation d (in batches, at most half of them) that
+      minimizes the squared standard error of the mean of what is kept, S^2(d) / (n - d), is returned in
+      observations.
+      """
+      observations = np.asarray(series, dtype=float)
+      batches = observations[:len(observations) // 5 * 5].reshape(-1, 5).mean(axis=1)
+      n = len(batches)
+      if n < 2:
+            return 0
+      kept = np.arange(n, 0, -1) # n - d
+      sums = np.cumsum(batches[::-1])[::-1]
+      squares = np.cumsum(batches[::-1] ** 2)[::-1]
+      statistic = (squares - sums ** 2 / kept) / kept ** 2
+      return 5 * int(np.argmin(statistic[:n // 2 + 1]))
+
+
+def patientsInSystemSeries(variables: dict, parameters: ModelParameters, pilot: int, interval: float) -> list:
+      """ Patients in the hospital every interval minutes of a pilot run (fast engine, own substreams),
+      sampled while patients keep arriving """
+      settings = variables["GENERAL_SETTINGS"]
+      streams = RandomStreams.fromVariables(variables, pilot, PILOT)
+      engine = HeapEngine(parameters, newAccumulators(), Samplers(parameters, streams, settings["samplerBlockSize"]))
+      series = []
+      time = 0
+      while engine.calendar and engine.generatedPatients < settings["totalPatients"]:
+            time += interval
+            engine.run(until=time)
+            series.append(engine.patientsInSystem())
+      return series
+
+
+def detectWarmUp(variables: dict, parameters: ModelParameters) -> float:
+      """ Warm-up period (minutes) given by MSER-5 over the average of warmUpPilotRuns pilot series """
+      settings = variables["GENERAL_SETTINGS"]
+      interval = settings["warmUpSampleInterval"]
+      series = [patientsInSystemSeries(variables, parameters, pilot, interval) for pilot in range(settings["warmUpPilotRuns"])]
+      length = min(len(pilotSeries) for pilotSeries in series)
+      average = np.mean([pilotSeries[:length] for pilotSeries in series], axis=0)
+      return mser5(average) * interval
+
+
+def withWarmUp(variables: dict, parameters: ModelParameters) -> dict:
+      """ Variables with the warm-up period to use: warmUpPeriod as is, or the MSER-5 estimate with warmUpDetection: mser5
+      (pilot runs of the parameters compiled from variables) """
+      match (variables["GENERAL_SETTINGS"]["warmUpDetection"]):
+            case "fixed":
+                  return variables
+            case "mser5":
+                  variables = copy.deepcopy(variables)
+                  variables["GENERAL_SETTINGS"]["warmUpPeriod"] = detectWarmUp(variables, parameters)
+                  variables["GENERAL_SETTINGS"]["warmUpDetection"] = "fixed"
+                  return variables
+            case _:
+                  raise ValueError(f"Unknown warm-up detection: {variables['GENERAL_SETTINGS']['warmUpDetection']}")
+
+
+def warmUpSnapshots(variables: dict, parameters: ModelParameters) -> list:
+      """ Engine states at the end of the warm-up of warmStartRuns runs (fast engine, own substreams) of the
+      parameters compiled from variables, for the replications to fork from """
+      settings = variables["GENERAL_SETTINGS"]
+      if settings["engine"] != "fast":
+            raise ValueError(f"Warm-start forks need engine: fast (got {settings['engine']})")
+      snapshots = []
+      for run in range(settings["warmStartRuns"]):
+            streams = RandomStreams.fromVariables(variables, run, WARM_UP)
+            accumulators = newAccumulators()
+            engine = HeapEngine(parameters, accumulators, Samplers(parameters, streams, settings["samplerBlockSize"]))
+            engine.run(until=settings["warmUpPeriod"])
+            resetWarmUpMetrics(accumulators, engine.carryOver(settings["warmUpPeriod"]))
+            snapshots.append(engine.snapshot())
+      return snapshots